@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+""" JSON codecs used by the transports and the RESTful API
+
+A codec encodes an object to str and decodes a str to object. Several backends are
+provided, the fast ones (orjson, ujson) are optional, if the package is not installed,
+the codec falls back to the next one automatically:
+
+    orjson -> ujson -> json (stdlib)
+
+All the codecs support the extra types of januscloud.common.utils:CustomJSONEncoder
+(bytes, datetime, set, __json__, ...). In 'compact' mode, all the codecs output the same text
+for ascii data. The fast codecs only produce the compact separators, so in 'plain' mode their
+output is compact, and in 'indented' mode orjson always indents with 2 spaces.
+"""
+import json
+import logging
+import importlib
+from januscloud.common.utils import CustomJSONEncoder
+
+log = logging.getLogger(__name__)
+
+JSON_CODECS = ('auto', 'json', 'orjson', 'ujson')
+JSON_INDENTS = ('indented', 'plain', 'compact')
+
+_custom_encoder = CustomJSONEncoder()
+
+
+def _custom_default(o):
+    return _custom_encoder.default(o)
+
+
+class StdJSONCodec(object):
+    """ codec based on the json module of python standard library """
+
+    name = 'json'
+
+    def __init__(self, indent='compact', indent_size=3):
+        self.indent = indent
+        if indent == 'indented':
+            self._encoder = CustomJSONEncoder(indent=indent_size)
+        elif indent == 'plain':
+            self._encoder = CustomJSONEncoder(indent=None)
+        else:
+            self._encoder = CustomJSONEncoder(indent=None, separators=(',', ':'))
+        self._decoder = json.JSONDecoder()
+        self.item_separator = self._encoder.item_separator
+
+    def encode(self, o):
+        return self._encoder.encode(o)
+
+    def decode(self, s):
+        return self._decoder.decode(s)
+
+    def dumps(self, o, **kwargs):
+        """ the same as encode(), for the place where a json.dumps() compatible function is
+        required, e.g. the serializer of pyramid JSON renderer. The other arguments are ignored
+        """
+        return self.encode(o)
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, self.indent)
+
+
+class OrJSONCodec(StdJSONCodec):
+    """ codec based on orjson """
+
+    name = 'orjson'
+
+    def __init__(self, indent='compact', indent_size=3):
+        super(OrJSONCodec, self).__init__(indent=indent, indent_size=indent_size)
+        self._orjson = importlib.import_module('orjson')
+        # datetime is passed to CustomJSONEncoder to keep the same format as json codec
+        self._option = self._orjson.OPT_NON_STR_KEYS | self._orjson.OPT_PASSTHROUGH_DATETIME | \
+            self._orjson.OPT_PASSTHROUGH_DATACLASS
+        if indent == 'indented':
+            self._option |= self._orjson.OPT_INDENT_2
+        self.item_separator = ','
+
+    def encode(self, o):
+        return self._orjson.dumps(o, default=_custom_default, option=self._option).decode('utf-8')
+
+    def decode(self, s):
+        return self._orjson.loads(s)
+
+
+class UJSONCodec(StdJSONCodec):
+    """ codec based on ujson """
+
+    name = 'ujson'
+
+    def __init__(self, indent='compact', indent_size=3):
+        super(UJSONCodec, self).__init__(indent=indent, indent_size=indent_size)
+        self._ujson = importlib.import_module('ujson')
+        self._indent = indent_size if indent == 'indented' else 0
+        self.item_separator = ','
+
+    def encode(self, o):
+        return self._ujson.dumps(o, ensure_ascii=True, escape_forward_slashes=False,
+                                 indent=self._indent, default=_custom_default)
+
+    def decode(self, s):
+        return self._ujson.loads(s)
+
+
+_codec_classes = {
+    'json': StdJSONCodec,
+    'orjson': OrJSONCodec,
+    'ujson': UJSONCodec,
+}
+
+_fallback_order = ('orjson', 'ujson', 'json')
+
+_codecs = {}
+
+
+def get_json_codec(codec='auto', indent='compact', indent_size=3):
+    """ get the json codec
+
+    The codecs are shared, the same instance is returned for the same arguments
+
+    :param codec: 'auto', 'json', 'orjson' or 'ujson', 'auto' means the fastest one installed.
+                  If the package of the codec is not installed, fall back to the next one
+    :param indent: 'indented', 'plain' or 'compact'
+    :param indent_size: indent size for 'indented' mode
+    :return: codec instance
+    """
+    key = (codec, indent, indent_size)
+    json_codec = _codecs.get(key)
+    if json_codec is not None:
+        return json_codec
+
+    if codec == 'auto':
+        candidates = _fallback_order
+    elif codec in _codec_classes:
+        candidates = _fallback_order[_fallback_order.index(codec):]
+    else:
+        raise ValueError('Unknown json codec: {}'.format(codec))
+
+    for name in candidates:
+        try:
+            json_codec = _codec_classes[name](indent=indent, indent_size=indent_size)
+            break
+        except ImportError:
+            if codec != 'auto':
+                log.warning('json codec {} is not installed, try the next one'.format(name))
+
+    _codecs[key] = json_codec
+    return json_codec
+
+
+if __name__ == '__main__':
+    # benchmark of encode / decode throughput on the captured videoroom messages
+    import timeit
+    import datetime
+
+    joined = {
+        "janus": "event",
+        "session_id": 3914538396738367,
+        "transaction": "QnvmFQqSxBdk",
+        "sender": 4783920191834783,
+        "plugindata": {
+            "plugin": "janus.plugin.videoroom",
+            "data": {
+                "videoroom": "joined",
+                "room": 1234,
+                "description": "Demo Room",
+                "id": 6985712203347120,
+                "private_id": 3612397584,
+                "publishers": [{
+                    "id": 2316436593893211 + i,
+                    "display": "user-{}".format(i),
+                    "audio_codec": "opus",
+                    "video_codec": "vp8",
+                    "streams": [
+                        {"type": "audio", "mindex": 0, "mid": "0", "codec": "opus", "stereo": False,
+                         "fec": True},
+                        {"type": "video", "mindex": 1, "mid": "1", "codec": "vp8", "simulcast": True,
+                         "svc": False}
+                    ],
+                    "talking": False
+                } for i in range(20)],
+                "attendees": []
+            }
+        }
+    }
+    event = {
+        "janus": "event",
+        "session_id": 3914538396738367,
+        "sender": 4783920191834783,
+        "opaque_id": "videoroomtest-SPQKNAvQ3Hs2",
+        "plugindata": {
+            "plugin": "janus.plugin.videoroom",
+            "data": {
+                "videoroom": "event",
+                "room": 1234,
+                "publishers": [{
+                    "id": 2316436593893211,
+                    "display": "new user",
+                    "streams": [
+                        {"type": "audio", "mindex": 0, "mid": "0", "codec": "opus"},
+                        {"type": "video", "mindex": 1, "mid": "1", "codec": "vp8"}
+                    ]
+                }]
+            }
+        }
+    }
+    custom = {
+        "created": datetime.datetime(2020, 1, 2, 3, 4, 5),
+        "allowed": {"token"},
+        "data": b"abc"
+    }
+
+    for name in ('json', 'orjson', 'ujson'):
+        json_codec = get_json_codec(name, 'compact')
+        if json_codec.name != name:
+            print('{:>8}: not installed'.format(name))
+            continue
+        for msg in (joined, event, custom):
+            assert json_codec.encode(msg) == get_json_codec('json', 'compact').encode(msg)
+
+        for indent in JSON_INDENTS:
+            json_codec = get_json_codec(name, indent)
+            for msg_name, msg in (('joined', joined), ('event', event)):
+                text = json_codec.encode(msg)
+                number = 20000
+                t_enc = timeit.timeit(lambda: json_codec.encode(msg), number=number)
+                t_dec = timeit.timeit(lambda: json_codec.decode(text), number=number)
+                print('{:>8} {:>8} {:>6}: encode {:8.0f} msg/s, decode {:8.0f} msg/s'.format(
+                    name, indent, msg_name, number / t_enc, number / t_dec))
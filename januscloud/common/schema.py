@@ -64,28 +64,47 @@ class And(object):
         assert len(args)
         assert list(kw) in (['error'], [])
         self._error = kw.get('error')
+        self._compiled = None
 
     def __repr__(self):
         return '%s(%s)' % (self.__class__.__name__,
                            ', '.join(repr(a) for a in self._args))
 
+    def compile(self):
+        if self._compiled is None:
+            validators = [_compile(s, self._error) for s in self._args]
+
+            def validate(data):
+                for validate_s in validators:
+                    data = validate_s(data)
+                return data
+            self._compiled = validate
+        return self._compiled
+
     def validate(self, data):
-        for s in [Schema(s, error=self._error) for s in self._args]:
-            data = s.validate(data)
-        return data
+        if self._compiled is None:
+            self.compile()
+        return self._compiled(data)
 
 
 class Or(And):
 
-    def validate(self, data):
-        x = SchemaError([], [])
-        for s in [Schema(s, error=self._error) for s in self._args]:
-            try:
-                return s.validate(data)
-            except SchemaError as _x:
-                x = _x
-        raise SchemaError(['%r did not validate %r' % (self, data)] + x.autos,
-                          [self._error] + x.errors)
+    def compile(self):
+        if self._compiled is None:
+            validators = [_compile(s, self._error) for s in self._args]
+            error = self._error
+
+            def validate(data):
+                x = SchemaError([], [])
+                for validate_s in validators:
+                    try:
+                        return validate_s(data)
+                    except SchemaError as _x:
+                        x = _x
+                raise SchemaError(['%r did not validate %r' % (self, data)] + x.autos,
+                                  [error] + x.errors)
+            self._compiled = validate
+        return self._compiled
 
 
 class EnumVal(object):
@@ -397,95 +416,201 @@ class Schema(object):
     def __init__(self, schema, error=None):
         self._schema = schema
         self._error = error
+        self._compiled = None
 
     def __repr__(self):
         return '%s(%r)' % (self.__class__.__name__, self._schema)
 
+    def compile(self):
+        """ turn the schema tree into a validator closure once, and cache it
+
+        The returned callable behaves exactly the same as validate(), but the
+        key tables of dict schemas are sorted only once and no intermediate
+        Schema wrapper is built for each validation.
+        """
+        if self._compiled is None:
+            self._compiled = _compile(self._schema, self._error)
+        return self._compiled
+
     def validate(self, data):
-        s = self._schema
-        e = self._error
-        if type(s) in (list, tuple, set, frozenset):
-            data = Schema(type(s), error=e).validate(data)
-            return type(s)(Or(*s, error=e).validate(d) for d in data)
-        if type(s) is dict:
-            data = Schema(dict, error=e).validate(data)
-            new = type(data)()
-            x = None
-            coverage = set() # non-optional schema keys that were matched
-            for key, value in data.items():
-                valid = False
-                skey = None
-                must_match = False
-                for skey in sorted(s, key=priority):
-                    svalue = s[skey]
-                    try:
-                        nkey = Schema(skey, error=e).validate(key)
-                        if isinstance(skey, str) or isinstance(skey, Optional) or isinstance(skey, STRING):
-                            must_match = True
-                        try:
-                            nvalue = Schema(svalue, error=e).validate(value)
-                        except SchemaError as _x:
-                            x = _x
-                            raise
-                    except SchemaError:
-                        if must_match:
-                            raise
-                        pass
-                    else:
-                        coverage.add(skey)
-                        valid = True
-                        break
-                if valid:
-                    if not isinstance(skey, AutoDel):
-                        new[nkey] = nvalue
-                elif skey is not None:
-                    if x is not None:
-                        raise SchemaError(['key %r is required' % key] +
-                                          x.autos, [e] + x.errors)
-                    else:
-                        raise SchemaError('invalid key %r' % key, e)
-            required = set(k for k in s if not isinstance(k, Optional))
-            # missed keys
-            if not required.issubset(coverage):
-                raise SchemaError('missed keys %r' % (required - coverage), e)
-                # wrong keys
-            #            if len(new) != len(data):
-            #                raise SchemaError('wrong keys %r in %r' % (new, data), e)
-            # default for optional keys
-            for k in set(s) - required - coverage:
+        if self._compiled is None:
+            self.compile()
+        return self._compiled(data)
+
+
+def _compiled_validate(s):
+    """ return the fastest validate callable of a schema object """
+    validate = type(s).validate
+    if validate is Schema.validate or validate is And.validate or validate is Or.validate:
+        return s.compile()
+    return s.validate
+
+
+def _compile(s, e):
+    """ compile schema s into a closure, which is equal to Schema(s, error=e).validate """
+    if type(s) in (list, tuple, set, frozenset):
+        return _compile_iterable(s, e)
+    if type(s) is dict:
+        return _compile_dict(s, e)
+    if hasattr(s, 'validate'):
+        return _compile_validator(s, e)
+    if type(s) is type:
+        return _compile_type(s, e)
+    if callable(s):
+        return _compile_callable(s, e)
+    return _compile_value(s, e)
+
+
+def _compile_iterable(s, e):
+    container_type = type(s)
+    check_container = _compile_type(container_type, e)
+    validate_item = Or(*s, error=e).compile()
+
+    def validate(data):
+        data = check_container(data)
+        return container_type(validate_item(d) for d in data)
+    return validate
+
+
+def _is_literal_key(skey):
+    # whether the key schema only matches the equal str key and returns itself
+    if type(skey) is str:
+        return True
+    if type(skey) in (Optional, DoNotCare, AutoDel) and type(skey._schema) is str:
+        return True
+    return False
+
+
+def _compile_dict(s, e):
+    check_dict = _compile_type(dict, e)
+
+    # key table pre-sorted by priority,
+    # each entry is (skey, key validator, value validator, must_match, auto_del)
+    table = []
+    literal_index = {}   # literal key str -> position in table
+    for skey in sorted(s, key=priority):
+        entry = (skey,
+                 _compile(skey, e),
+                 _compile(s[skey], e),
+                 isinstance(skey, str) or isinstance(skey, Optional) or isinstance(skey, STRING),
+                 isinstance(skey, AutoDel))
+        if _is_literal_key(skey):
+            literal = skey if type(skey) is str else skey._schema
+            if literal not in literal_index:
+                literal_index[literal] = len(table)
+        table.append(entry)
+    # for each literal position, the non-literal entries which should be tried before it
+    literal_positions = set(literal_index.values())
+    non_literals = [entry for pos, entry in enumerate(table) if pos not in literal_positions]
+    candidates_by_literal = {}
+    for literal, pos in literal_index.items():
+        candidates_by_literal[literal] = [entry for i, entry in enumerate(table[:pos])
+                                          if i not in literal_positions] + [table[pos]]
+
+    required = set(k for k in s if not isinstance(k, Optional))
+    optional = set(s) - required
+
+    def validate(data):
+        data = check_dict(data)
+        new = type(data)()
+        x = None
+        coverage = set()  # non-optional schema keys that were matched
+        for key, value in data.items():
+            if type(key) is str:
+                candidates = candidates_by_literal.get(key, non_literals)
+            else:
+                candidates = table
+            valid = False
+            skey = None
+            for skey, validate_key, validate_value, must_match, auto_del in candidates:
+                try:
+                    nkey = validate_key(key)
+                except SchemaError:
+                    continue
                 try:
-                    new[k.default] = s[k].default
-                except AttributeError:
-                    pass
-            return new
-        if hasattr(s, 'validate'):
+                    nvalue = validate_value(value)
+                except SchemaError as _x:
+                    x = _x
+                    if must_match:
+                        raise
+                    continue
+                coverage.add(skey)
+                valid = True
+                break
+            if valid:
+                if not auto_del:
+                    new[nkey] = nvalue
+            elif table:
+                if x is not None:
+                    raise SchemaError(['key %r is required' % key] +
+                                      x.autos, [e] + x.errors)
+                else:
+                    raise SchemaError('invalid key %r' % key, e)
+        # missed keys
+        if not required.issubset(coverage):
+            raise SchemaError('missed keys %r' % (required - coverage), e)
+        # default for optional keys
+        for k in optional - coverage:
             try:
-                return s.validate(data)
-            except SchemaError as x:
-                raise SchemaError([None] + x.autos, [e] + x.errors)
-            except BaseException as x:
-                raise SchemaError('%r.validate(%r) raised %r' % (s, data, x),
-                                  self._error)
-        if type(s) is type:
-            if isinstance(data, s):
+                new[k.default] = s[k].default
+            except AttributeError:
+                pass
+        return new
+    return validate
+
+
+def _compile_validator(s, e):
+    validate_s = _compiled_validate(s)
+
+    def validate(data):
+        try:
+            return validate_s(data)
+        except SchemaError as x:
+            raise SchemaError([None] + x.autos, [e] + x.errors)
+        except BaseException as x:
+            raise SchemaError('%r.validate(%r) raised %r' % (s, data, x), e)
+    return validate
+
+
+def _compile_type(s, e):
+    if s is object:
+        return _return_data
+
+    def validate(data):
+        if isinstance(data, s):
+            return data
+        else:
+            raise SchemaError('%r should be instance of %r' % (data, s), e)
+    return validate
+
+
+def _compile_callable(s, e):
+
+    def validate(data):
+        f = s.__name__
+        try:
+            if s(data):
                 return data
-            else:
-                raise SchemaError('%r should be instance of %r' % (data, s), e)
-        if callable(s):
-            f = s.__name__
-            try:
-                if s(data):
-                    return data
-            except SchemaError as x:
-                raise SchemaError([None] + x.autos, [e] + x.errors)
-            except BaseException as x:
-                raise SchemaError('%s(%r) raised %r' % (f, data, x),
-                                  self._error)
-            raise SchemaError('%s(%r) should evaluate to True' % (f, data), e)
+        except SchemaError as x:
+            raise SchemaError([None] + x.autos, [e] + x.errors)
+        except BaseException as x:
+            raise SchemaError('%s(%r) raised %r' % (f, data, x), e)
+        raise SchemaError('%s(%r) should evaluate to True' % (f, data), e)
+    return validate
+
+
+def _compile_value(s, e):
+
+    def validate(data):
         if s == data:
-            return s # Jamken: Make sure the return data is absolute the specific value in case of fix value schema
+            return s  # Jamken: Make sure the return data is absolute the specific value in case of fix value schema
         else:
             raise SchemaError('%r does not match %r' % (s, data), e)
+    return validate
+
+
+def _return_data(data):
+    return data
 
 
 class Optional(Schema):
@@ -513,6 +638,30 @@ class Default(Schema):
 
 
 if __name__ == '__main__':
+    # micro benchmark of the validation throughput
+    import time
+
+    def benchmark(name, schema, data, number=20000):
+        schema.validate(data)   # compile first
+        start = time.perf_counter()
+        for i in range(number):
+            schema.validate(data)
+        print('{}: {:.0f} validations/sec'.format(name, number / (time.perf_counter() - start)))
+
+    try:
+        from januscloud.core.request import Request
+        from januscloud.proxy.plugin.videoroom import room_params_schema
+    except ImportError as e:
+        print('skip the benchmark of the real schemas: {}'.format(e))
+    else:
+        benchmark('Request.request_schema', Request.request_schema,
+                  {'janus': 'message', 'transaction': 'abcdefgh1234', 'session_id': 123456789,
+                   'handle_id': 987654321, 'body': {'request': 'join', 'ptype': 'publisher', 'room': 1234}})
+        benchmark('room_params_schema', room_params_schema,
+                  {'room': 1234, 'description': 'Demo Room', 'secret': 'adminpwd', 'publishers': 6,
+                   'bitrate': 128000, 'fir_freq': 10, 'audiocodec': 'opus', 'videocodec': 'vp8,h264',
+                   'record': False, 'request': 'create', 'permanent': False})
+
     # example
     schema = Schema({"key1": STRING,       # key1 should be string
                      "key2": STRING,       # key2 should be int
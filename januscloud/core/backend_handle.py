@@ -4,12 +4,13 @@ import logging
 from januscloud.common.utils import error_to_janus_msg, create_janus_msg, get_monotonic_time, random_uint64
 from januscloud.common.error import JanusCloudError, JANUS_ERROR_INVALID_ELEMENT_TYPE, \
     JANUS_ERROR_PLUGIN_DETACH, JANUS_ERROR_BAD_GATEWAY, JANUS_ERROR_MISSING_MANDATORY_ELEMENT, JANUS_ERROR_INVALID_JSON
-from gevent.queue import Queue
-import gevent
+from gevent.event import AsyncResult
+from januscloud.core.dispatcher import FairDispatcher
 
 log = logging.getLogger(__name__)
 
-stop_message = object()
+# async events of all the backend handles are handled by the shared dispatcher, in order for each handle
+_event_dispatcher = FairDispatcher('backend handle event', max_workers=1024, max_key_queue=1024)
 
 class HandleListener(object):
     def on_async_event(self, handle, event_msg):
@@ -38,8 +39,9 @@ class BackendHandle(object):
         self._has_detach = False
         self._handle_listener = handle_listener
 
-        self._async_event_queue = Queue(maxsize=1024)
-        self._async_event_greenlet = gevent.spawn(self._async_event_handler_routine)
+    def set_handle_listener(self, handle_listener):
+        """ rebind the listener, e.g. when a pre-attached handle is handed out """
+        self._handle_listener = handle_listener
 
     def detach(self):
         """ detach this handle from the session
@@ -52,11 +54,6 @@ class BackendHandle(object):
             return
         self._has_detach = True
 
-        # stop async event greenlet
-        if not self._async_event_queue.full():
-            self._async_event_queue.put(stop_message)
-        self._async_event_greenlet = None
-
         if self._session:
             session = self._session
             self._session = None
@@ -83,6 +80,34 @@ class BackendHandle(object):
 
 
     def send_message(self, body, jsep=None):
+        message = self._create_message(body, jsep)
+        response = self._session.send_request(message)
+        return self._parse_message_response(response)
+
+    def send_message_async(self, body, jsep=None, timeout=30):
+        """ send message without waiting for the response
+
+        :return: gevent.event.AsyncResult object, whose value is (data, reply_jsep) the same as send_message()
+        """
+        message = self._create_message(body, jsep)
+        return _chain_result(self._session.send_request_async(message, timeout=timeout),
+                             self._parse_message_response)
+
+    def send_trickle(self, candidate=None, candidates=None):
+        trickle_msg = self._create_trickle(candidate, candidates)
+        response = self._session.send_request(trickle_msg, ignore_ack=False)
+        self._parse_trickle_response(response)
+
+    def send_trickle_async(self, candidate=None, candidates=None, timeout=30):
+        """ send trickle without waiting for the ack
+
+        :return: gevent.event.AsyncResult object, whose value is None when acked
+        """
+        trickle_msg = self._create_trickle(candidate, candidates)
+        return _chain_result(self._session.send_request_async(trickle_msg, ignore_ack=False, timeout=timeout),
+                             self._parse_trickle_response)
+
+    def _create_message(self, body, jsep=None):
         if self._has_detach:
             raise JanusCloudError('backend handle {} has been destroyed'.format(self.handle_id),
                                   JANUS_ERROR_PLUGIN_DETACH)
@@ -92,8 +117,10 @@ class BackendHandle(object):
         if jsep:
             params['jsep'] = jsep
 
-        message = create_janus_msg('message', handle_id=self.handle_id, **params)
-        response = self._session.send_request(message)
+        return create_janus_msg('message', handle_id=self.handle_id, **params)
+
+    @staticmethod
+    def _parse_message_response(response):
         if response['janus'] == 'event' or response['janus'] == 'success':
             data = response['plugindata']['data']
             reply_jsep = response.get('jsep')
@@ -105,7 +132,7 @@ class BackendHandle(object):
                 'unknown backend response {}'.format(response),
                 JANUS_ERROR_BAD_GATEWAY)
 
-    def send_trickle(self, candidate=None, candidates=None):
+    def _create_trickle(self, candidate=None, candidates=None):
         if self._has_detach:
             raise JanusCloudError('backend handle {} has been destroyed'.format(self.handle_id),
                                   JANUS_ERROR_PLUGIN_DETACH)
@@ -120,8 +147,10 @@ class BackendHandle(object):
             params['candidate'] = candidate
         if candidates:
             params['candidates'] = candidates
-        trickle_msg = create_janus_msg('trickle', handle_id=self.handle_id, **params)
-        response = self._session.send_request(trickle_msg, ignore_ack=False)
+        return create_janus_msg('trickle', handle_id=self.handle_id, **params)
+
+    @staticmethod
+    def _parse_trickle_response(response):
         if response['janus'] == 'ack':
             pass # successful
         elif response['janus'] == 'error':
@@ -147,9 +176,9 @@ class BackendHandle(object):
                 JANUS_ERROR_BAD_GATEWAY)
 
     def on_async_event(self, event_msg):
-        if not self._async_event_queue.full():
-            self._async_event_queue.put(event_msg)
-        else:
+        if self._has_detach:
+            return
+        if not _event_dispatcher.dispatch(self.handle_id, self._handle_async_event, event_msg):
             # drop the event
             log.error("backend handle {} async event queue is full, drop the receiving event".format(self.handle_id))
 
@@ -158,11 +187,6 @@ class BackendHandle(object):
             return
         self._has_detach = True
 
-        # stop async event greenlet
-        if not self._async_event_queue.full():
-            self._async_event_queue.put(stop_message)
-        self._async_event_greenlet = None
-
         self._session = None
 
         if self._handle_listener:
@@ -171,18 +195,29 @@ class BackendHandle(object):
             except Exception:
                 log.exception('on_close() exception for backend handle {}'.format(self.handle_id))
 
-    def _async_event_handler_routine(self):
-        while True:
-            if self._has_detach and self._async_event_queue.empty():
-                break
-            event_msg = self._async_event_queue.get()
-            if event_msg == stop_message:
-                break
-            try:
-                if self._handle_listener:
-                    self._handle_listener.on_async_event(self, event_msg)
-            except Exception:
-                log.exception('Error when handle async event for backend handle {}'.format(self.handle_id))  
+    def _handle_async_event(self, event_msg):
+        try:
+            if self._handle_listener:
+                self._handle_listener.on_async_event(self, event_msg)
+        except Exception:
+            log.exception('Error when handle async event for backend handle {}'.format(self.handle_id))
+
+def _chain_result(async_result, parser):
+    """ return a new AsyncResult which is set with the parsed value of the given one """
+    parsed_result = AsyncResult()
+
+    def on_complete(source):
+        if not source.successful():
+            parsed_result.set_exception(source.exception)
+            return
+        try:
+            parsed_result.set(parser(source.value))
+        except Exception as e:
+            parsed_result.set_exception(e)
+
+    async_result.rawlink(on_complete)
+    return parsed_result
+
 
 if __name__ == '__main__':
 
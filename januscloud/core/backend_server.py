@@ -6,6 +6,7 @@ import importlib
 import gevent
 import random
 import bisect
+from januscloud.core.hash_ring import HashRing
 
 log = logging.getLogger(__name__)
 
@@ -15,6 +16,26 @@ JANUS_SERVER_STATUS_ABNORMAL = 1
 JANUS_SERVER_STATUS_MAINTENANCE = 2
 JANUS_SERVER_STATUS_HWM = 3
 
+SESSION_LOAD_WEIGHT = 2         # a backend session costs as much as so many handles in the load score
+LATENCY_LOAD_SCALE = 0.1        # the load score is doubled for every so many secs of the round trip time
+RTT_SMOOTH_FACTOR = 0.2         # weight of the new sample in the smoothed round trip time
+
+_server_rtt = {}    # server url -> smoothed round trip time in secs
+
+
+def update_server_rtt(server_url, rtt):
+    """ report a round trip time sample of the backend server, e.g. measured by the keepalive """
+    srtt = _server_rtt.get(server_url)
+    if srtt is None:
+        _server_rtt[server_url] = rtt
+    else:
+        _server_rtt[server_url] = srtt + RTT_SMOOTH_FACTOR * (rtt - srtt)
+
+
+def get_server_rtt(server_url):
+    """ get the smoothed round trip time of the backend server, None if not measured yet """
+    return _server_rtt.get(server_url)
+
 
 class BackendServer(object):
     """ This backend session represents a session of the backend Janus server """
@@ -42,18 +63,40 @@ class BackendServerManager(object):
 
     SERVER_EXPIRE_CHECK_INTERVAL = 300
 
-    def __init__(self, select_mode, static_server_list=[], server_dao=None, ):
-
+    def __init__(self, select_mode, static_server_list=[], server_dao=None, ip_location_table=None,
+                 chash_load_bound=1.25):
+        """
+        :param select_mode: algorithm to choose the backend server, 'rr', 'rand', 'lb', 'wr', 'geo', 'chash'
+                            or 'module_name:method_name'
+        :param static_server_list: list of the server config which never expires
+        :param server_dao: DAO of the backend servers
+        :param ip_location_table: januscloud.core.ip_location:IPLocationTable for 'geo' mode
+        :param chash_load_bound: for 'chash' mode, a server loaded above so many times of the average is
+                                 skipped for the next one on the ring, 0 means not bounded
+        """
         self._server_dao = server_dao
         self._rr_index = 0
+        self._inflight = {}     # server name -> [allocations since the last report, utime of the last report]
+        self._ip_location_table = ip_location_table
+        self._chash_load_bound = chash_load_bound
+        self._hash_ring = HashRing(())
+        self._key_algorithm = None      # algorithm for the choice with a key, e.g. room id
         if select_mode == 'rr':
             self._select_algorithm = self._rr_algo
         elif select_mode == 'rand':
             self._select_algorithm = self._rand_algo
         elif select_mode == 'lb':
-            self._select_algorithm = self._rand_algo
+            self._select_algorithm = self._lb_algo
         elif select_mode == 'wr':
             self._select_algorithm = self._wr_algo
+        elif select_mode == 'chash':
+            # the choice without key, e.g. for a handle not belonging to any room, is made as 'lb'
+            self._select_algorithm = self._lb_algo
+            self._key_algorithm = self._chash_algo
+        elif select_mode == 'geo':
+            if ip_location_table is None:
+                log.warning('No IP location table for server_select "geo", the servers are chosen by load only')
+            self._select_algorithm = self._geo_algo
         elif ':' in select_mode:
             module_name, sep, method_name = select_mode.partition(':')
             module = importlib.import_module(module_name)
@@ -86,6 +129,7 @@ class BackendServerManager(object):
         if server:
             log.info('Backend Server {} ({}) is removed from proxy'.format(server.name, server.url))
             self._server_dao.del_by_name(name)
+        self._inflight.pop(name, None)
 
     def get_valid_server_list(self):
         return BackendServerManager.get_valid_servers(self._server_dao)
@@ -141,18 +185,110 @@ class BackendServerManager(object):
         return server_list[index]
 
     def _lb_algo(self, server_dao, session_transport=None):
+        """ power of two choices: pick 2 servers at random, and choose the less loaded one
+
+        Compared to choosing the least loaded one of all, it doesn't make all the proxies rush
+        to the same server between two load reports. No switch happens from getting the server
+        list to counting the allocation, so it's safe for the concurrent greenlets.
+        """
         server_list = BackendServerManager.get_valid_servers(server_dao)
-        target = None
-        for server in server_list:
-            if target is None or server.handle_num < target.handle_num:
-                target = server
+        if len(server_list) == 0:
+            return None
+        return self._choose_less_loaded(server_list)
 
-        target.handle_num += 1
-        server_dao.update(target)
+    def _geo_algo(self, server_dao, session_transport=None):
+        """ prefer the servers of the same location and ISP as the client, then of the same location,
+        then all the servers, and choose one of them as 'lb' does """
+        server_list = BackendServerManager.get_valid_servers(server_dao)
+        if len(server_list) == 0:
+            return None
+        client_location = None
+        if self._ip_location_table is not None and session_transport is not None:
+            client_location = self._ip_location_table.lookup_transport(session_transport)
+        if client_location is not None:
+            location, isp = client_location
+            local_servers = [server for server in server_list if server.location == location]
+            if local_servers:
+                server_list = local_servers
+                if isp:
+                    same_isp_servers = [server for server in local_servers if server.isp == isp]
+                    if same_isp_servers:
+                        server_list = same_isp_servers
+        return self._choose_less_loaded(server_list)
+
+    def _chash_algo(self, server_dao, session_transport=None, key=None, exclude=()):
+        """ consistent hashing with bounded load
+
+        The server of the key is found on the hash ring of the valid servers, so the same key is put
+        on the same server by all the proxies, and only about 1/N of the keys are moved when a
+        server joins or leaves. If the server is excluded or loaded above chash_load_bound times of
+        the average, the next one on the ring is chosen instead.
+        """
+        server_list = BackendServerManager.get_valid_servers(server_dao)
+        if len(server_list) == 0:
+            return None
+        servers = {server.name: server for server in server_list}
+        if self._hash_ring.nodes != servers.keys():
+            self._hash_ring = HashRing(servers.keys())
+        capacity = None
+        if self._chash_load_bound:
+            total_load = sum(self._load(server) for server in server_list)
+            capacity = self._chash_load_bound * total_load / len(server_list) + 1
+        target = None
+        for name in self._hash_ring.iter_nodes(key):
+            if name in exclude:
+                continue
+            if capacity is None or self._load(servers[name]) < capacity:
+                target = servers[name]
+                break
+            if target is None:
+                target = servers[name]      # all overloaded, keep the server of the key
+        if target is None:
+            return None
+        self._inflight_of(target)[0] += 1
+        return target
 
+    def _choose_less_loaded(self, server_list):
+        if len(server_list) == 1:
+            target = server_list[0]
+        else:
+            first, second = random.sample(server_list, 2)
+            if self._load_score(first) <= self._load_score(second):
+                target = first
+            else:
+                target = second
+        self._inflight_of(target)[0] += 1
         return target
 
-    def choose_server(self, transport=None):
+    def _inflight_of(self, server):
+        # the allocations counted since the last report, reset when a new report comes
+        inflight = self._inflight.get(server.name)
+        if inflight is None or inflight[1] != server.utime:
+            inflight = self._inflight[server.name] = [0, server.utime]
+        return inflight
+
+    def _load(self, server):
+        return server.handle_num + server.session_num * SESSION_LOAD_WEIGHT + self._inflight_of(server)[0]
+
+    def _load_score(self, server):
+        load = self._load(server) + 1
+        rtt = _server_rtt.get(server.url)
+        if rtt:
+            load *= 1 + rtt / LATENCY_LOAD_SCALE
+        return load
+
+    def choose_server(self, transport=None, key=None, exclude=()):
+        """ choose a backend server
+
+        :param transport: transport of the client
+        :param key: the choices with the same key (e.g. room id) prefer the same server in 'chash' mode,
+                    ignored by the other modes
+        :param exclude: names of the servers not to be chosen in 'chash' mode, e.g. the ones already
+                        used by the room, ignored by the other modes
+        :return: BackendServer object, None if no server is available
+        """
+        if key is not None and self._key_algorithm is not None:
+            return self._key_algorithm(self._server_dao, transport, key, exclude)
         return self._select_algorithm(self._server_dao, transport)
 
     def _check_expired_routine(self):
@@ -162,6 +298,7 @@ class BackendServerManager(object):
             for server in self._server_dao.get_list():
                 if server.expire and now - server.utime >= server.expire:
                     log.info('Backend Server {} ({}) is removed for expiration '.format(server.name, server.url))
+                    self._inflight.pop(server.name, None)
                     try:
                         self._server_dao.del_by_name(server.name)
                     except Exception as e:
@@ -169,7 +306,83 @@ class BackendServerManager(object):
                         pass
 
 if __name__ == '__main__':
-    pass
+    # simulation of the load imbalance (max / mean handles of the servers) of the select algorithms
+    #
+    # several proxies allocate handles on the shared backend servers, whose load is reported
+    # (as by janus-sentinel) every REPORT_INTERVAL secs, and a handle lives for an exponential
+    # duration. In the second scenario, an empty server joins in the middle of the run. In the
+    # third one, each allocation is a room bringing 1 - 40 handles to the server.
+    import copy
+    import math
+
+    SERVERS = 16
+    PROXIES = 4
+    ARRIVAL_RATE = 200          # handles per sec
+    MEAN_DURATION = 60          # secs
+    REPORT_INTERVAL = 10        # secs
+    STEP = 0.1
+    WARMUP = 300
+    DURATION = 600
+
+    class SimDao(object):
+        def __init__(self):
+            self.reported = []
+
+        def get_list(self):
+            return [copy.copy(server) for server in self.reported]
+
+    def poisson(lam):
+        # Knuth, fine for the small lambda per step
+        threshold = math.exp(-lam)
+        k, p = 0, random.random()
+        while p > threshold:
+            k += 1
+            p *= random.random()
+        return k
+
+    def simulate(select_mode, join_server=False, room_size=1, seed=1):
+        random.seed(seed)
+        names = ['server{}'.format(i) for i in range(SERVERS)]
+        handles = {name: [] for name in names}     # name -> list of end time
+        if join_server:
+            names = names[:-1]                     # the last server joins later
+        dao = SimDao()
+        proxies = [BackendServerManager(select_mode, [], dao) for i in range(PROXIES)]
+        ratios = []
+        now = 0.0
+        next_report = 0.0
+        while now < WARMUP + DURATION:
+            if join_server and now >= WARMUP + DURATION / 2 and len(names) < SERVERS:
+                names.append('server{}'.format(SERVERS - 1))
+            for name in names:
+                handles[name] = [end for end in handles[name] if end > now]
+            if now >= next_report:
+                dao.reported = []
+                for name in names:
+                    server = BackendServer(name, 'ws://' + name, JANUS_SERVER_STATUS_NORMAL,
+                                           handle_num=len(handles[name]), expire=0)
+                    server.utime = now
+                    dao.reported.append(server)
+                next_report += REPORT_INTERVAL
+            for i in range(poisson(ARRIVAL_RATE * STEP / room_size)):
+                server = random.choice(proxies).choose_server()
+                end = now + random.expovariate(1.0 / MEAN_DURATION)
+                handles[server.name].extend([end] * random.randint(1, room_size * 2 - 1))
+            if now >= WARMUP:
+                loads = [len(handles[name]) for name in names]
+                mean = sum(loads) / len(loads)
+                if mean:
+                    ratios.append(max(loads) / mean)
+            now += STEP
+        return sum(ratios) / len(ratios), max(ratios)
+
+    for title, join_server, room_size in (('steady', False, 1), ('a server joins', True, 1),
+                                          ('rooms of 1 - 40 handles', False, 20)):
+        print('{}: {} servers, {} proxies, {} handles/s, {}s mean duration, load reported every {}s'.format(
+            title, SERVERS, PROXIES, ARRIVAL_RATE, MEAN_DURATION, REPORT_INTERVAL))
+        for select_mode in ('rr', 'rand', 'wr', 'lb'):
+            avg_ratio, max_ratio = simulate(select_mode, join_server, room_size)
+            print('    {:>4}: max/mean load avg {:.3f}, worst {:.3f}'.format(select_mode, avg_ratio, max_ratio))
 
 
 
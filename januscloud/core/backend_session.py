@@ -10,9 +10,11 @@ from januscloud.common.schema import Schema, Optional, DoNotCare, \
     FloatVal, AutoDel
 import time
 import gevent
-from gevent.event import Event
+from collections import deque
+from gevent.event import AsyncResult, Event
 from januscloud.transport.ws import WSClient
 from januscloud.core.backend_handle import BackendHandle
+from januscloud.core.backend_server import update_server_rtt
 
 log = logging.getLogger(__name__)
 
@@ -20,23 +22,36 @@ log = logging.getLogger(__name__)
 BACKEND_SESSION_STATE_CREATING = 1
 BACKEND_SESSION_STATE_ACTIVE = 2
 BACKEND_SESSION_STATE_DESTROYED = 3
+BACKEND_SESSION_STATE_RECONNECTING = 4
+
+RECONNECT_BACKOFF_MIN = 0.5
+RECONNECT_BACKOFF_MAX = 5
+RECONNECT_MAX_PENDING_MSG = 1024
 
 
 class BackendTransaction(object):
     def __init__(self, transaction_id, request_msg, url, ignore_ack=True):
         self.transaction_id = transaction_id
         self.request_msg = request_msg
-        self._response_ready = Event()
+        self.async_result = AsyncResult()   # set with the response, or the exception if failed
         self._response = None
         self._ignore_ack = ignore_ack
         self._url = url
 
     def wait_response(self, timeout=None):
-        ready = self._response_ready.wait(timeout=timeout)
-        if not ready:
+        self.async_result.wait(timeout=timeout)
+        if not self.async_result.ready():
             raise JanusCloudError('Request {} Timeout for backend Janus server: {}'.format(self.request_msg, self._url),
                                   JANUS_ERROR_GATEWAY_TIMEOUT)
-        return self._response
+        return self.async_result.get()
+
+    def fail(self, exception):
+        if not self.async_result.ready():
+            self.async_result.set_exception(exception)
+
+    def timeout(self):
+        self.fail(JanusCloudError('Request {} Timeout for backend Janus server: {}'.format(self.request_msg, self._url),
+                                  JANUS_ERROR_GATEWAY_TIMEOUT))
 
     @property
     def response(self):
@@ -48,14 +63,16 @@ class BackendTransaction(object):
         if self._ignore_ack and method == 'ack':
             return   # not consider ack is response
         self._response = response
-        self._response_ready.set()
+        if not self.async_result.ready():
+            self.async_result.set(response)
 
 
 class BackendSession(object):
     """ This backend session represents a session of the backend Janus server """
 
-    def __init__(self, url, auto_destroy=False, api_secret=''):
+    def __init__(self, url, auto_destroy=False, api_secret='', slot=0):
         self.url = url
+        self.slot = slot     # position in the session pool of the backend server
         self._ws_client = None
         self._transactions = {}
         self.session_id = 0
@@ -65,15 +82,25 @@ class BackendSession(object):
         self._auto_destroy_greenlet = None
         self._keepalive_interval = 10
         self._keepalive_greenlet = None
+        self._session_timeout = 30
+        self._reconnect_greenlet = None
+        self._pending_msgs = []    # (message, whether waited by a transaction) sent during reconnecting
+        self._reconnecting_client = None    # the new connection claiming the session during reconnecting
+        self._claim_transaction = None      # the claim transaction in flight on the reconnecting connection
+        self._warm_handles = {}    # plugin package name -> deque of (pre-attached handle, attached time)
+        self._warm_demand = {}     # plugin package name -> last time a handle of the plugin is requested
+        self._warm_greenlet = None
+        self._warm_event = Event()
         self._api_secret = api_secret
-        _sessions[url] = self
+        _get_session_pool(url)[slot] = self
 
     def init(self):
         try:
-            self._ws_client = WSClient(self.url, self._recv_msg_cbk, self._close_cbk, protocols=['janus-protocol'])
+            self._ws_client = self._create_ws_client()
             session_timeout = self._get_session_timeout()
             if session_timeout:
                 self._keepalive_interval = int(session_timeout / 3)
+            self._session_timeout = session_timeout
             self.session_id = self._create_janus_session()
             self.state = BACKEND_SESSION_STATE_ACTIVE
             self._keepalive_greenlet = gevent.spawn(self._keepalive_routine)
@@ -98,6 +125,31 @@ class BackendSession(object):
             raise JanusCloudError('Session has destroy for Janus server: {}'.format(self.url),
                                   JANUS_ERROR_SERVICE_UNAVAILABLE)
 
+        # the pre-attached handles have no opaque id
+        if not _handle_pool_size or opaque_id:
+            return self._attach_handle(plugin_package_name, opaque_id=opaque_id, handle_listener=handle_listener)
+
+        self._warm_demand[plugin_package_name] = get_monotonic_time()
+        handle = self._pop_warm_handle(plugin_package_name)
+        if handle is not None:
+            _handle_pool_stats['hits'] += 1
+            handle.set_handle_listener(handle_listener)
+            if self._auto_destroy_greenlet:
+                gevent.kill(self._auto_destroy_greenlet)
+                self._auto_destroy_greenlet = None
+        else:
+            _handle_pool_stats['misses'] += 1
+            start_time = get_monotonic_time()
+            handle = self._attach_handle(plugin_package_name, handle_listener=handle_listener)
+            _handle_pool_stats['miss_attach_time'] += get_monotonic_time() - start_time
+
+        # refill the pool in background
+        if self._warm_greenlet is None:
+            self._warm_greenlet = gevent.spawn(self._warm_handle_routine)
+        self._warm_event.set()
+        return handle
+
+    def _attach_handle(self, plugin_package_name, opaque_id=None, handle_listener=None):
         attach_request_msg = create_janus_msg('attach', plugin=plugin_package_name)
         if opaque_id:
             attach_request_msg['opaque_id'] = opaque_id
@@ -130,9 +182,61 @@ class BackendSession(object):
     def get_handle(self, handle_id, default=None):
         return self._handles.get(handle_id, default)
 
+    def handle_count(self):
+        """ number of the handles in use, excluding the pre-attached ones """
+        # the warm handles detached by Janus are already removed from _handles
+        warm_num = sum(1 for warm in self._warm_handles.values()
+                       for handle, attached_time in warm if handle.handle_id in self._handles)
+        return len(self._handles) - warm_num
+
     def on_handle_detached(self, handle_id):
         self._handles.pop(handle_id, None)
 
+    def _pop_warm_handle(self, plugin_package_name):
+        warm = self._warm_handles.get(plugin_package_name)
+        now = get_monotonic_time()
+        while warm:
+            handle, attached_time = warm.popleft()
+            if handle.handle_id not in self._handles:
+                continue   # detached by Janus
+            if now - attached_time > _handle_pool_max_idle:
+                handle.detach()
+                continue
+            return handle
+        return None
+
+    def _warm_handle_routine(self):
+        while self.state in (BACKEND_SESSION_STATE_ACTIVE, BACKEND_SESSION_STATE_RECONNECTING):
+            self._warm_event.clear()
+            now = get_monotonic_time()
+            for plugin_package_name, demand_time in list(self._warm_demand.items()):
+                warm = self._warm_handles.setdefault(plugin_package_name, deque())
+
+                # detach the handles idle too long
+                while warm and (now - warm[0][1] > _handle_pool_max_idle or warm[0][0].handle_id not in self._handles):
+                    handle, attached_time = warm.popleft()
+                    handle.detach()
+
+                if now - demand_time > _handle_pool_max_idle:
+                    # no more demand for this plugin, stop keeping the pool
+                    while warm:
+                        handle, attached_time = warm.popleft()
+                        handle.detach()
+                    self._warm_demand.pop(plugin_package_name, None)
+                    self._warm_handles.pop(plugin_package_name, None)
+                    continue
+
+                while len(warm) < _handle_pool_size and self.state == BACKEND_SESSION_STATE_ACTIVE:
+                    try:
+                        handle = self._attach_handle(plugin_package_name)
+                    except Exception as e:
+                        log.warning('Failed to pre-attach handle of {} on Janus server {}: {}'.format(
+                            plugin_package_name, self.url, e))
+                        break
+                    warm.append((handle, get_monotonic_time()))
+            self._warm_event.wait(timeout=max(_handle_pool_max_idle / 2, 1))
+        self._warm_greenlet = None
+
     def async_send_request(self, msg):
         if self.state == BACKEND_SESSION_STATE_DESTROYED:
             raise JanusCloudError('Session has destroy for Janus server: {}'.format(self.url),
@@ -144,10 +248,50 @@ class BackendSession(object):
         if self._api_secret:
             send_msg['apisecret'] = self._api_secret  
         log.debug('Send Async Request {} to Janus server: {}'.format(send_msg, self.url))
-        self._ws_client.send_message(send_msg)              
+        self._send_msg(send_msg)
 
     def send_request(self, msg, ignore_ack=True, timeout=30):
 
+        transaction = self._new_transaction(msg, ignore_ack=ignore_ack)
+        transaction_id = transaction.transaction_id
+        try:
+            self._transactions[transaction_id] = transaction
+            log.debug('Send Request {} to Janus server: {}'.format(transaction.request_msg, self.url))
+            self._send_msg(transaction.request_msg)
+            response = transaction.wait_response(timeout=timeout)
+            log.debug('Receive Response {} from Janus server: {}'.format(response, self.url))
+            return response
+        finally:
+            self._transactions.pop(transaction_id, None)
+
+    def send_request_async(self, msg, ignore_ack=True, timeout=30):
+        """ send the request without waiting for the response
+
+        :param msg: request message
+        :param ignore_ack: if True, the ack message is not regarded as the response
+        :param timeout: timeout in seconds, after which the result is set with the timeout error
+        :return: gevent.event.AsyncResult object, whose value is the response message
+        """
+        transaction = self._new_transaction(msg, ignore_ack=ignore_ack)
+        transaction_id = transaction.transaction_id
+        self._transactions[transaction_id] = transaction
+        try:
+            log.debug('Send Request {} to Janus server: {}'.format(transaction.request_msg, self.url))
+            self._send_msg(transaction.request_msg)
+        except Exception:
+            self._transactions.pop(transaction_id, None)
+            raise
+
+        timeout_greenlet = gevent.spawn_later(timeout, transaction.timeout)
+
+        def on_complete(async_result):
+            self._transactions.pop(transaction_id, None)
+            timeout_greenlet.kill(block=False)
+
+        transaction.async_result.rawlink(on_complete)
+        return transaction.async_result
+
+    def _new_transaction(self, msg, ignore_ack=True):
         if self.state == BACKEND_SESSION_STATE_DESTROYED:
             raise JanusCloudError('Session has destroy for Janus server: {}'.format(self.url),
                                   JANUS_ERROR_SERVICE_UNAVAILABLE)
@@ -158,23 +302,17 @@ class BackendSession(object):
         send_msg['transaction'] = transaction_id
         if self._api_secret:
             send_msg['apisecret'] = self._api_secret
-        transaction = BackendTransaction(transaction_id, send_msg, url=self.url, ignore_ack=ignore_ack)
-        try:
-            self._transactions[transaction_id] = transaction
-            log.debug('Send Request {} to Janus server: {}'.format(send_msg, self.url))
-            self._ws_client.send_message(send_msg)
-            response = transaction.wait_response(timeout=timeout)
-            log.debug('Receive Response {} from Janus server: {}'.format(response, self.url))
-            return response
-        finally:
-            self._transactions.pop(transaction_id, None)
+        return BackendTransaction(transaction_id, send_msg, url=self.url, ignore_ack=ignore_ack)
 
     def destroy(self):
         if self.state == BACKEND_SESSION_STATE_DESTROYED:
             return
         self.state = BACKEND_SESSION_STATE_DESTROYED
-        if _sessions.get(self.url) == self:
-            _sessions.pop(self.url)
+        pool = _sessions.get(self.url)
+        if pool is not None and pool[self.slot] == self:
+            pool[self.slot] = None
+            if not any(pool):
+                _sessions.pop(self.url)
 
         if self._auto_destroy_greenlet:
             gevent.kill(self._auto_destroy_greenlet)
@@ -183,10 +321,23 @@ class BackendSession(object):
         if self._keepalive_greenlet is not None:
             self._keepalive_greenlet = None
 
+        self._reconnect_greenlet = None
+        self._pending_msgs.clear()
+
+        self._warm_handles.clear()
+        self._warm_demand.clear()
+        self._warm_greenlet = None
+        self._warm_event.set()
+
         for handle in self._handles.values():
             handle.on_close()
         self._handles.clear()
 
+        # fail the pending requests at once, instead of waiting for timeout
+        for transaction in list(self._transactions.values()):
+            transaction.fail(JanusCloudError('Session has destroy for Janus server: {}'.format(self.url),
+                                             JANUS_ERROR_SERVICE_UNAVAILABLE))
+
         if self._ws_client:
             try:
                 self._ws_client.close()
@@ -194,12 +345,121 @@ class BackendSession(object):
                 pass
             self._ws_client = None
 
-    def _close_cbk(self):
+    def _create_ws_client(self):
+        ws_client = None
+
+        def close_cbk():
+            self._close_cbk(ws_client)
+
+        ws_client = WSClient(self.url, self._recv_msg_cbk, close_cbk, protocols=['janus-protocol'],
+                             deflate=_ws_deflate)
+        return ws_client
+
+    def _send_msg(self, msg):
+        if self.state == BACKEND_SESSION_STATE_RECONNECTING:
+            # buffer the message until the session is reclaimed, except keepalive, since the session
+            # is kept alive by the claim
+            if msg.get('janus') == 'keepalive' or len(self._pending_msgs) >= RECONNECT_MAX_PENDING_MSG:
+                raise JanusCloudError('Session is reconnecting to Janus server: {}'.format(self.url),
+                                      JANUS_ERROR_SERVICE_UNAVAILABLE)
+            self._pending_msgs.append((msg, msg.get('transaction') in self._transactions))
+        else:
+            self._ws_client.send_message(msg)
+
+    def _close_cbk(self, ws_client=None):
         if self.state == BACKEND_SESSION_STATE_DESTROYED:
             return
+        if ws_client is not self._ws_client:
+            if ws_client is not None and ws_client is self._reconnecting_client and self._claim_transaction:
+                # fail the claim at once, so that the reconnect routine goes on with the next attempt
+                self._claim_transaction.fail(JanusCloudError(
+                    'Connection lost to Janus server: {} during reclaim'.format(self.url),
+                    JANUS_ERROR_SERVICE_UNAVAILABLE))
+            return    # the old connection or the one failed during reconnecting
         log.info('Backend session {} is closed by under network'.format(self.session_id))
         self._ws_client = None
-        self.destroy()
+        if self.state == BACKEND_SESSION_STATE_ACTIVE:
+            # the Janus session is still alive until session timeout, try to reclaim it by a new connection
+            self.state = BACKEND_SESSION_STATE_RECONNECTING
+            # the responses of the requests in flight are lost with the connection
+            for transaction in list(self._transactions.values()):
+                transaction.fail(JanusCloudError('Connection lost to Janus server: {}'.format(self.url),
+                                                 JANUS_ERROR_SERVICE_UNAVAILABLE))
+            self._reconnect_greenlet = gevent.spawn(self._reconnect_routine)
+        else:
+            self.destroy()
+
+    def _reconnect_routine(self):
+        reconnect_timeout = self._session_timeout or 60
+        deadline = get_monotonic_time() + reconnect_timeout
+        backoff = RECONNECT_BACKOFF_MIN
+        while self.state == BACKEND_SESSION_STATE_RECONNECTING and get_monotonic_time() < deadline:
+            gevent.sleep(backoff)
+            if self.state != BACKEND_SESSION_STATE_RECONNECTING:
+                return
+            ws_client = None
+            try:
+                ws_client = self._create_ws_client()
+                claimed = self._claim_janus_session(ws_client, timeout=max(deadline - get_monotonic_time(), 1))
+            except Exception as e:
+                log.warning('Failed to reclaim backend session {} on Janus server {}: {}'.format(
+                    self.session_id, self.url, e))
+                if ws_client:
+                    try:
+                        ws_client.close()
+                    except Exception:
+                        pass
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+                continue
+
+            if not claimed or self.state != BACKEND_SESSION_STATE_RECONNECTING:
+                ws_client.close()
+                break
+            # reclaimed, flush the messages buffered
+            log.info('Backend session {} is reclaimed on Janus server {}'.format(self.session_id, self.url))
+            self._ws_client = ws_client
+            self.state = BACKEND_SESSION_STATE_ACTIVE
+            self._reconnect_greenlet = None
+            pending_msgs = self._pending_msgs
+            self._pending_msgs = []
+            try:
+                for msg, waited in pending_msgs:
+                    if waited and msg['transaction'] not in self._transactions:
+                        # the caller has given up (e.g. timeout), nobody would handle the result
+                        continue
+                    ws_client.send_message(msg)
+            except Exception:
+                log.exception('Failed to send the pending messages to Janus server {}'.format(self.url))
+            return
+
+        if self.state == BACKEND_SESSION_STATE_RECONNECTING:
+            log.info('Backend session {} cannot be reclaimed, destroy it'.format(self.session_id))
+            self.destroy()
+
+    def _claim_janus_session(self, ws_client, timeout=30):
+        """ return True if claimed, False if the session is refused by Janus server (e.g. it has been timeout) """
+        transaction = self._new_transaction(create_janus_msg('claim'))
+        transaction_id = transaction.transaction_id
+        try:
+            self._transactions[transaction_id] = transaction
+            self._reconnecting_client = ws_client
+            self._claim_transaction = transaction
+            ws_client.send_message(transaction.request_msg)
+            response = transaction.wait_response(timeout=timeout)
+        finally:
+            self._transactions.pop(transaction_id, None)
+            self._reconnecting_client = None
+            self._claim_transaction = None
+        if response['janus'] == 'success':
+            return True
+        elif response['janus'] == 'error':
+            log.warning('Claim session error for Janus server {} with reason {}'.format(
+                self.url, response['error']['reason']))
+            return False
+        else:
+            raise JanusCloudError(
+                'Claim session error for Janus server: {} with invalid response {}'.format(self.url, response),
+                JANUS_ERROR_BAD_GATEWAY)
 
 
     def _auto_destroy_routine(self):
@@ -268,35 +528,88 @@ class BackendSession(object):
     def _keepalive_routine(self):
         gevent.sleep(self._keepalive_interval)
         keepalive_msg = create_janus_msg('keepalive')
-        while self.state == BACKEND_SESSION_STATE_ACTIVE:
+        while self.state in (BACKEND_SESSION_STATE_ACTIVE, BACKEND_SESSION_STATE_RECONNECTING):
+            if self.state == BACKEND_SESSION_STATE_RECONNECTING:
+                # the session would be kept alive by claim
+                gevent.sleep(self._keepalive_interval)
+                continue
             try:
                 # if there is no handle existed and auto destroy is enabled, just schedule the destroy route
-                if not self._handles:
+                if self.handle_count() == 0:
                     if self._auto_destroy and self._auto_destroy_greenlet is None:
                         self._auto_destroy_greenlet = gevent.spawn_later(self._auto_destroy, self._auto_destroy_routine)
 
+                start_ts = get_monotonic_time()
                 self.send_request(keepalive_msg, ignore_ack=False)
+                update_server_rtt(self.url, get_monotonic_time() - start_ts)
 
             except Exception as e:
+                if self.state == BACKEND_SESSION_STATE_RECONNECTING:
+                    continue    # connection lost, wait for reconnecting
                 log.exception('Keepalive failed for backend session {}'.format(self.url))
                 self.destroy()
             else:
                 gevent.sleep(self._keepalive_interval)
 
 
-_sessions = {}
+_sessions = {}     # server url -> session pool, which is a list of sessions (None for the empty slot)
 
 _api_secret = ''
 
-def get_cur_sessions():
-    return list(_sessions.values())
+_pool_size = 1
+
+_pool_select = 'least_handles'
+
+_handle_pool_size = 0
 
-def get_backend_session(server_url, auto_destroy=False):
-    session = _sessions.get(server_url)
+_handle_pool_max_idle = 60
+
+_ws_deflate = False
+
+_handle_pool_stats = {
+    'hits': 0,
+    'misses': 0,
+    'miss_attach_time': 0.0,    # total seconds of attaching the handles on the critical path
+}
+
+def get_cur_sessions():
+    return [session for pool in _sessions.values() for session in pool if session is not None]
+
+def _get_session_pool(server_url):
+    pool = _sessions.get(server_url)
+    if pool is None:
+        pool = _sessions[server_url] = [None] * _pool_size
+    return pool
+
+def _select_slot(pool, key=None):
+    if _pool_select == 'hash' and key is not None:
+        return hash(key) % len(pool)
+    # least handles, the empty slot first
+    slot = 0
+    min_handles = None
+    for i, session in enumerate(pool):
+        if session is None:
+            return i
+        if min_handles is None or session.handle_count() < min_handles:
+            slot = i
+            min_handles = session.handle_count()
+    return slot
+
+def get_backend_session(server_url, auto_destroy=False, key=None):
+    """ get a backend session in the session pool of the backend server
+
+    :param server_url: url of the backend Janus server
+    :param auto_destroy: if not 0, the new created session would be destroyed after so many seconds without handles
+    :param key: the sessions with the same key share the same session for hash pool select
+    :return: BackendSession object
+    """
+    pool = _get_session_pool(server_url)
+    slot = _select_slot(pool, key)
+    session = pool[slot]
     if session is None:
         # create new session
         session = \
-            BackendSession(server_url, auto_destroy=auto_destroy, api_secret=_api_secret)
+            BackendSession(server_url, auto_destroy=auto_destroy, api_secret=_api_secret, slot=slot)
         try:
             session.init()
         except Exception as e:
@@ -305,7 +618,8 @@ def get_backend_session(server_url, auto_destroy=False):
                                   .format(server_url, str(e)), JANUS_ERROR_BAD_GATEWAY)
 
     # wait for session init complete
-    while session.state != BACKEND_SESSION_STATE_ACTIVE:
+    # the reconnecting session can be used, the requests on it are buffered until it's reclaimed
+    while session.state != BACKEND_SESSION_STATE_ACTIVE and session.state != BACKEND_SESSION_STATE_RECONNECTING:
         if session.state == BACKEND_SESSION_STATE_CREATING:
             gevent.sleep(0.01)
         elif session.state == BACKEND_SESSION_STATE_DESTROYED:
@@ -314,10 +628,77 @@ def get_backend_session(server_url, auto_destroy=False):
     return session
 
 
+def set_handle_pool(pool_size=0, max_idle=60):
+    """ configure the pool of pre-attached handles for each backend session and plugin
+
+    :param pool_size: how many pre-attached handles are kept for each plugin, 0 means disabled
+    :param max_idle: the pre-attached handle idle for so many seconds would be detached,
+                     and the pool is not kept for the plugin not requested for so many seconds
+    """
+    global _handle_pool_size, _handle_pool_max_idle
+    _handle_pool_size = int(pool_size)
+    _handle_pool_max_idle = max_idle
+
+def get_handle_pool_stats():
+    """ statistics of the pre-attached handle pool """
+    requests = _handle_pool_stats['hits'] + _handle_pool_stats['misses']
+    misses = _handle_pool_stats['misses']
+    return {
+        'pool_size': _handle_pool_size,
+        'max_idle': _handle_pool_max_idle,
+        'warm_handles': sum(len(warm) for session in get_cur_sessions() for warm in session._warm_handles.values()),
+        'hits': _handle_pool_stats['hits'],
+        'misses': misses,
+        'hit_rate': _handle_pool_stats['hits'] / requests if requests else 0.0,
+        # the average latency added to join by the handle attaching on pool miss
+        'avg_miss_attach_ms': _handle_pool_stats['miss_attach_time'] * 1000 / misses if misses else 0.0,
+    }
+
+def gather(async_results, timeout=30, raise_error=True):
+    """ wait for all the async results with a shared deadline
+
+    :param async_results: list of gevent.event.AsyncResult, e.g. returned by BackendSession.send_request_async()
+    :param timeout: the deadline in seconds for all the results
+    :param raise_error: if True, raise the first error of the results, otherwise the exception
+                        takes the place of the value in the returned list
+    :return: list of the values of the results in the same order
+    """
+    deadline = get_monotonic_time() + timeout
+    values = []
+    for async_result in async_results:
+        async_result.wait(timeout=max(deadline - get_monotonic_time(), 0))
+        if not async_result.ready():
+            error = JanusCloudError('Requests Timeout for backend Janus server', JANUS_ERROR_GATEWAY_TIMEOUT)
+            if raise_error:
+                raise error
+            values.append(error)
+        elif async_result.successful():
+            values.append(async_result.value)
+        elif raise_error:
+            raise async_result.exception
+        else:
+            values.append(async_result.exception)
+    return values
+
 def set_api_secret(api_secret):
     global _api_secret
     _api_secret = api_secret
 
+def set_session_pool(pool_size=1, pool_select='least_handles'):
+    """ configure the session pool for each backend server, must be called before any session is created
+
+    :param pool_size: how many backend sessions (websocket connections) for each backend server
+    :param pool_select: how to choose a session in the pool for the new handle, 'least_handles' or 'hash'
+    """
+    global _pool_size, _pool_select
+    _pool_size = max(int(pool_size), 1)
+    _pool_select = pool_select
+
+def set_ws_deflate(deflate=False):
+    """ whether to offer permessage-deflate extension on the websocket connections to the backend servers """
+    global _ws_deflate
+    _ws_deflate = bool(deflate)
+
 if __name__ == '__main__':
     from januscloud.common.logger import test_config
     test_config(debug=True)
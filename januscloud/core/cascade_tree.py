@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+""" Cascade tree of a feed forwarded between the backend servers
+
+The origin publisher is the root, and each remote publisher of the feed on another backend
+server is a node, forwarded by its parent. If every node is forwarded by the root, a feed
+cascaded to N backend servers is sent N times by the backend server of the publisher, so
+the nodes are put in a tree with at most max_fanout children per node instead.
+
+A node is any object with the methods:
+
+    get_children()      the child nodes
+    can_forward()       whether the node is ready to forward the feed to a new child
+    cascade_location()  location of the backend server of the node, '' if unknown
+"""
+from collections import deque
+
+
+def choose_cascade_parent(root, location='', max_fanout=0):
+    """ find the node to forward the feed to a new node
+
+    The shallowest node with less than max_fanout children is chosen, the one with less
+    children for the tie. If location is given, the nodes of the same location are preferred
+    at any depth, so that the feed crosses the locations once and fans out inside.
+
+    :param root: root node of the tree
+    :param location: location of the new node, '' means not biased by location
+    :param max_fanout: max children of a node, 0 means no limit, i.e. all the nodes are the children of the root
+    :return: the parent node, root if none of the nodes can take more children
+    """
+    if max_fanout <= 0:
+        return root
+    parent = None
+    parent_key = None
+    queue = deque([(root, 0)])
+    while queue:
+        node, depth = queue.popleft()
+        children = node.get_children()
+        if len(children) < max_fanout and node.can_forward():
+            key = (bool(location) and node.cascade_location() != location, depth, len(children))
+            if parent_key is None or key < parent_key:
+                parent = node
+                parent_key = key
+        for child in children:
+            queue.append((child, depth + 1))
+    if parent is None:
+        return root
+    return parent
+
+
+def tree_stats(root):
+    """ get (max fan-out, depth, node number) of the tree """
+    max_fanout = 0
+    max_depth = 0
+    node_num = 0
+    queue = deque([(root, 0)])
+    while queue:
+        node, depth = queue.popleft()
+        children = node.get_children()
+        node_num += 1
+        max_fanout = max(max_fanout, len(children))
+        max_depth = max(max_depth, depth)
+        for child in children:
+            queue.append((child, depth + 1))
+    return max_fanout, max_depth, node_num
+
+
+if __name__ == '__main__':
+    # simulate a feed cascaded to many backend servers in a few locations, and the rebalance
+    # after the intermediate nodes are destroyed
+    import random
+
+    class _Node(object):
+        def __init__(self, name, location):
+            self.name = name
+            self.location = location
+            self.parent = None
+            self.children = []
+
+        def get_children(self):
+            return self.children
+
+        def can_forward(self):
+            return True
+
+        def cascade_location(self):
+            return self.location
+
+    def attach(root, node, max_fanout, biased):
+        parent = choose_cascade_parent(root, node.location if biased else '', max_fanout)
+        parent.children.append(node)
+        node.parent = parent
+
+    def cross_location_edges(root):
+        edges = 0
+        queue = deque([root])
+        while queue:
+            node = queue.popleft()
+            for child in node.children:
+                if child.location != node.location:
+                    edges += 1
+                queue.append(child)
+        return edges
+
+    def simulate(backend_num, max_fanout, biased, destroyed_num):
+        rand = random.Random(backend_num)
+        locations = ['loc{}'.format(i) for i in range(4)]
+        root = _Node('origin', locations[0])
+        nodes = [_Node('backend{}'.format(i), rand.choice(locations)) for i in range(backend_num)]
+        for node in nodes:
+            attach(root, node, max_fanout, biased)
+        before = (len(root.children),) + tree_stats(root)[:2] + (cross_location_edges(root),)
+
+        # destroy the intermediate nodes, and re-attach their children to the tree
+        for i in range(destroyed_num):
+            intermediates = [node for node in nodes if node.children]
+            if not intermediates:
+                break
+            node = rand.choice(intermediates)
+            nodes.remove(node)
+            node.parent.children.remove(node)
+            for child in node.children:
+                child.parent = None
+                attach(root, child, max_fanout, biased)
+            node.children = []
+        after = (len(root.children),) + tree_stats(root)[:2] + (cross_location_edges(root),)
+        return before, after
+
+    print('backends fanout biased | origin fan-out, max fan-out, depth, cross-location edges'
+          ' | the same after 5 intermediates destroyed')
+    for backend_num in (8, 20, 50):
+        for max_fanout, biased in ((0, False), (2, False), (4, False), (4, True), (8, True)):
+            before, after = simulate(backend_num, max_fanout, biased, 5)
+            print('{:>8} {:>6} {:>6} | {:>3} {:>3} {:>3} {:>3} | {:>3} {:>3} {:>3} {:>3}'.format(
+                backend_num, max_fanout, str(biased), *(before + after)))
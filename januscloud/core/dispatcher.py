@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from collections import deque
+import gevent
+
+log = logging.getLogger(__name__)
+
+
+class FairDispatcher(object):
+    """ This dispatcher runs the tasks of each key in FIFO order, with a global worker budget
+
+    Each key (e.g. session id) has its own queue, and at most key_concurrency tasks of a key run
+    at the same time, so with the default key_concurrency 1, the tasks of a key run one by one in
+    order. The keys with pending tasks are served round robin, one task per turn, so a key with
+    many tasks cannot starve the others. At most max_workers worker greenlets run the tasks, the
+    tasks beyond are queued instead of blocking the caller.
+    """
+
+    def __init__(self, name, max_workers=1024, key_concurrency=1, max_key_queue=64):
+        self.name = name
+        self._max_workers = max_workers or None
+        self._key_concurrency = key_concurrency
+        self._max_key_queue = max_key_queue
+        self._queues = {}       # key -> deque of pending tasks, only for the keys with pending or running tasks
+        self._running = {}      # key -> number of running tasks
+        self._ready = deque()   # keys which have pending tasks and can run more, in round robin order
+        self._workers = 0
+        self.rejected = 0
+
+    def dispatch(self, key, func, *args):
+        """ dispatch a task
+
+        :param key: hashable key, the tasks with the same key run in order
+        :param func: task callable
+        :param args: arguments of func
+        :return: True if dispatched, False if the queue of the key is full and the task is rejected
+        """
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = deque()
+        elif len(queue) >= self._max_key_queue:
+            self.rejected += 1
+            return False
+        queue.append((func, args))
+        if len(queue) == 1 and self._running.get(key, 0) < self._key_concurrency:
+            self._ready.append(key)
+            self._spawn_worker()
+        return True
+
+    def get_stats(self):
+        return {
+            'name': self.name,
+            'workers': self._workers,
+            'max_workers': self._max_workers or 0,
+            'busy_keys': len(self._queues),
+            'queued_tasks': sum(len(queue) for queue in self._queues.values()),
+            'rejected': self.rejected,
+        }
+
+    def _spawn_worker(self):
+        if self._max_workers is None or self._workers < self._max_workers:
+            self._workers += 1
+            gevent.spawn(self._worker_routine)
+
+    def _worker_routine(self):
+        try:
+            while self._ready:
+                key = self._ready.popleft()
+                queue = self._queues[key]
+                func, args = queue.popleft()
+                running = self._running[key] = self._running.get(key, 0) + 1
+                if queue and running < self._key_concurrency:
+                    # more tasks of this key can run, queue it at the tail for the next turn
+                    self._ready.append(key)
+                    self._spawn_worker()
+                try:
+                    func(*args)
+                except Exception:
+                    log.exception('Error when run task {} in dispatcher {}'.format(func, self.name))
+                finally:
+                    running = self._running[key] - 1
+                    if running:
+                        self._running[key] = running
+                    else:
+                        del self._running[key]
+                    if queue:
+                        if running + 1 >= self._key_concurrency:
+                            # the key was at its concurrency limit, so it is not in the ready list
+                            self._ready.append(key)
+                    elif not running:
+                        del self._queues[key]
+        finally:
+            self._workers -= 1
+
+
+if __name__ == '__main__':
+    # memory footprint of the handles with the per-handle greenlet/queue vs the shared dispatcher
+    import gc
+    import sys
+    import subprocess
+    from gevent.queue import Queue
+
+    def rss_kb():
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+        return 0
+
+    class PerHandleGreenlet(object):
+        """ the former BackendHandle / FrontendHandleBase event machinery """
+        def __init__(self, handle_id):
+            self.handle_id = handle_id
+            self._queue = Queue(maxsize=1024)
+            self._greenlet = gevent.spawn(self._routine)
+
+        def on_event(self, event):
+            self._queue.put(event)
+
+        def _routine(self):
+            while True:
+                event = self._queue.get()
+                if event is None:
+                    return
+
+    dispatcher = FairDispatcher('bench', max_workers=1024, max_key_queue=1024)
+
+    class DispatchedHandle(object):
+        def __init__(self, handle_id):
+            self.handle_id = handle_id
+
+        def on_event(self, event):
+            dispatcher.dispatch(self.handle_id, self._handle_event, event)
+
+        def _handle_event(self, event):
+            pass
+
+    def measure(handle_cls, handle_num):
+        gc.collect()
+        base = rss_kb()
+        handles = [handle_cls(i) for i in range(handle_num)]
+        for handle in handles:
+            handle.on_event('event')
+        gevent.sleep(0.1)     # let all the events be handled
+        gc.collect()
+        used = rss_kb() - base
+        print('{:>18} x {:>6}: {:>8} KB, {:>6.2f} KB per handle'.format(
+            handle_cls.__name__, handle_num, used, used / handle_num))
+
+    if len(sys.argv) > 2:
+        measure(globals()[sys.argv[1]], int(sys.argv[2]))
+    else:
+        # measure in a new process each time, since RSS is not given back after freed
+        for handle_num in (10000, 50000):
+            for handle_cls in (PerHandleGreenlet, DispatchedHandle):
+                subprocess.call([sys.executable, '-m', 'januscloud.core.dispatcher',
+                                 handle_cls.__name__, str(handle_num)])
@@ -3,14 +3,13 @@ import copy
 
 import logging
 import time
-from gevent.queue import Queue
-import gevent
 from januscloud.common.utils import error_to_janus_msg, create_janus_msg
 from januscloud.common.error import JanusCloudError, JANUS_ERROR_UNKNOWN_REQUEST, JANUS_ERROR_PLUGIN_MESSAGE, \
-    JANUS_ERROR_MISSING_REQUEST
+    JANUS_ERROR_MISSING_REQUEST, JANUS_ERROR_SERVICE_UNAVAILABLE
 from januscloud.common.schema import Schema, Optional, DoNotCare, \
     Use, IntVal, Default, SchemaError, BoolVal, StrRe, ListVal, Or, STRING, \
     FloatVal, AutoDel
+from januscloud.core.dispatcher import FairDispatcher
 
 
 log = logging.getLogger(__name__)
@@ -18,7 +17,9 @@ log = logging.getLogger(__name__)
 JANUS_PLUGIN_OK = 0
 JANUS_PLUGIN_OK_WAIT = 1
 
-stop_message = object()
+# async messages of all the frontend handles are handled by the shared dispatcher, in order for each handle.
+# More workers than backend events, because the message handlers would block on backend requests
+_message_dispatcher = FairDispatcher('frontend handle message', max_workers=4096, max_key_queue=1024)
 
 
 class FrontendHandleBase(object):
@@ -33,8 +34,6 @@ class FrontendHandleBase(object):
         self.created = time.time()
 
         self.plugin_package_name = plugin.get_package()
-        self._async_message_queue = Queue(maxsize=1024)
-        self._async_message_greenlet = gevent.spawn(self._async_message_handler_routine)
 
 
     def detach(self):
@@ -43,11 +42,6 @@ class FrontendHandleBase(object):
             return
         self._has_destroy = True
 
-        # stop async message greenlet
-        if not self._async_message_queue.full():
-            self._async_message_queue.put(stop_message)
-        self._async_message_greenlet = None
-
         # send detach event
         event = create_janus_msg('detached', self._session.session_id)
         event['sender'] = self.handle_id
@@ -72,18 +66,17 @@ class FrontendHandleBase(object):
         raise JanusCloudError('hangup not support\'trickle\'', JANUS_ERROR_MISSING_REQUEST)
 
     def _enqueue_async_message(self, transaction, body, jsep=None):
-        self._async_message_queue.put_nowait((transaction, body, jsep))
+        if not _message_dispatcher.dispatch(self.handle_id, self._async_message_task, transaction, body, jsep):
+            raise JanusCloudError('Too many pending messages for handle {}'.format(self.handle_id),
+                                  JANUS_ERROR_SERVICE_UNAVAILABLE)
 
-    def _async_message_handler_routine(self):
-        while not self._has_destroy:
-            msg = self._async_message_queue.get()
-            if self._has_destroy or msg == stop_message:
-                return
-            try:
-                transaction, body, jsep = msg
-                self._handle_async_message(transaction, body, jsep)
-            except Exception:
-                log.exception('Error when handle async message for handle {}'.format(self.handle_id))
+    def _async_message_task(self, transaction, body, jsep):
+        if self._has_destroy:
+            return
+        try:
+            self._handle_async_message(transaction, body, jsep)
+        except Exception:
+            log.exception('Error when handle async message for handle {}'.format(self.handle_id))
 
 
     def _handle_async_message(self, transaction, body, jsep):
@@ -111,6 +104,11 @@ class FrontendHandleBase(object):
             event['opaque_id'] = self.opaque_id
         self._session.notify_event(event)
 
+    def _push_broadcast_event(self, broadcast_msg):
+        if self._has_destroy:
+            return
+        self._session.notify_broadcast_event(broadcast_msg, self.handle_id, self.opaque_id)
+
 
 
 
@@ -9,25 +9,59 @@ from januscloud.common.schema import Schema, Optional, DoNotCare, \
     FloatVal, AutoDel
 import time
 import gevent
+from gevent.pool import Pool
+from gevent.queue import Queue
+from collections import deque
 import sys
 
 from januscloud.core.plugin_base import get_plugin
+from januscloud.core.timing_wheel import TimingWheel
 
 log = logging.getLogger(__name__)
 
 
 TIMEOUT_CHECK_INTERVAL  =  2
+TRANSPORT_GONE_TEARDOWN_CONCURRENCY = 64    # max number of transport-gone sessions destroyed at the same time
+HANDLE_TEARDOWN_CONCURRENCY = 8     # max number of handles detached at the same time on session destroy
+HANDLE_TEARDOWN_TIMEOUT = 10        # secs to wait for the handles detached on session destroy
+HANDLE_REAP_TIMEOUT = 60            # secs for the reaper to wait for the slow detaches before killing them
+
+
+_reaper_queue = Queue()
+_reaper_greenlet = None
+
+
+def _reap_detach_workers(session_id, workers):
+    """ hand over the detach workers not finished in time to the reaper, so the caller never waits on them """
+    global _reaper_greenlet
+    _reaper_queue.put((session_id, workers, get_monotonic_time() + HANDLE_REAP_TIMEOUT))
+    if _reaper_greenlet is None:
+        _reaper_greenlet = gevent.spawn(_reaper_routine)
+
+
+def _reaper_routine():
+    while True:
+        session_id, workers, deadline = _reaper_queue.get()
+        gevent.joinall(workers, timeout=max(deadline - get_monotonic_time(), 0))
+        stuck_workers = [worker for worker in workers if not worker.ready()]
+        if stuck_workers:
+            log.error('Handles detach of session {} is still blocked after {} secs, killed'.format(
+                session_id, HANDLE_TEARDOWN_TIMEOUT + HANDLE_REAP_TIMEOUT))
+            gevent.killall(stuck_workers, block=False)
 
 
 class FrontendSession(object):
     """ This frontend session represents a Janus session  """
 
-    def __init__(self, session_id, transport=None):
+    def __init__(self, session_id, transport=None, timeout_wheel=None):
         self.session_id = session_id
         self.ts = transport
         self._handles = {}
+        self._timeout_wheel = timeout_wheel
         self.last_activity = get_monotonic_time()
         self._has_destroyed = False
+        if timeout_wheel is not None:
+            timeout_wheel.add(session_id, self)
 
     def notify_event(self, event):
         try:
@@ -37,6 +71,15 @@ class FrontendSession(object):
         except Exception as e:
             log.debug('Failed to send backe Asynchronous event ({}) on session (id:{}): {}, Ignore'.format(event, self.session_id, e))
 
+    def notify_broadcast_event(self, broadcast_msg, sender=None, opaque_id=None):
+        """ notify an event broadcast to many sessions, whose common part is only encoded once by transport """
+        try:
+            if self.ts:
+                self.ts.send_broadcast_message(broadcast_msg, self.session_id, sender, opaque_id)
+        except Exception as e:
+            log.debug('Failed to send back broadcast event ({}) on session (id:{}): {}, Ignore'.format(
+                broadcast_msg.method, self.session_id, e))
+
     def destroy(self):
         """ destroy the session
 
@@ -49,17 +92,35 @@ class FrontendSession(object):
         else:
             self._has_destroyed = True
 
+        if self._timeout_wheel is not None:
+            self._timeout_wheel.remove(self.session_id)
         self.ts = None
-        detach_handles = self._handles
+        detach_handles = deque(self._handles.values())
         self._handles = {}
 
-        # detach all handles on it
-        for handle in detach_handles.values():
-            handle.detach()       # would result into IO block
-        detach_handles.clear()
+        # detach all handles on it, which would result into IO block, so the handles
+        # are detached by a few workers concurrently, and the ones not finished
+        # within HANDLE_TEARDOWN_TIMEOUT are left to the reaper
+        if detach_handles:
+            workers = [gevent.spawn(self._detach_handles_routine, detach_handles)
+                       for i in range(min(len(detach_handles), HANDLE_TEARDOWN_CONCURRENCY))]
+            gevent.joinall(workers, timeout=HANDLE_TEARDOWN_TIMEOUT)
+            pending_workers = [worker for worker in workers if not worker.ready()]
+            if pending_workers:
+                log.warning('session: {} has {} handles still detaching after {} secs, left to the reaper'.format(
+                    self.session_id, len(detach_handles) + len(pending_workers), HANDLE_TEARDOWN_TIMEOUT))
+                _reap_detach_workers(self.session_id, pending_workers)
 
         log.info('session: {} has destroyed '.format(self.session_id))
 
+    def _detach_handles_routine(self, detach_handles):
+        while detach_handles:
+            handle = detach_handles.popleft()
+            try:
+                handle.detach()
+            except Exception:
+                log.exception('Failed to detach handle {} of session {}'.format(handle.handle_id, self.session_id))
+
     def transport_claim(self, new_transport):
         if self.ts:
             self.ts.session_over(self.session_id, False, True)
@@ -71,6 +132,8 @@ class FrontendSession(object):
 
     def activate(self):
         self.last_activity = get_monotonic_time()
+        if self._timeout_wheel is not None and not self._has_destroyed:
+            self._timeout_wheel.add(self.session_id, self)
 
     def attach_handle(self, plugin, opaque_id=None):
         if self._has_destroyed:
@@ -97,9 +160,15 @@ class FrontendSessionManager(object):
 
     def __init__(self, session_timeout):
         self._sessions = {}
+        self._transport_sessions = {}    # transport -> set of the id of the sessions on it
+        self._teardown_pool = Pool(TRANSPORT_GONE_TEARDOWN_CONCURRENCY)
         self._session_timeout = session_timeout
         self._started = True
-        self.check_greenlet = gevent.spawn(self._check_session_timeout_routine)
+        self._timeout_wheel = None
+        if session_timeout > 0:
+            # session timeout check is enable
+            self._timeout_wheel = TimingWheel('session_timeout', session_timeout,
+                                              self._on_sessions_timeout, tick=TIMEOUT_CHECK_INTERVAL)
 
     def create_new_session(self, session_id=0, transport=None):
         if session_id == 0:
@@ -108,9 +177,10 @@ class FrontendSessionManager(object):
                 session_id = random_uint64()
         if session_id in self._sessions:
             raise JanusCloudError('Session ID already in use', JANUS_ERROR_SESSION_CONFLICT)
-        session = FrontendSession(session_id, transport)
+        session = FrontendSession(session_id, transport, self._timeout_wheel)
         self._sessions[session_id] = session
         if transport:
+            self._add_transport_session(transport, session_id)
             transport.session_created(session_id)
 
         log.info('Creating new session: {} '.format(session_id))
@@ -130,51 +200,71 @@ class FrontendSessionManager(object):
             log.error("Couldn't find any session {}".format(session_id))
             raise JanusCloudError('No such session {}'.format(session_id), JANUS_ERROR_SESSION_NOT_FOUND)
         transport = session.ts
+        if transport:
+            self._remove_transport_session(transport, session_id)
         session.destroy()
         if transport:
             transport.session_over(session_id, False, False)
 
+    def transport_claim(self, session, new_transport):
+        old_transport = session.ts
+        session.transport_claim(new_transport)
+        if old_transport:
+            self._remove_transport_session(old_transport, session.session_id)
+        self._add_transport_session(new_transport, session.session_id)
+
     def transport_gone(self, transport):
+        session_ids = self._transport_sessions.pop(transport, ())
         gone_sessions = []
-        for session in self._sessions.values():
-            if session.ts == transport:
+        for session_id in session_ids:
+            session = self._sessions.get(session_id)
+            if session is not None and session.ts == transport:
                 # destroy the session because of the underlayer transport session is gone
+                log.debug('  -- Session "{}" will be over for transport gone '.format(session_id))
+                self._sessions.pop(session_id, None)
                 gone_sessions.append(session)
+
+        # destroy() blocks on the backend IO, so the sessions are destroyed concurrently,
+        # and the spawn blocks when too many sessions are being destroyed
         for session in gone_sessions:
-                log.debug('  -- Session "{}" will be over for transport gone '.format(session.session_id))
-                self._sessions.pop(session.session_id, None)
-        for session in gone_sessions:
-            session_id = session.session_id
+            self._teardown_pool.spawn(self._destroy_gone_session, session)
+
+    def _add_transport_session(self, transport, session_id):
+        session_ids = self._transport_sessions.get(transport)
+        if session_ids is None:
+            session_ids = self._transport_sessions[transport] = set()
+        session_ids.add(session_id)
+
+    def _remove_transport_session(self, transport, session_id):
+        session_ids = self._transport_sessions.get(transport)
+        if session_ids is not None:
+            session_ids.discard(session_id)
+            if not session_ids:
+                del self._transport_sessions[transport]
+
+    @staticmethod
+    def _destroy_gone_session(session):
+        try:
+            session.destroy()
+        except Exception as e:
+            log.exception('Failed to destroy transport-gone session "{}"'.format(session.session_id))
+
+    def _on_sessions_timeout(self, expired_sessions):
+        # called by the timing wheel with the sessions which are not activated within session timeout
+        timeout_sessions = []
+        for session in expired_sessions:
+            if self._sessions.get(session.session_id) is session:
+                self._sessions.pop(session.session_id, None)  # avoid future usage
+                if session.ts:
+                    self._remove_transport_session(session.ts, session.session_id)
+                timeout_sessions.append(session)
+
+        # kick out all timeout session
+        for session in timeout_sessions:
             try:
-                session.destroy()
+                self._kick_timeout_sessions(session)
             except Exception as e:
-                log.exception('Failed to destroy transport-gone session "{}"'.format(session_id))
-
-    def _check_session_timeout_routine(self):
-        while True:
-            if self._session_timeout > 0:
-                # session timeout check is enable
-                now = get_monotonic_time()
-                timeout_sessions = []
-                for session in self._sessions.values():
-                    if now - session.last_activity > self._session_timeout:
-                        timeout_sessions.append(session)
-                for session in timeout_sessions:
-                    self._sessions.pop(session.session_id, None)  # avoid future usage
-
-                # kick out all timeout session
-                for session in timeout_sessions:
-                    try:
-                        self._kick_timeout_sessions(session)
-                    except Exception as e:
-                        log.exception('Failed to kick out the timeout session "{}"'.format(session.session_id))
-                timeout_sessions.clear()
-                delta_time = get_monotonic_time() - now
-                if delta_time < TIMEOUT_CHECK_INTERVAL:
-                    gevent.sleep(TIMEOUT_CHECK_INTERVAL - delta_time)
-            else:
-                # session timeout check is disable, just None loop
-                gevent.sleep(TIMEOUT_CHECK_INTERVAL)
+                log.exception('Failed to kick out the timeout session "{}"'.format(session.session_id))
 
     def _kick_timeout_sessions(self, session):
         session_id = session.session_id
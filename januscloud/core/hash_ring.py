@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+from bisect import bisect_right
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing(object):
+    """ This consistent hash ring maps a key to the nodes
+
+    Each node is put on the ring as many virtual nodes, and a key belongs to the first node
+    found clockwise from its hash. When a node joins or leaves, only the keys of the node are
+    moved, that is about 1/N of the keys.
+    """
+
+    def __init__(self, nodes, vnodes=160):
+        """
+        :param nodes: iterable of the node names
+        :param vnodes: number of the virtual nodes of each node, more for the better balance
+        """
+        self.nodes = frozenset(nodes)
+        points = sorted((_hash('{}#{}'.format(node, i)), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [point[0] for point in points]
+        self._nodes = [point[1] for point in points]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def get_node(self, key):
+        """ get the node of the key, None if the ring is empty """
+        if not self._hashes:
+            return None
+        index = bisect_right(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._nodes[index]
+
+    def iter_nodes(self, key):
+        """ iterate all the distinct nodes clockwise from the key, the first one is the node of the key """
+        if not self._hashes:
+            return
+        total = len(self._hashes)
+        start = bisect_right(self._hashes, _hash(str(key)))
+        seen = set()
+        for offset in range(total):
+            node = self._nodes[(start + offset) % total]
+            if node not in seen:
+                seen.add(node)
+                yield node
+                if len(seen) == len(self.nodes):
+                    return
+
+
+if __name__ == '__main__':
+    # key distribution and movement of the hash ring vs modulo hashing
+    import timeit
+
+    keys = list(range(100000))
+    for node_num in (4, 8, 16):
+        nodes = ['server{}'.format(i) for i in range(node_num)]
+        ring = HashRing(nodes)
+        grown_ring = HashRing(nodes + ['server{}'.format(node_num)])
+        counts = {}
+        moved = moved_modulo = 0
+        for key in keys:
+            node = ring.get_node(key)
+            counts[node] = counts.get(node, 0) + 1
+            if grown_ring.get_node(key) != node:
+                moved += 1
+            if key % node_num != key % (node_num + 1):
+                moved_modulo += 1
+        print('{:>2} -> {:>2} nodes: max/mean keys {:.3f}, moved {:.3f} (ideal {:.3f}, modulo {:.3f})'.format(
+            node_num, node_num + 1, max(counts.values()) / (len(keys) / node_num), moved / len(keys),
+            1 / (node_num + 1), moved_modulo / len(keys)))
+    number = 100000
+    t_get = timeit.timeit(lambda: ring.get_node(123456789), number=number) / number
+    print('get_node: {:.3f} us'.format(t_get * 1000000))
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+""" IP location table, which maps the client address to its location and ISP
+
+The table is loaded from a text file, one CIDR prefix per line with its location and optional
+ISP, separated by spaces or commas, '#' starts a comment:
+
+    # cidr             location    isp
+    10.0.0.0/8         lan
+    58.32.0.0/13       shanghai    telecom
+    2408:8000::/20     beijing     unicom
+
+A prefix inside another one overrides it. The prefixes are compiled into a sorted list of
+disjoint address ranges, so a lookup is a binary search, and the results of the recent
+addresses are cached.
+"""
+import logging
+import socket
+import ipaddress
+from bisect import bisect_right
+
+log = logging.getLogger(__name__)
+
+LOOKUP_CACHE_SIZE = 65536
+
+
+class _RangeTable(object):
+    """ disjoint address ranges compiled from the prefixes of the same address family """
+
+    def __init__(self, prefixes):
+        """
+        :param prefixes: list of (start, end, value), which are either nested or disjoint
+        """
+        self.starts = []
+        self.ends = []
+        self.values = []
+        # outer prefix first for the same start, and the later one wins for the same prefix
+        prefixes = sorted(enumerate(prefixes), key=lambda item: (item[1][0], -item[1][1], item[0]))
+        stack = []
+        pos = 0
+        for index, (start, end, value) in prefixes:
+            while stack and stack[-1][1] < start:
+                pos = self._close(stack.pop(), pos)
+            if stack:
+                self._emit(pos, start - 1, stack[-1][2])
+            pos = start
+            stack.append((start, end, value))
+        while stack:
+            pos = self._close(stack.pop(), pos)
+
+    def _close(self, prefix, pos):
+        self._emit(pos, prefix[1], prefix[2])
+        return max(pos, prefix[1] + 1)
+
+    def _emit(self, start, end, value):
+        if start > end:
+            return
+        if self.ends and self.ends[-1] + 1 == start and self.values[-1] == value:
+            self.ends[-1] = end     # merge with the previous range
+            return
+        self.starts.append(start)
+        self.ends.append(end)
+        self.values.append(value)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def lookup(self, address):
+        index = bisect_right(self.starts, address) - 1
+        if index >= 0 and address <= self.ends[index]:
+            return self.values[index]
+        return None
+
+
+class IPLocationTable(object):
+
+    def __init__(self, entries=()):
+        """
+        :param entries: iterable of (cidr, location, isp)
+        """
+        v4_prefixes = []
+        v6_prefixes = []
+        for cidr, location, isp in entries:
+            network = ipaddress.ip_network(cidr, strict=False)
+            prefix = (int(network.network_address), int(network.broadcast_address), (location, isp))
+            if network.version == 4:
+                v4_prefixes.append(prefix)
+            else:
+                v6_prefixes.append(prefix)
+        self.prefix_num = len(v4_prefixes) + len(v6_prefixes)
+        self._v4_table = _RangeTable(v4_prefixes)
+        self._v6_table = _RangeTable(v6_prefixes)
+        self._cache = {}
+
+    @classmethod
+    def load(cls, path):
+        entries = []
+        with open(path, 'r') as f:
+            for line_no, line in enumerate(f, 1):
+                fields = line.split('#', 1)[0].replace(',', ' ').split()
+                if not fields:
+                    continue
+                if len(fields) < 2:
+                    raise ValueError('{} line {}: location is missing'.format(path, line_no))
+                entries.append((fields[0], fields[1], fields[2] if len(fields) > 2 else ''))
+        table = cls(entries)
+        log.info('IP location table is loaded from {}, {} prefixes'.format(path, table.prefix_num))
+        return table
+
+    def lookup(self, ip):
+        """ get the location of the ip address
+
+        :param ip: ip address string
+        :return: (location, isp), or None if not found or invalid address
+        """
+        try:
+            return self._cache[ip]
+        except KeyError:
+            pass
+        try:
+            result = self._v4_table.lookup(int.from_bytes(socket.inet_aton(ip), 'big')) if ':' not in ip else \
+                self._lookup_v6(ip)
+        except (OSError, ValueError):
+            result = None
+        if len(self._cache) >= LOOKUP_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[ip] = result
+        return result
+
+    def lookup_transport(self, transport):
+        """ get the location of the peer of the transport, None if unknown """
+        try:
+            peer_address = transport.peer_address
+        except Exception:
+            return None
+        if not peer_address:
+            return None
+        return self.lookup(peer_address[0])
+
+    def _lookup_v6(self, ip):
+        packed = socket.inet_pton(socket.AF_INET6, ip.partition('%')[0])
+        if packed[:12] == b'\x00' * 10 + b'\xff\xff':
+            # IPv4-mapped address
+            return self._v4_table.lookup(int.from_bytes(packed[12:], 'big'))
+        return self._v6_table.lookup(int.from_bytes(packed, 'big'))
+
+
+if __name__ == '__main__':
+    # lookup cost of a table with many prefixes
+    import random
+    import timeit
+
+    random.seed(1)
+    entries = []
+    for i in range(100000):
+        length = random.choice((8, 12, 16, 18, 20, 22, 24, 24, 24, 28))
+        address = random.getrandbits(32) >> (32 - length) << (32 - length)
+        entries.append(('{}/{}'.format(ipaddress.IPv4Address(address), length),
+                        'region{}'.format(i % 30), 'isp{}'.format(i % 5)))
+    for i in range(1000):
+        address = (0x2400 << 112) | (random.getrandbits(32) << 80)
+        entries.append(('{}/48'.format(ipaddress.IPv6Address(address)), 'region{}'.format(i % 30), 'isp0'))
+
+    # check with the naive longest prefix match
+    table = IPLocationTable(entries)
+    networks = [(ipaddress.ip_network(cidr), (location, isp)) for cidr, location, isp in entries]
+    for i in range(200):
+        ip = ipaddress.IPv4Address(random.getrandbits(32))
+        matched = [(network.prefixlen, index) for index, (network, value) in enumerate(networks)
+                   if network.version == 4 and ip in network]
+        expected = networks[max(matched)[1]][1] if matched else None
+        assert table.lookup(str(ip)) == expected, ip
+
+    ips = [str(ipaddress.IPv4Address(random.getrandbits(32))) for i in range(100000)]
+    number = len(ips)
+    t_compile = timeit.timeit(lambda: IPLocationTable(entries), number=1)
+    t_miss = timeit.timeit(lambda: [table._v4_table.lookup(int.from_bytes(socket.inet_aton(ip), 'big'))
+                                    for ip in ips], number=1) / number
+    t_hit = timeit.timeit(lambda: [table.lookup(ip) for ip in ips[:10000]], number=10) / 100000
+    print('{} prefixes compiled into {} ranges in {:.2f} s'.format(
+        table.prefix_num, len(table._v4_table) + len(table._v6_table), t_compile))
+    print('lookup: {:.3f} us uncached, {:.3f} us cached'.format(t_miss * 1000000, t_hit * 1000000))
@@ -107,6 +107,29 @@ class Request(object):
 
 
 class RequestHandler(object):
+    # schemas are compiled on the first use and shared by all requests
+    create_params_schema = Schema({
+        Optional('id'): IntVal(min=1, max=9007199254740992),
+        AutoDel(str): object  # for all other key we don't care
+    })
+
+    attach_params_schema = Schema({
+        'plugin': StrVal(max_len=64),
+        Optional('opaque_id'): StrVal(max_len=64),
+        AutoDel(str): object  # for all other key we don't care
+    })
+
+    message_params_schema = Schema({
+        'body': dict,
+        Optional('jsep'): dict,
+        AutoDel(str): object  # for all other key we don't care
+    })
+
+    trickle_params_schema = Schema({
+        Optional('candidate'): dict,
+        Optional('candidates'): [dict],
+        AutoDel(str): object  # for all other key we don't care
+    })
 
     def __init__(self, frontend_session_mgr=None, proxy_conf={}):
         self._frontend_session_mgr = frontend_session_mgr
@@ -161,12 +184,7 @@ class RequestHandler(object):
         return create_janus_msg('pong', 0, request.transaction)
 
     def _handle_create(self, request):
-        create_params_schema = Schema({
-                Optional('id'): IntVal(min=1, max=9007199254740992),
-                AutoDel(str): object  # for all other key we don't care
-        })
-
-        params = create_params_schema.validate(request.message)
+        params = self.create_params_schema.validate(request.message)
         session_id = params.get('id', 0)
         session = self._frontend_session_mgr.create_new_session(session_id, request.transport)
         return create_janus_msg('success', 0, request.transaction, data={'id': session.session_id})
@@ -185,17 +203,12 @@ class RequestHandler(object):
 
     def _handle_claim(self, request):
         session = self._get_session(request)
-        session.transport_claim(request.transport)
+        self._frontend_session_mgr.transport_claim(session, request.transport)
         return create_janus_msg('success', request.session_id, request.transaction)
 
     def _handle_attach(self, request):
         session = self._get_session(request)
-        attach_params_schema = Schema({
-                'plugin': StrVal(max_len=64),
-                Optional('opaque_id'): StrVal(max_len=64),
-                AutoDel(str): object  # for all other key we don't care
-        })
-        params = attach_params_schema.validate(request.message)
+        params = self.attach_params_schema.validate(request.message)
         handle = session.attach_handle(**params)
         return create_janus_msg('success', request.session_id, request.transaction, data={'id': handle.handle_id})
 
@@ -211,13 +224,7 @@ class RequestHandler(object):
         return create_janus_msg('success', request.session_id, request.transaction)
 
     def _handle_message(self, request):
-
-        message_params_schema = Schema({
-                'body': dict,
-                Optional('jsep'): dict,
-                AutoDel(str): object  # for all other key we don't care
-        })
-        params = message_params_schema.validate(request.message)
+        params = self.message_params_schema.validate(request.message)
 
         # dispatch to plugin handle
         handle = self._get_plugin_handle(request)
@@ -245,13 +252,7 @@ class RequestHandler(object):
         return response
 
     def _handle_trickle(self, request):
-
-        trickle_params_schema = Schema({
-                Optional('candidate'): dict,
-                Optional('candidates'): [dict],
-                AutoDel(str): object  # for all other key we don't care
-        })
-        params = trickle_params_schema.validate(request.message)
+        params = self.trickle_params_schema.validate(request.message)
         candidate = params.get('candidate')
         candidates = params.get('candidates')
 
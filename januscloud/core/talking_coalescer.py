@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import logging
+import weakref
+import gevent
+from januscloud.common.utils import get_monotonic_time
+
+log = logging.getLogger(__name__)
+
+
+class TalkingCoalescer(object):
+    """ Coalesce the talking / stopped-talking events of a room
+
+    Instead of forwarding each talking state change to every participant of the room, the
+    changes within window seconds are aggregated, and then the list of all the active speakers
+    is sent to the recipients at once. A recipient gets the list at most once per min_interval
+    seconds, the changes in between are merged into its next one, so nothing is lost but the
+    intermediate states.
+    """
+
+    def __init__(self, send_summary, get_recipients, window=0.2, min_interval=0.0):
+        """
+        :param send_summary: callback send_summary(speakers, recipients) to send the list of the
+                             speaker info to the recipients, it cannot block
+        :param get_recipients: callback to get the current recipients, which must be weak referable
+        :param window: seconds to aggregate the changes
+        :param min_interval: min seconds between 2 summaries sent to the same recipient, 0 means no limit
+        """
+        self._send_summary = send_summary
+        self._get_recipients = get_recipients
+        self._window = window
+        self._min_interval = min_interval
+        self._speakers = {}         # speaker id -> speaker info
+        self._version = 0           # increased by each flush with changes
+        self._dirty = False
+        self._sent = weakref.WeakKeyDictionary()     # recipient -> (version, monotonic time) of its last summary
+        self._flush_greenlet = None
+        self.changes = 0            # talking state changes
+        self.summaries = 0          # summaries sent, counted per recipient
+
+    def update(self, speaker_id, talking, info=None):
+        """ update the talking state of a speaker
+
+        :param speaker_id: id of the speaker
+        :param talking: whether the speaker is talking
+        :param info: dict of the speaker info in the summary if talking
+        """
+        if talking:
+            info = info or {}
+            if self._speakers.get(speaker_id) == info:
+                return
+            self._speakers[speaker_id] = info
+        elif self._speakers.pop(speaker_id, None) is None:
+            return
+        self.changes += 1
+        if not self._dirty:
+            self._dirty = True
+            self._schedule(self._window)
+
+    def remove(self, speaker_id):
+        self.update(speaker_id, False)
+
+    def get_speakers(self):
+        return list(self._speakers.values())
+
+    def close(self):
+        if self._flush_greenlet is not None:
+            self._flush_greenlet.kill(block=False)
+            self._flush_greenlet = None
+        self._speakers.clear()
+        self._sent.clear()
+
+    def _schedule(self, delay):
+        if self._flush_greenlet is None:
+            self._flush_greenlet = gevent.spawn_later(delay, self._flush)
+
+    def _flush(self):
+        self._flush_greenlet = None
+        if self._dirty:
+            self._dirty = False
+            self._version += 1
+        now = get_monotonic_time()
+        recipients = []
+        next_flush = None
+        for recipient in self._get_recipients():
+            version, sent_time = self._sent.get(recipient, (0, 0))
+            if version >= self._version:
+                continue   # up to date
+            wait = sent_time + self._min_interval - now
+            if wait > 0:
+                # rate limited, merged into a later summary
+                next_flush = wait if next_flush is None else min(next_flush, wait)
+                continue
+            recipients.append(recipient)
+            self._sent[recipient] = (self._version, now)
+        if recipients:
+            self.summaries += len(recipients)
+            try:
+                self._send_summary(self.get_speakers(), recipients)
+            except Exception as e:
+                log.warning('Fail to send the talking summary: {}'.format(e))
+        if next_flush is not None:
+            self._schedule(next_flush)
+
+
+if __name__ == '__main__':
+    # messages sent in a room with noisy mics, legacy per-event forwarding vs coalesced summaries
+    import random
+
+    class _Recipient(object):
+        pass
+
+    def simulate(participant_num, noisy_num, window, min_interval, duration=10.0, toggle_interval=0.3):
+        rand = random.Random(participant_num)
+        recipients = [_Recipient() for i in range(participant_num)]
+        sent = [0]
+
+        def send_summary(speakers, to):
+            sent[0] += len(to)
+
+        coalescer = TalkingCoalescer(send_summary, lambda: recipients, window, min_interval)
+        legacy_messages = 0
+        talking = [False] * noisy_num
+
+        def noisy_mic(i):
+            nonlocal legacy_messages
+            while True:
+                gevent.sleep(rand.expovariate(1 / toggle_interval))
+                talking[i] = not talking[i]
+                legacy_messages += participant_num     # to the talker itself and all the others
+                coalescer.update(i, talking[i], {'id': i})
+
+        greenlets = [gevent.spawn(noisy_mic, i) for i in range(noisy_num)]
+        gevent.sleep(duration)
+        gevent.killall(greenlets)
+        coalescer.close()
+        return legacy_messages / duration, sent[0] / duration
+
+    print('participants noisy window min_interval | legacy msg/s, summary msg/s')
+    for participant_num, noisy_num in ((10, 3), (50, 10), (100, 20)):
+        for window, min_interval in ((0.2, 0), (0.2, 1.0)):
+            legacy, summary = simulate(participant_num, noisy_num, window, min_interval)
+            print('{:>12} {:>5} {:>6} {:>12} | {:>8.0f} {:>8.0f}'.format(
+                participant_num, noisy_num, window, min_interval, legacy, summary))
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import gevent
+from januscloud.common.utils import get_monotonic_time
+
+log = logging.getLogger(__name__)
+
+
+class TimingWheel(object):
+    """ This timing wheel expires the items of which the deadline is passed
+
+    The items are put into the buckets by their deadline, one bucket per tick. Re-scheduling
+    an item only moves it from one bucket to another, and each tick only the buckets whose
+    time is passed are popped out, so the cost of a tick is proportional to the number of
+    the expired items instead of all the items watched.
+
+    The expired items are given to expired_cbk(items) in the greenlet of the wheel. An item
+    is expired at most one tick later than its deadline.
+    """
+
+    def __init__(self, name, timeout, expired_cbk, tick=1.0):
+        self.name = name
+        self.timeout = timeout
+        self._expired_cbk = expired_cbk
+        self._tick = tick
+        self._buckets = {}     # bucket index -> {key: item}
+        self._bucket_of = {}   # key -> bucket index
+        self._cursor = int(get_monotonic_time() / tick)   # the last bucket which has expired
+        self._greenlet = gevent.spawn(self._tick_routine)
+
+    def __len__(self):
+        return len(self._bucket_of)
+
+    def __contains__(self, key):
+        return key in self._bucket_of
+
+    def add(self, key, item, timeout=None):
+        """ watch the item, or re-schedule it if the key is already watched
+
+        :param key: hashable key of the item
+        :param item: the object given to expired_cbk
+        :param timeout: the item expires after timeout seconds from now, default to the timeout of the wheel
+        """
+        if timeout is None:
+            timeout = self.timeout
+        index = int((get_monotonic_time() + timeout) / self._tick) + 1
+        if index <= self._cursor:
+            index = self._cursor + 1
+        old_index = self._bucket_of.get(key)
+        if old_index == index:
+            self._buckets[index][key] = item
+            return
+        if old_index is not None:
+            self._remove_from_bucket(key, old_index)
+        bucket = self._buckets.get(index)
+        if bucket is None:
+            bucket = self._buckets[index] = {}
+        bucket[key] = item
+        self._bucket_of[key] = index
+
+    def remove(self, key):
+        index = self._bucket_of.pop(key, None)
+        if index is not None:
+            self._remove_from_bucket(key, index)
+
+    def stop(self):
+        if self._greenlet is not None:
+            greenlet = self._greenlet
+            self._greenlet = None
+            greenlet.kill()
+        self._buckets.clear()
+        self._bucket_of.clear()
+
+    def _remove_from_bucket(self, key, index):
+        bucket = self._buckets.get(index)
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del self._buckets[index]
+
+    def _pop_expired(self, now):
+        expired = []
+        current = int(now / self._tick)
+        while self._cursor < current:
+            self._cursor += 1
+            bucket = self._buckets.pop(self._cursor, None)
+            if bucket:
+                for key in bucket:
+                    del self._bucket_of[key]
+                expired.extend(bucket.values())
+        return expired
+
+    def _tick_routine(self):
+        while True:
+            gevent.sleep(self._tick)
+            expired = self._pop_expired(get_monotonic_time())
+            if expired:
+                try:
+                    self._expired_cbk(expired)
+                except Exception:
+                    log.exception('Error when handle the expired items of timing wheel {}'.format(self.name))
+
+
+class TimerService(TimingWheel):
+    """ This timer service runs many one-shot timers on a timing wheel in one greenlet
+
+    The callbacks run in the greenlet of the wheel one by one, so they must not block, the
+    blocking work should be spawned in a new greenlet. A periodic timer is made by calling
+    call_later() again in its callback.
+    """
+
+    def __init__(self, name, tick=1.0):
+        super(TimerService, self).__init__(name, 0, self._run_timers, tick=tick)
+
+    def call_later(self, key, delay, func, *args):
+        """ call func(*args) after delay seconds, the timer of the same key is replaced """
+        self.add(key, (func, args), delay)
+
+    def cancel(self, key):
+        self.remove(key)
+
+    def _run_timers(self, timers):
+        for func, args in timers:
+            try:
+                func(*args)
+            except Exception:
+                log.exception('Error when run timer {} of timer service {}'.format(func, self.name))
+
+
+_timer_service = None
+
+
+def get_timer_service():
+    """ get the timer service shared by the whole process, whose precision is 1 sec """
+    global _timer_service
+    if _timer_service is None:
+        _timer_service = TimerService('shared_timer', tick=1.0)
+    return _timer_service
+
+
+if __name__ == '__main__':
+    # cost of a timeout check with the full scan vs the timing wheel
+    import timeit
+
+    class Session(object):
+        def __init__(self, session_id):
+            self.session_id = session_id
+            self.last_activity = get_monotonic_time()
+
+    session_timeout = 60
+    for session_num in (10000, 100000):
+        sessions = {i: Session(i) for i in range(session_num)}
+        now = get_monotonic_time()
+
+        def full_scan():
+            return [session for session in sessions.values()
+                    if now - session.last_activity > session_timeout]
+
+        wheel = TimingWheel('bench', session_timeout, lambda items: None, tick=2)
+        for session in sessions.values():
+            wheel.add(session.session_id, session)
+
+        def wheel_tick():
+            return wheel._pop_expired(now)
+
+        def wheel_touch():
+            for session_id in range(0, session_num, 100):
+                wheel.add(session_id, sessions[session_id])
+
+        number = 50
+        t_scan = timeit.timeit(full_scan, number=number) / number
+        t_tick = timeit.timeit(wheel_tick, number=number) / number
+        t_touch = timeit.timeit(wheel_touch, number=number) / number / (session_num // 100)
+        print('{:>6} sessions: full scan {:8.3f} ms/check, wheel tick {:8.4f} ms/check, '
+              'activate {:6.3f} us'.format(session_num, t_scan * 1000, t_tick * 1000, t_touch * 1000000))
+        wheel.stop()
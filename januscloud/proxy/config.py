@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 from januscloud.common.schema import Schema, StrVal, Default, AutoDel, Optional, BoolVal, IntVal, \
-    StrRe, EnumVal, Or
+    StrRe, EnumVal, Or, FloatVal
 from januscloud.common.confparser import parse as parse_config
 from pkg_resources import Requirement, resource_filename
 import os
@@ -12,12 +12,21 @@ log = logging.getLogger(__name__)
 config_schema = Schema({
     Optional("general"): Default({
         Optional("daemonize"): Default(BoolVal(), default=False),
+        Optional("workers"): Default(IntVal(min=1, max=128), default=1),
         Optional("configs_folder"): Default(StrVal(), default=''),
         Optional("server_name"): Default(StrRe(r'^\S*$'), default=''),
         Optional("session_timeout"): Default(IntVal(min=0, max=86400), default=60),
         Optional("server_db"): Default(StrVal(), default='memory'),
+        Optional("server_db_cache_ttl"): Default(IntVal(min=0, max=3600), default=5),
         Optional("server_select"): Default(StrVal(), default='rr'),
+        Optional("ip_location_table"): Default(StrVal(), default=''),
+        Optional("chash_load_bound"): Default(FloatVal(min=0), default=1.25),
         Optional('api_secret'): Default(StrVal(), default=''),
+        Optional('backend_session_pool_size'): Default(IntVal(min=1, max=64), default=1),
+        Optional('backend_session_pool_select'): Default(EnumVal(['least_handles', 'hash']), default='least_handles'),
+        Optional('backend_handle_pool_size'): Default(IntVal(min=0, max=64), default=0),
+        Optional('backend_handle_pool_max_idle'): Default(IntVal(min=1, max=86400), default=60),
+        Optional('backend_ws_deflate'): Default(BoolVal(), default=False),
         AutoDel(str): object  # for all other key we don't care
     }, default={}),
     Optional("log"): Default({
@@ -37,18 +46,34 @@ config_schema = Schema({
     Optional("plugins"): Default([StrRe('^\S+:\S+$')], default=[]),
     Optional("ws_transport"): Default({
         Optional("json"): Default(EnumVal(['indented', 'plain', 'compact']), default='indented'),
+        Optional("json_codec"): Default(EnumVal(['auto', 'json', 'orjson', 'ujson']), default='auto'),
         Optional("pingpong_trigger"): Default(IntVal(min=0, max=3600), default=0),
         Optional("pingpong_timeout"): Default(IntVal(min=1, max=3600), default=30),
         Optional("ws"): Default(BoolVal(), default=False),
         Optional("ws_listen"): Default(StrRe('^\S+:\d+$'), default='0.0.0.0:8288'),
         Optional("wss"): Default(BoolVal(), default=False),
         Optional("wss_listen"): Default(StrRe('^\S+:\d+$'), default='0.0.0.0:8289'),
+        Optional("worker_ws_listen"): Default(StrRe('^(\S+:\d+)?$'), default=''),
+        Optional("worker_wss_listen"): Default(StrRe('^(\S+:\d+)?$'), default=''),
         Optional("max_greenlet_num"): Default(IntVal(min=0, max=10000), default=1000),
+        Optional("session_concurrency"): Default(IntVal(min=1, max=1000), default=1),
+        Optional("session_queue_size"): Default(IntVal(min=1, max=100000), default=64),
+        Optional("send_queue_size"): Default(IntVal(min=0, max=100000), default=1024),
+        Optional("send_queue_high_watermark"): Default(IntVal(min=1, max=100000), default=256),
+        Optional("send_queue_low_watermark"): Default(IntVal(min=0, max=100000), default=64),
+        Optional("send_queue_drop_policy"): Default(EnumVal(['none', 'drop', 'coalesce']), default='coalesce'),
+        Optional("slow_consumer_timeout"): Default(IntVal(min=0, max=3600), default=30),
+        Optional("deflate"): Default(BoolVal(), default=False),
+        Optional("deflate_window_bits"): Default(IntVal(min=9, max=15), default=15),
+        Optional("deflate_context_takeover"): Default(BoolVal(), default=True),
+        Optional("deflate_min_size"): Default(IntVal(min=0, max=1048576), default=256),
         AutoDel(str): object  # for all other key we don't care
     }, default={}),
     Optional("admin_api"): Default({
         Optional("json"): Default(EnumVal(['indented', 'plain', 'compact']), default='indented'),
+        Optional("json_codec"): Default(EnumVal(['auto', 'json', 'orjson', 'ujson']), default='auto'),
         Optional("http_listen"): Default(StrRe('^\S+:\d+$'), default='0.0.0.0:8100'),
+        Optional("worker_http_listen"): Default(StrRe('^\S+:\d+$'), default='127.0.0.1:8110'),
         AutoDel(str): object  # for all other key we don't care
     }, default={}),
     Optional("janus_server"): Default([{
@@ -113,7 +113,9 @@ class RDRoomDao(object):
                          require_e2ee=bool(rd_room.get('require_e2ee', False)),
                          vp9_profile=str(rd_room.get('vp9_profile', '')),
                          h264_profile=str(rd_room.get('h264_profile', '')),
-                         min_publisher_one_backend=int(rd_room.get('min_publisher_one_backend', 5)))
+                         min_publisher_one_backend=int(rd_room.get('min_publisher_one_backend', 5)),
+                         max_subscriber_one_backend=int(rd_room.get('max_subscriber_one_backend', 0)),
+                         max_bitrate_one_backend=int(rd_room.get('max_bitrate_one_backend', 0)))
 
         if 'ctime' in rd_room:
             room.ctime = float(rd_room['ctime'])
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import logging
+from redis import RedisError
+log = logging.getLogger(__name__)
+
+"""
+januscloud:video_room_owners:<room_id>       string of the proxy owning the video room, expired if not renewed
+
+"""
+
+# set the owner if the room has no owner, renew the lease if owned by the caller, return the owner
+_CLAIM_SCRIPT = """
+local owner = redis.call('get', KEYS[1])
+if not owner then
+    redis.call('set', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    return ARGV[1]
+end
+if owner == ARGV[1] then
+    redis.call('expire', KEYS[1], ARGV[2])
+end
+return owner
+"""
+
+# delete the owner only if owned by the caller
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RDRoomOwnerDao(object):
+    """ The owner of a room is the only proxy serving its participants, as a lease which must be
+    renewed within lease seconds, so that the rooms of a crashed proxy can be taken by others """
+
+    def __init__(self, redis_client=None, lease=30):
+        self._redis_client = redis_client
+        self._redis_client.client_getname()     # test the connection if available or not
+        self._lease = lease
+        self._claim_script = self._redis_client.register_script(_CLAIM_SCRIPT)
+        self._release_script = self._redis_client.register_script(_RELEASE_SCRIPT)
+
+    def get_owner(self, room_id):
+        try:
+            return self._redis_client.get(self._key_owner(room_id))
+        except RedisError as e:
+            log.warning('Fail to get the owner of video room {} because of Redis client error: {}'.format(room_id, e))
+            return None
+
+    def claim(self, room_id, owner):
+        """ claim the room for owner, or renew the lease if already owned by it
+
+        :return: the owner of the room after claimed
+        """
+        return self._claim_script(keys=[self._key_owner(room_id)], args=[owner, self._lease])
+
+    def claim_list(self, room_id_list, owner):
+        """ claim or renew many rooms in one round trip
+
+        :return: list of the owners of the rooms in the same order
+        """
+        with self._redis_client.pipeline() as p:
+            for room_id in room_id_list:
+                self._claim_script(keys=[self._key_owner(room_id)], args=[owner, self._lease], client=p)
+            return p.execute()
+
+    def release(self, room_id, owner):
+        self._release_script(keys=[self._key_owner(room_id)], args=[owner])
+
+    @staticmethod
+    def _key_owner(room_id):
+        return 'januscloud:video_room_owners:{0}'.format(room_id)
+
+
+def test_redis():
+    # test redis client
+    import redis
+
+    connection_pool = redis.BlockingConnectionPool.from_url(
+        url='redis://127.0.0.1:6379',
+        decode_responses=True,
+        health_check_interval=30,
+        timeout=10)
+    redis_client = redis.Redis(connection_pool=connection_pool)
+    owner_dao = RDRoomOwnerDao(redis_client, lease=10)
+
+    room_id = 1234
+    owner_dao.release(room_id, 'proxy1')
+    assert owner_dao.get_owner(room_id) is None
+    assert owner_dao.claim(room_id, 'proxy1') == 'proxy1'
+    assert owner_dao.claim(room_id, 'proxy2') == 'proxy1'
+    assert owner_dao.claim_list([room_id, 5678], 'proxy2') == ['proxy1', 'proxy2']
+    owner_dao.release(room_id, 'proxy2')
+    assert owner_dao.get_owner(room_id) == 'proxy1'
+    owner_dao.release(room_id, 'proxy1')
+    owner_dao.release(5678, 'proxy2')
+    assert owner_dao.get_owner(room_id) is None
+
+    print('redis db test successful')
+
+
+if __name__ == '__main__':
+    test_redis()
@@ -1,21 +1,46 @@
 # -*- coding: utf-8 -*-
 import logging
-from januscloud.common.utils import to_redis_hash
+import copy
+import time
+import gevent
+from januscloud.common.utils import to_redis_hash, get_monotonic_time
 from januscloud.core.backend_server import BackendServer
 from redis import RedisError
 log = logging.getLogger(__name__)
 
 """
 januscloud:backend_servers:<server_name>       hash map of the backend janus server info, will expired 
+januscloud:backend_server_index                sorted set of the backend server names, scored by the expire time
+januscloud:backend_server_changed              pub/sub channel of the backend server names added, deleted or
+                                               changed in SERVER_CHANGED_FIELDS
 
 """
 
+SERVER_INDEX_KEY = 'januscloud:backend_server_index'
+SERVER_CHANGED_CHANNEL = 'januscloud:backend_server_changed'
+SUBSCRIBE_RETRY_INTERVAL = 5
+# the fields of a backend server which change the choice of the proxies, the others (e.g. the load
+# reported by janus-sentinel) are refreshed on the other proxies when their cache expires
+SERVER_CHANGED_FIELDS = ('url', 'status', 'location', 'isp')
+
 
 class RDServerDao(object):
+    """ The backend server list is cached locally, so that choosing a backend server costs no
+    round trip to redis. The cache is invalidated when any proxy adds, deletes a server or changes
+    its status, which is published on SERVER_CHANGED_CHANNEL, and expires after cache_ttl seconds
+    in case some notification is missed. Only the load of a server reported by janus-sentinel is
+    refreshed in the cache, without invalidating it on all the proxies. """
 
-    def __init__(self, redis_client=None):
+    def __init__(self, redis_client=None, cache_ttl=5):
         self._redis_client = redis_client
         self._redis_client.client_getname()     # test the connection if available or not
+        self._cache_ttl = cache_ttl
+        self._cached_servers = None
+        self._cache_ts = 0
+        self._index_servers()
+        self._subscribe_greenlet = None
+        if cache_ttl > 0:
+            self._subscribe_greenlet = gevent.spawn(self._subscribe_routine)
 
     def get_by_name(self, server_name):
         try:
@@ -29,52 +54,135 @@ class RDServerDao(object):
             return None
 
     def del_by_name(self, server_name):
-        self._redis_client.delete(self._key_server(server_name))
-
-    def add(self, server):
-        server_key = self._key_server(server.name)
         with self._redis_client.pipeline() as p:
-            p.hmset(
-                server_key,
-                to_redis_hash(server),
-            )
-            if server.expire != 0:
-                p.expire(server_key, server.expire)
+            p.delete(self._key_server(server_name))
+            p.zrem(SERVER_INDEX_KEY, server_name)
+            p.publish(SERVER_CHANGED_CHANNEL, server_name)
             p.execute()
+        self.invalidate_cache()
+
+    def add(self, server):
+        self._save(server)
 
     def update(self, server):
-        server_key = self._key_server(server.name)
-        with self._redis_client.pipeline() as p:
-            p.hmset(
-                server_key,
-                to_redis_hash(server),
-            )
-            if server.expire != 0:
-                p.expire(server_key, server.expire)
-            p.execute()
+        self._save(server)
 
     def get_list(self):
+        if self._cached_servers is not None and get_monotonic_time() - self._cache_ts < self._cache_ttl:
+            return [copy.copy(server) for server in self._cached_servers]
+
+        cache_ts = get_monotonic_time()
         server_list = []
         try:
-            server_key_list = self._redis_client.keys(pattern='januscloud:backend_servers:*')
+            with self._redis_client.pipeline() as p:
+                # trim the servers expired without being deleted
+                p.zremrangebyscore(SERVER_INDEX_KEY, '-inf', '({}'.format(time.time()))
+                p.zrange(SERVER_INDEX_KEY, 0, -1)
+                server_name_list = p.execute()[1]
             start = 0
             step = 32
-            total = len(server_key_list)
-            while True:
+            total = len(server_name_list)
+            while start < total:
                 with self._redis_client.pipeline() as p:
-                    for server_key in server_key_list[start:start+step]:
-                        p.hgetall(server_key)
+                    for server_name in server_name_list[start:start+step]:
+                        p.hgetall(self._key_server(server_name))
                     result = p.execute()
                     for rd_server in result:
                         if rd_server:
                             server_list.append(self._from_rd_server(rd_server))
                 start += step
-                if start >= total:
-                    break
         except RedisError as e:
             log.warning('Fail to get backend server list because of Redis client error: {}'.format(e))
+            if self._cached_servers is not None:
+                # better than no server at all
+                return [copy.copy(server) for server in self._cached_servers]
+            return server_list
+
+        if self._cache_ttl > 0 and cache_ts >= self._cache_ts:
+            # not cached if invalidated while loading
+            self._cached_servers = server_list
+            self._cache_ts = cache_ts
+        return [copy.copy(server) for server in server_list]
+
+    def invalidate_cache(self):
+        self._cached_servers = None
+        self._cache_ts = get_monotonic_time()
+
+    def _save(self, server):
+        server_key = self._key_server(server.name)
+        server_hash = to_redis_hash(server)
+        with self._redis_client.pipeline() as p:
+            p.hmget(server_key, SERVER_CHANGED_FIELDS)
+            p.hmset(
+                server_key,
+                server_hash,
+            )
+            if server.expire != 0:
+                p.expire(server_key, server.expire)
+                p.zadd(SERVER_INDEX_KEY, {server.name: time.time() + server.expire})
+            else:
+                p.zadd(SERVER_INDEX_KEY, {server.name: '+inf'})
+            old_values = p.execute()[0]
+        if old_values != [str(server_hash.get(field, '')) for field in SERVER_CHANGED_FIELDS]:
+            # added or changed, e.g. the status
+            self._redis_client.publish(SERVER_CHANGED_CHANNEL, server.name)
+            self.invalidate_cache()
+        else:
+            self._refresh_cache(server)
+
+    def _refresh_cache(self, server):
+        if self._cached_servers is None:
+            return
+        for cached_server in self._cached_servers:
+            if cached_server.name == server.name:
+                cached_server.__dict__.update(server.__dict__)
+                return
+        self.invalidate_cache()
+
+    def _index_servers(self):
+        # index the servers written by the former version without the index, by SCAN instead of KEYS
+        try:
+            server_name_list = []
+            for server_key in self._redis_client.scan_iter(match=self._key_server('*'), count=1000):
+                server_name_list.append(server_key[len(self._key_server('')):])
+            if not server_name_list:
+                return
+            with self._redis_client.pipeline() as p:
+                for server_name in server_name_list:
+                    p.ttl(self._key_server(server_name))
+                ttl_list = p.execute()
+            index = {}
+            now = time.time()
+            for server_name, ttl in zip(server_name_list, ttl_list):
+                if ttl == -1:
+                    index[server_name] = '+inf'
+                elif ttl >= 0:
+                    index[server_name] = now + ttl
+            if index:
+                self._redis_client.zadd(SERVER_INDEX_KEY, index)
+        except RedisError as e:
+            log.warning('Fail to index backend servers because of Redis client error: {}'.format(e))
 
-        return server_list
+    def _subscribe_routine(self):
+        while True:
+            pubsub = self._redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(SERVER_CHANGED_CHANNEL)
+                # the changes before subscribed are missed
+                self.invalidate_cache()
+                for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        self.invalidate_cache()
+            except RedisError as e:
+                log.warning('Backend server change subscription is broken because of Redis client error: {}, '
+                            'retry after {} secs'.format(e, SUBSCRIBE_RETRY_INTERVAL))
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            self.invalidate_cache()
+            gevent.sleep(SUBSCRIBE_RETRY_INTERVAL)
 
     @staticmethod
     def _key_server(server_name):
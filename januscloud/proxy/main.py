@@ -8,9 +8,23 @@ import os
 
 def main():
     if len(sys.argv) == 2:
-        config = load_conf(sys.argv[1])
+        conf_path = sys.argv[1]
     else:
-        config = load_conf('/opt/janus-cloud/conf/janus-proxy.yml')
+        conf_path = '/opt/janus-cloud/conf/janus-proxy.yml'
+    config = load_conf(conf_path)
+
+    from januscloud.proxy.supervisor import get_worker_index
+    worker_index = get_worker_index()
+    if worker_index is not None:
+        # started by the supervisor, which has been daemonized if required
+        do_main(config, worker_index)
+        return
+
+    if config['general']['workers'] > 1:
+        worker_args = [sys.executable, '-m', 'januscloud.proxy.main', os.path.abspath(conf_path)]
+        run = lambda: do_supervisor(config, worker_args)
+    else:
+        run = lambda: do_main(config)
 
     if config['general']['daemonize']:
         with DaemonContext(stdin=sys.stdin,
@@ -19,31 +33,91 @@ def main():
                            # so we won't prevent file systems from being unmounted.
                            # working_directory=os.getcwd(),
                            files_preserve=list(range(3, 100))):
-            do_main(config)
+            run()
     else:
-        do_main(config)
+        run()
+
+
+def do_supervisor(config, worker_args):
+
+    import signal
+    from gevent.pywsgi import WSGIServer
+    from januscloud.common.json_codec import get_json_codec
+    from januscloud.common.logger import set_root_logger
+    from januscloud.proxy.supervisor import Supervisor, AdminAPIAggregator
+    import gevent
+
+    set_root_logger(**(config['log']))
+
+    import logging
+    log = logging.getLogger(__name__)
+
+    supervisor = None
+    try:
+        log.info('Janus Proxy supervisor is starting {} workers...'.format(config['general']['workers']))
+        supervisor = Supervisor(config['general']['workers'], worker_args, config)
+        admin_json_codec = get_json_codec(config['admin_api']['json_codec'], config['admin_api']['json'], indent_size=4)
+        rest_server = WSGIServer(
+            config['admin_api']['http_listen'],
+            AdminAPIAggregator(supervisor, admin_json_codec),
+            log=logging.getLogger('rest server')
+        )
+        rest_server.init_socket()   # fail before starting the workers if the address is in use
+        supervisor.start(start_failed_cbk=rest_server.stop)
+
+        log.info('Janus Proxy supervisor launched successfully')
 
+        def stop_server():
+            log.info('Janus Proxy supervisor receives signals to quit...')
+            rest_server.stop()
+
+        gevent.signal_handler(signal.SIGTERM, stop_server)
+        gevent.signal_handler(signal.SIGQUIT, stop_server)
+        gevent.signal_handler(signal.SIGINT, stop_server)
+
+        rest_server.serve_forever()
 
-def do_main(config):
+        log.info("Janus-proxy supervisor Quit")
+
+    except Exception:
+        log.exception('Fail to start Janus Proxy supervisor')
+    finally:
+        if supervisor is not None:
+            supervisor.stop()
+
+
+def do_main(config, worker_index=None):
 
     import signal
     from gevent.pywsgi import WSGIServer
     from pyramid.config import Configurator
     from pyramid.renderers import JSON
-    from januscloud.common.utils import CustomJSONEncoder
+    from januscloud.common.json_codec import get_json_codec
     from januscloud.common.logger import set_root_logger
     from januscloud.transport.ws import WSServer
     import importlib
     from januscloud.common.error import JanusCloudError, JANUS_ERROR_NOT_IMPLEMENTED
     import gevent
 
+    from januscloud.proxy.supervisor import get_worker_listen, get_worker_http_listen, get_worker_log_file, \
+        get_supervisor_pid, WORKER_START_FAILED_EXIT_CODE
+    # admin_api.http_listen is kept as the public admin address (served by the supervisor in workers mode),
+    # since the plugins publish it to the other proxies, e.g. the api_url of the videocall users
+    http_listen = config['admin_api']['http_listen']
+    if worker_index is not None:
+        config['log']['log_to_file'] = get_worker_log_file(config['log']['log_to_file'], worker_index)
+        http_listen = get_worker_http_listen(config, worker_index)
     set_root_logger(**(config['log']))
 
     import logging
     log = logging.getLogger(__name__)
 
+    launched = False
     try:
-        log.info('Janus Proxy is starting...')
+        if worker_index is None:
+            log.info('Janus Proxy is starting...')
+        else:
+            log.info('Janus Proxy worker {} is starting...'.format(worker_index))
         cert_pem_file = config['certificates'].get('cert_pem')
         cert_key_file = config['certificates'].get('cert_key')
 
@@ -60,7 +134,7 @@ def do_main(config):
                 health_check_interval=30,
                 timeout=10)
             redis_client = redis.Redis(connection_pool=connection_pool)
-            server_dao = RDServerDao(redis_client)
+            server_dao = RDServerDao(redis_client, cache_ttl=config['general']['server_db_cache_ttl'])
         else:
             raise JanusCloudError('server_db url {} not support'.format(config['general']['server_db']),
                                   JANUS_ERROR_NOT_IMPLEMENTED)
@@ -71,20 +145,35 @@ def do_main(config):
         frontend_session_mgr = FrontendSessionManager(session_timeout=config['general']['session_timeout'])
         from januscloud.core.request import RequestHandler
         request_handler = RequestHandler(frontend_session_mgr=frontend_session_mgr, proxy_conf=config)
+        ip_location_table = None
+        if config['general']['ip_location_table']:
+            from januscloud.core.ip_location import IPLocationTable
+            ip_location_table = IPLocationTable.load(
+                os.path.join(config['general']['configs_folder'], config['general']['ip_location_table']))
         from januscloud.core.backend_server import BackendServerManager
         backend_server_manager = BackendServerManager(config['general']['server_select'],
                                                       config['janus_server'],
-                                                      server_dao)
-        from januscloud.core.backend_session import set_api_secret
+                                                      server_dao,
+                                                      ip_location_table=ip_location_table,
+                                                      chash_load_bound=config['general']['chash_load_bound'])
+        from januscloud.core.backend_session import set_api_secret, set_session_pool, set_handle_pool, \
+            set_ws_deflate
         set_api_secret(config['general']['api_secret'])
+        set_session_pool(config['general']['backend_session_pool_size'],
+                         config['general']['backend_session_pool_select'])
+        set_handle_pool(config['general']['backend_handle_pool_size'],
+                        config['general']['backend_handle_pool_max_idle'])
+        set_ws_deflate(config['general']['backend_ws_deflate'])
 
         # rest api config
         pyramid_config = Configurator()
-        pyramid_config.add_renderer(None, JSON(indent=4, check_circular=True, cls=CustomJSONEncoder))
+        admin_json_codec = get_json_codec(config['admin_api']['json_codec'], config['admin_api']['json'], indent_size=4)
+        pyramid_config.add_renderer(None, JSON(serializer=admin_json_codec.dumps))
         pyramid_config.include('januscloud.proxy.rest')
         # TODO register service to pyramid registry
         pyramid_config.registry.backend_server_manager = backend_server_manager
         pyramid_config.registry.proxy_conf = config
+        pyramid_config.registry.ws_server_list = []
 
 
         # load the plugins
@@ -103,38 +192,51 @@ def do_main(config):
         # set up all server
         server_list = []
         rest_server = WSGIServer(
-            config['admin_api']['http_listen'],
+            http_listen,
             pyramid_config.make_wsgi_app(),
             log=logging.getLogger('rest server')
         )
 
         server_list.append(rest_server)
-        if config['ws_transport']['wss']:
-            wss_server = WSServer(
-                config['ws_transport']['wss_listen'],
-                request_handler,
-                msg_handler_pool_size=config['ws_transport']['max_greenlet_num'],
-                indent=config['ws_transport']['json'],
-                keyfile=cert_key_file,
-                certfile=cert_pem_file,
-                pingpong_trigger=config['ws_transport']['pingpong_trigger'],
-                pingpong_timeout=config['ws_transport']['pingpong_timeout'],
+        # the shared ws/wss addresses, and the ones of this worker if configured
+        ws_listen_list = []
+        for secure, key in ((True, 'wss'), (False, 'ws')):
+            if not config['ws_transport'][key]:
+                continue
+            ws_listen_list.append((secure, config['ws_transport'][key + '_listen'], worker_index is not None))
+            worker_listen = config['ws_transport']['worker_{}_listen'.format(key)]
+            if worker_index is not None and worker_listen:
+                ws_listen_list.append((secure, get_worker_listen(worker_listen, worker_index), False))
 
-            )
-            server_list.append(wss_server)
-
-        if config['ws_transport']['ws']:
+        for secure, listen, reuse_port in ws_listen_list:
             ws_server = WSServer(
-                config['ws_transport']['ws_listen'],
+                listen,
                 request_handler,
                 msg_handler_pool_size=config['ws_transport']['max_greenlet_num'],
+                session_concurrency=config['ws_transport']['session_concurrency'],
+                session_queue_size=config['ws_transport']['session_queue_size'],
                 indent=config['ws_transport']['json'],
+                json_codec=config['ws_transport']['json_codec'],
+                keyfile=cert_key_file if secure else None,
+                certfile=cert_pem_file if secure else None,
                 pingpong_trigger=config['ws_transport']['pingpong_trigger'],
                 pingpong_timeout=config['ws_transport']['pingpong_timeout'],
+                send_queue_size=config['ws_transport']['send_queue_size'],
+                send_queue_high_watermark=config['ws_transport']['send_queue_high_watermark'],
+                send_queue_low_watermark=config['ws_transport']['send_queue_low_watermark'],
+                send_queue_drop_policy=config['ws_transport']['send_queue_drop_policy'],
+                slow_consumer_timeout=config['ws_transport']['slow_consumer_timeout'],
+                deflate=config['ws_transport']['deflate'],
+                deflate_window_bits=config['ws_transport']['deflate_window_bits'],
+                deflate_context_takeover=config['ws_transport']['deflate_context_takeover'],
+                deflate_min_size=config['ws_transport']['deflate_min_size'],
+                reuse_port=reuse_port,
             )
             server_list.append(ws_server)
+            pyramid_config.registry.ws_server_list.append(ws_server)
 
         log.info('Janus Proxy launched successfully')
+        launched = True
 
         def stop_server():
             log.info('Janus Proxy receives signals to quit...')
@@ -145,12 +247,19 @@ def do_main(config):
         gevent.signal_handler(signal.SIGQUIT, stop_server)
         gevent.signal_handler(signal.SIGINT, stop_server)
 
+        if worker_index is not None:
+            # quit with the supervisor, instead of being left as an orphan
+            gevent.spawn(watch_supervisor, get_supervisor_pid(), stop_server)
+
         serve_forever(server_list)  # serve all server
 
         log.info("Janus-proxy Quit")
 
     except Exception:
         log.exception('Fail to start Janus Proxy')
+        if worker_index is not None and not launched:
+            # tell the supervisor not to restart it again and again, e.g. for a bad config
+            sys.exit(WORKER_START_FAILED_EXIT_CODE)
 
 
 def serve_forever(server_list):
@@ -160,5 +269,11 @@ def serve_forever(server_list):
     gevent.joinall(server_greenlets)
 
 
+def watch_supervisor(supervisor_pid, stop_server):
+    while os.getppid() == supervisor_pid:
+        gevent.sleep(1)
+    stop_server()
+
+
 if __name__ == '__main__':
     main()
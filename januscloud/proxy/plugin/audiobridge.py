@@ -6,7 +6,7 @@ import logging
 import re
 from urllib.parse import urlparse
 from januscloud.common.utils import error_to_janus_msg, create_janus_msg, random_uint64, random_uint32, \
-    get_monotonic_time
+    get_monotonic_time, JanusBroadcastMsg
 from januscloud.common.error import JanusCloudError, JANUS_ERROR_UNKNOWN_REQUEST, JANUS_ERROR_INVALID_REQUEST_PATH, \
     JANUS_ERROR_BAD_GATEWAY, JANUS_ERROR_CONFLICT, JANUS_ERROR_NOT_IMPLEMENTED, JANUS_ERROR_INTERNAL_ERROR, \
     JANUS_ERROR_GATEWAY_TIMEOUT
@@ -16,11 +16,12 @@ from januscloud.common.schema import Schema, Optional, DoNotCare, \
 from januscloud.core import backend_handle
 from januscloud.core.backend_session import get_backend_session
 from januscloud.core.plugin_base import PluginBase
+from januscloud.core.timing_wheel import TimingWheel
+from januscloud.core.talking_coalescer import TalkingCoalescer
 from januscloud.core.frontend_handle_base import FrontendHandleBase, JANUS_PLUGIN_OK_WAIT, JANUS_PLUGIN_OK
 import os.path
 from januscloud.common.confparser import parse as parse_config
 import time
-import gevent
 from januscloud.proxy.rest.common import post_view, get_params_from_request, get_view, delete_view, put_view
 from pyramid.response import Response
 import sys
@@ -204,6 +205,7 @@ join_base_schema = Schema({
     Optional('pin'): Default(StrVal(max_len=256), default=''),
     Optional('token'): StrVal(max_len=256),
     Optional('id'): IntVal(min=1),
+    Optional('talking_events'): EnumVal(['summary', 'legacy']),
     
     AutoDel(str): object  # for all other key we must delete
 })
@@ -258,6 +260,9 @@ participant_configure_schema = Schema({
 
 _backend_server_mgr = None
 
+_talking_coalesce_window = 0.0          # seconds to coalesce the talking events, 0 means forwarding one by one
+_talking_summary_min_interval = 0.0     # min seconds between 2 talking summaries to a participant
+
 def _send_backend_message(backend_handle, body, jsep=None):
     if backend_handle is None:
         raise JanusCloudError('Not connected', JANUS_ERROR_INTERNAL_ERROR)
@@ -283,6 +288,7 @@ class AudioBridgeParticipant(object):
         self.codec = ''            # Audio codec this publisher is using
         self.audiolevel_ext = False # Audio level RTP extension enabled or not 
         self.talking = False       # Whether this participant is currently talking (uses audio levels extension)
+        self.legacy_talking_events = False  # Whether to get the talking events one by one instead of the summary
         self.muted = False         # Whether this participant is muted
         self.spatial_position = 50 # Panning of this participant in the mix
         self.mjr_active = False    # Whether this participant has to be recorded to an mjr file or not
@@ -382,7 +388,8 @@ class AudioBridgeParticipant(object):
 
         # backend session
         backend_session = get_backend_session(server_url, 
-                                              auto_destroy=BACKEND_SESSION_AUTO_DESTROY_TIME)
+                                              auto_destroy=BACKEND_SESSION_AUTO_DESTROY_TIME,
+                                              key=room.room_id)
 
         # attach backend handle
         backend_handle = backend_session.attach_handle(JANUS_AUDIOBRIDGE_PACKAGE, handle_listener=self)
@@ -613,6 +620,12 @@ class AudioBridgeParticipant(object):
         if self._frontend_handle:
             self._frontend_handle.push_plugin_event(data=data)
 
+    def push_audiobridge_broadcast_event(self, broadcast_msg):
+        if self._has_destroyed:
+            return
+        if self._frontend_handle:
+            self._frontend_handle.push_broadcast_event(broadcast_msg)
+
     def hangup(self):
         if self._has_destroyed:
             return
@@ -687,6 +700,10 @@ class AudioBridgeParticipant(object):
                         self.talking = True
                     else:
                         self.talking = False
+                    if _talking_coalesce_window > 0 and self.room:
+                        self.room.update_talking(self)
+                if _talking_coalesce_window > 0 and not self.legacy_talking_events:
+                    return  # coalesced into the talking-summary event
                 # pass through the talking event to front handle
                 talk_event = data.copy()
                 talk_event['id'] = self.user_id
@@ -813,8 +830,10 @@ class AudioBridgeRoom(object):
 
         self._backend_admin_key = backend_admin_key
         self._lock = BoundedSemaphore()
+        self._talking_coalescer = None           # TalkingCoalescer, created on the first talking event
 
         self.idle_ts = get_monotonic_time()
+        self._idle_wheel = None                  # timing wheel for auto cleanup, set by the room manager
 
         if utime is None:
             self.utime = time.time()
@@ -834,12 +853,19 @@ class AudioBridgeRoom(object):
             raise JanusCloudError('No such room ({})'.format(self.room_id),
                                   JANUS_AUDIOBRIDGE_ERROR_NO_SUCH_ROOM)
 
+    def set_idle_wheel(self, idle_wheel):
+        self._idle_wheel = idle_wheel
+
     def check_idle(self):
         if len(self._participants) == 0:
             if self.idle_ts == 0:
                 self.idle_ts = get_monotonic_time()
+                if self._idle_wheel is not None:
+                    self._idle_wheel.add(self.room_id, self)
             return True
         else:
+            if self.idle_ts != 0 and self._idle_wheel is not None:
+                self._idle_wheel.remove(self.room_id)
             self.idle_ts = 0
             return False
 
@@ -847,12 +873,18 @@ class AudioBridgeRoom(object):
         if self._has_destroyed:
             return
         self._has_destroyed = True
+        if self._idle_wheel is not None:
+            self._idle_wheel.remove(self.room_id)
 
         participants = list(self._participants.values())
 
         self._participants.clear()
         self._creating_user_id.clear()
 
+        if self._talking_coalescer is not None:
+            self._talking_coalescer.close()
+            self._talking_coalescer = None
+
         # Notify all participants that the fun is over, and that they'll be kicked
         log.debug("Audiobridge Room {} is destroyed, Notifying all participants".format(
             self.room_id)
@@ -943,13 +975,14 @@ class AudioBridgeRoom(object):
                 return self._backend_handle # other greenlet active  
 
             # choose backend server
-            backend_server = _backend_server_mgr.choose_server()
+            backend_server = _backend_server_mgr.choose_server(key=self.room_id)
             if backend_server is None:
                 raise JanusCloudError('No backend server available', JANUS_ERROR_BAD_GATEWAY)   
             
             # 1. create the backend handle
             backend_session = get_backend_session(backend_server.url, 
-                                                auto_destroy=BACKEND_SESSION_AUTO_DESTROY_TIME)
+                                                auto_destroy=BACKEND_SESSION_AUTO_DESTROY_TIME,
+                                                key=self.room_id)
             backend_handle = backend_session.attach_handle(JANUS_AUDIOBRIDGE_PACKAGE, 
                 opaque_id=backend_server.name,
                 handle_listener=self)
@@ -1169,6 +1202,8 @@ class AudioBridgeRoom(object):
         participant = self._participants.pop(participant_id, None)
         if participant is None:
             return  # already removed
+        if self._talking_coalescer is not None:
+            self._talking_coalescer.remove(participant_id)
 
         event = {
             'audiobridge': 'event',
@@ -1205,17 +1240,60 @@ class AudioBridgeRoom(object):
         if self._has_destroyed: # if destroyed, just return
             return
 
+        # the plugin event is encoded only once for all the participants
+        broadcast_msg = JanusBroadcastMsg('event', plugindata={
+            'plugin': JANUS_AUDIOBRIDGE_PACKAGE,
+            'data': event
+        })
         participant_list = list(self._participants.values())
         for participant in participant_list:
             if participant != src_participant:
                 try:
                     # log.debug('Notifying participant {} ({})'.format(participant.user_id, participant.display))
-                    participant.push_audiobridge_event(event)
+                    participant.push_audiobridge_broadcast_event(broadcast_msg)
                 except Exception as e:
                     log.warning('Notify participant {} ({}) of audiobridge room {} Failed:{}'.format(
                         participant.user_id, participant.display, self.room_id, e))
                     pass     # ignore errors during push event to each publisher
 
+    def update_talking(self, participant):
+        """ update the talking state of the participant, which is sent to the participants in the
+        talking-summary event listing the active speakers, except the ones asking for the legacy events """
+        if self._has_destroyed:
+            return
+        if self._talking_coalescer is None:
+            self._talking_coalescer = TalkingCoalescer(
+                send_summary=self._send_talking_summary,
+                get_recipients=self._talking_summary_recipients,
+                window=_talking_coalesce_window,
+                min_interval=_talking_summary_min_interval)
+        speaker = {'id': participant.user_id}
+        if participant.display:
+            speaker['display'] = participant.display
+        self._talking_coalescer.update(participant.user_id, participant.talking, speaker)
+
+    def _talking_summary_recipients(self):
+        return [participant for participant in self._participants.values()
+                if not participant.legacy_talking_events]
+
+    def _send_talking_summary(self, speakers, recipients):
+        if self._has_destroyed:
+            return
+        broadcast_msg = JanusBroadcastMsg('event', plugindata={
+            'plugin': JANUS_AUDIOBRIDGE_PACKAGE,
+            'data': {
+                'audiobridge': 'talking-summary',
+                'room': self.room_id,
+                'talking': speakers
+            }
+        })
+        for participant in recipients:
+            try:
+                participant.push_audiobridge_broadcast_event(broadcast_msg)
+            except Exception as e:
+                log.warning('Notify participant {} ({}) of audiobridge room {} Failed:{}'.format(
+                    participant.user_id, participant.display, self.room_id, e))
+
     def enable_allowed(self):
         log.debug('Enabling the check on allowed authorization tokens for audiobridge room {}'.format(self.room_id))
         self.check_allowed = True
@@ -1525,11 +1603,13 @@ class AudioBridgeRoomManager(object):
         self._auto_cleanup_sec = auto_cleanup_sec
         if 0 < self._auto_cleanup_sec < 60:
             self._auto_cleanup_sec = 60    # above 60 secs
-        self._auto_cleanup_greenlet = None
+        self._idle_wheel = None
+        if self._auto_cleanup_sec > 0:
+            # room auto cleanup is enable
+            self._idle_wheel = TimingWheel('room_auto_cleanup', self._auto_cleanup_sec,
+                                           self._on_rooms_idle_timeout, tick=ROOM_CLEANUP_CHECK_INTERVAL)
         if self._room_dao is not None:
             self._load_from_dao()
-        if auto_cleanup_sec:
-            self._auto_cleanup_greenlet = gevent.spawn(self._room_auto_cleanup_routine)
 
     def __len__(self):
         return len(self._rooms_map)
@@ -1564,6 +1644,7 @@ class AudioBridgeRoomManager(object):
         except Exception as e:
             self._rooms_map.pop(room_id, None)
             raise
+        self._watch_idle(new_room)
         if not new_room.is_private:
             self._public_rooms_list.append(new_room)
 
@@ -1683,48 +1764,43 @@ class AudioBridgeRoomManager(object):
         for room in room_list:
             room.set_backend_admin_key(self._admin_key)
             self._rooms_map[room.room_id] = room
+            self._watch_idle(room)
             if not room.is_private:
                 self._public_rooms_list.append(room)
         log.info('Audiobridge rooms are loaded from DB ({}) successfully, total {} rooms'.format(
             self._room_db,
             len(room_list)))
 
-    def _room_auto_cleanup_routine(self):
+    def _watch_idle(self, room):
+        if self._idle_wheel is not None:
+            room.set_idle_wheel(self._idle_wheel)
+            if room.check_idle():
+                self._idle_wheel.add(room.room_id, room)
+
+    def _on_rooms_idle_timeout(self, expired_rooms):
+        # called by the timing wheel with the rooms which have been idle for auto_cleanup_sec
         cleanup_rooms = []
-        while True:
-            if self._auto_cleanup_sec > 0:
-                # room auto cleanup is enable
-                now = get_monotonic_time()
-                cleanup_rooms.clear()
-                for room in self._rooms_map.values():
-                    if room.check_idle() and now - room.idle_ts > self._auto_cleanup_sec:
-                        cleanup_rooms.append(room)
-                for room in cleanup_rooms:
-                    self._rooms_map.pop(room.room_id, None)  # avoid future usage
-                    if room in self._public_rooms_list:
-                        self._public_rooms_list.remove(room)
-
-                # kick out all timeout session
-                for room in cleanup_rooms:
-                    try:
-                        log.info('Audiobridge room {} timeout for auto cleanup'.format(room.room_id))   
-                        room.destroy()                                            
-                    except Exception as e:
-                        log.warning('Failed to destroy the empty Audiobridge room "{}": {}'.format(room.room_id, e))
-
-                if self._room_dao is not None:
-                    try:
-                        self._room_dao.del_by_list(cleanup_rooms)
-                    except Exception as e:
-                        log.warning('Failed to delete the empty Audiobridge rooms from DB: {}'.format(e))
-
-                cleanup_rooms.clear()
-                delta_time = get_monotonic_time() - now
-                if delta_time < ROOM_CLEANUP_CHECK_INTERVAL:
-                    gevent.sleep(ROOM_CLEANUP_CHECK_INTERVAL - delta_time)
-            else:
-                # session timeout check is disable, just None loop
-                gevent.sleep(ROOM_CLEANUP_CHECK_INTERVAL)
+        for room in expired_rooms:
+            if self._rooms_map.get(room.room_id) is room and room.check_idle():
+                cleanup_rooms.append(room)
+        for room in cleanup_rooms:
+            self._rooms_map.pop(room.room_id, None)  # avoid future usage
+            if room in self._public_rooms_list:
+                self._public_rooms_list.remove(room)
+
+        # destroy all the idle rooms
+        for room in cleanup_rooms:
+            try:
+                log.info('Audiobridge room {} timeout for auto cleanup'.format(room.room_id))
+                room.destroy()
+            except Exception as e:
+                log.warning('Failed to destroy the empty Audiobridge room "{}": {}'.format(room.room_id, e))
+
+        if self._room_dao is not None and cleanup_rooms:
+            try:
+                self._room_dao.del_by_list(cleanup_rooms)
+            except Exception as e:
+                log.warning('Failed to delete the empty Audiobridge rooms from DB: {}'.format(e))
 
 class AudioBridgeHandle(FrontendHandleBase):
 
@@ -2232,6 +2308,7 @@ class AudioBridgeHandle(FrontendHandleBase):
                     handle=self,
                     jsep=jsep,
                     **join_params)
+                new_participant.legacy_talking_events = join_base_info.get('talking_events') == 'legacy'
 
                 # attach publisher to self
                 self.participant_type = JANUS_AUDIOBRIDGE_P_TYPE_PARTICIPANT
@@ -2358,11 +2435,14 @@ class AudioBridgeHandle(FrontendHandleBase):
     def push_event(self, method, transaction=None, **kwargs):
         self._push_event(method=method, transaction=transaction, **kwargs)
 
+    def push_broadcast_event(self, broadcast_msg):
+        self._push_broadcast_event(broadcast_msg)
+
 
-    def choose_server(self, transport=None):
+    def choose_server(self, transport=None, key=None, exclude=()):
         if transport is None:
             transport = self._session.ts
-        return self._plugin.backend_server_mgr.choose_server(self._session.ts)
+        return self._plugin.backend_server_mgr.choose_server(transport, key=key, exclude=exclude)
 
 class AudioBridgePlugin(PluginBase):
     """ This video room plugin """
@@ -2375,6 +2455,9 @@ class AudioBridgePlugin(PluginBase):
         )
         global _backend_server_mgr
         _backend_server_mgr = backend_server_mgr
+        global _talking_coalesce_window, _talking_summary_min_interval
+        _talking_coalesce_window = self.config['general']['talking_coalesce_window'] / 1000
+        _talking_summary_min_interval = self.config['general']['talking_summary_min_interval'] / 1000
         self.backend_server_mgr = backend_server_mgr
         room_dao = None
         if self.config['general']['room_db'].startswith('memory'):
@@ -2393,6 +2476,10 @@ class AudioBridgePlugin(PluginBase):
             raise JanusCloudError(
                 'room_db \'{}\' not support by audiobridge plugin'.format(self.config['general']['room_db']),
                 JANUS_ERROR_NOT_IMPLEMENTED)
+        if proxy_config['general'].get('workers', 1) > 1:
+            # the participants of a room would be split across the workers
+            raise JanusCloudError('audiobridge plugin doesn\'t support the workers mode of janus-proxy',
+                                  JANUS_ERROR_NOT_IMPLEMENTED)
 
         self.room_mgr = AudioBridgeRoomManager(
             room_db=self.config['general']['room_db'],
@@ -2439,6 +2526,8 @@ class AudioBridgePlugin(PluginBase):
                 Optional("admin_key"): Default(StrVal(), default=''),
                 Optional("lock_rtp_forward"): Default(BoolVal(), default=False),
                 Optional("lock_play_file"): Default(BoolVal(), default=False),
+                Optional("talking_coalesce_window"): Default(IntVal(min=0, max=10000), default=0),
+                Optional("talking_summary_min_interval"): Default(IntVal(min=0, max=60000), default=0),
                 AutoDel(str): object  # for all other key we don't care
             }, default={}),
             Optional("rooms"): Default([{
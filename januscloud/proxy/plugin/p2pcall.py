@@ -457,6 +457,10 @@ class P2PCallPlugin(PluginBase):
         else:
             raise JanusCloudError('user_db url {} not support by videocall plugin'.format(self.config['general']['user_db']),
                                   JANUS_ERROR_NOT_IMPLEMENTED)
+        if proxy_config['general'].get('workers', 1) > 1:
+            # the users on the other workers can not be found in memory
+            raise JanusCloudError('p2pcall plugin doesn\'t support the workers mode of janus-proxy',
+                                  JANUS_ERROR_NOT_IMPLEMENTED)
 
         self.api_base_url = self.get_api_base_url(proxy_config)
         #print('api_base_url:', self.api_base_url)
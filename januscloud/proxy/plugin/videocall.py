@@ -556,6 +556,10 @@ class VideoCallPlugin(PluginBase):
         self.user_dao = None
 
         if self.config['general']['user_db'].startswith('memory'):
+            if proxy_config['general'].get('workers', 1) > 1:
+                # the users on the other workers can not be found in memory
+                raise JanusCloudError('videocall plugin requires the user_db of redis in workers mode',
+                                      JANUS_ERROR_NOT_IMPLEMENTED)
             from januscloud.proxy.dao.mem_videocall_user_dao import MemVideoCallUserDao
             self.user_dao = MemVideoCallUserDao()
 
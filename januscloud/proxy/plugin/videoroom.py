@@ -1,13 +1,13 @@
 # -*- coding: utf-8 -*-
 import base64
+import collections
 import copy
 
 import logging
 import re
 from urllib.parse import urlparse
-import random
 from januscloud.common.utils import error_to_janus_msg, create_janus_msg, random_uint64, random_uint32, \
-    get_monotonic_time
+    get_monotonic_time, JanusBroadcastMsg
 from januscloud.common.error import JanusCloudError, JANUS_ERROR_UNKNOWN_REQUEST, JANUS_ERROR_INVALID_REQUEST_PATH, \
     JANUS_ERROR_BAD_GATEWAY, JANUS_ERROR_CONFLICT, JANUS_ERROR_NOT_IMPLEMENTED, JANUS_ERROR_INTERNAL_ERROR, \
     JANUS_ERROR_GATEWAY_TIMEOUT
@@ -17,18 +17,23 @@ from januscloud.common.schema import Schema, Optional, DoNotCare, \
     FloatVal, AutoDel, StrVal, EnumVal
 from januscloud.core import backend_handle
 from januscloud.core.backend_session import get_backend_session
+from januscloud.core.cascade_tree import choose_cascade_parent
+from januscloud.core.talking_coalescer import TalkingCoalescer
 from januscloud.core.plugin_base import PluginBase
+from januscloud.core.timing_wheel import TimingWheel, get_timer_service
 from januscloud.core.frontend_handle_base import FrontendHandleBase, JANUS_PLUGIN_OK_WAIT, JANUS_PLUGIN_OK
 import os.path
 from januscloud.common.confparser import parse as parse_config
 import time
 import gevent
 from januscloud.proxy.rest.common import post_view, get_params_from_request, get_view, delete_view, put_view
+from januscloud.proxy.supervisor import get_worker_index, get_worker_listen
 from pyramid.response import Response
 import sys
 import traceback
 import weakref
 from gevent.lock import BoundedSemaphore
+from gevent.event import Event
 
 
 log = logging.getLogger(__name__)
@@ -39,6 +44,10 @@ ROOM_CLEANUP_CHECK_INTERVAL = 10  # CHECK EMPTY ROOM INTERVAL
 REMOTE_CLEANUP_CHECK_INTERVAL = 1  # CHECK UNUSED REMOTE PUBLISHER INTERVAL
 REMOTE_IDLE_TIMEOUT = 60
 
+DEFAULT_PUBLISHER_BITRATE = 512000  # estimated bitrate of the publisher without any bitrate limit
+PLACEMENT_HISTORY_SIZE = 32         # number of the recent placement decisions kept for each room
+BACKEND_ROOM_WARM_INTERVAL = 5      # check the pre-activated backend rooms every 5s
+
 JANUS_VIDEOROOM_ERROR_UNKNOWN_ERROR = 499
 JANUS_VIDEOROOM_ERROR_NO_MESSAGE = 421
 JANUS_VIDEOROOM_ERROR_INVALID_JSON = 422
@@ -59,6 +68,7 @@ JANUS_VIDEOROOM_ERROR_ID_EXISTS = 436
 JANUS_VIDEOROOM_ERROR_INVALID_SDP = 437
 JANUS_VIDEOROOM_ERROR_ALREADY_DESTROYED = 470
 JANUS_VIDEOROOM_ERROR_ALREADY_BACKEND = 471
+JANUS_VIDEOROOM_ERROR_ROOM_REDIRECT = 472
 
 JANUS_VIDEOROOM_API_SYNC_VERSION = 'v1.1.4(2023-06-15)'
 
@@ -117,6 +127,8 @@ room_params_schema = Schema({
     Optional('lock_record'): BoolVal(),
     Optional('require_e2ee'): BoolVal(),
     Optional('min_publisher_one_backend'): IntVal(min=0, max=100000),
+    Optional('max_subscriber_one_backend'): IntVal(min=0, max=100000),
+    Optional('max_bitrate_one_backend'): IntVal(min=0),
     AutoDel(str): object  # for all other key we must delete
 })
 
@@ -220,6 +232,7 @@ publisher_join_schema = Schema({
     Optional('id'): IntVal(min=1),
     Optional('display'): StrVal(max_len=256),
     Optional('token'): StrVal(max_len=256),
+    Optional('talking_events'): EnumVal(['summary', 'legacy']),
     AutoDel(str): object  # for all other key we must delete
 })
 
@@ -428,6 +441,11 @@ def _send_backend_message(backend_handle, body, jsep=None):
 
     return data, reply_jsep
 
+_backend_room_warmer = None     # BackendRoomWarmer, set by the plugin if enabled
+
+_talking_coalesce_window = 0.0          # seconds to coalesce the talking events, 0 means forwarding one by one
+_talking_summary_min_interval = 0.0     # min seconds between 2 talking summaries to a participant
+
 '''
 class BackendHandleManager(object):
     def __init__(self) -> None:
@@ -590,6 +608,8 @@ class VideoRoomSubscriber(object):
         self._data_feed_ids.clear()
         self._media_feed_ids.clear()
 
+        if self._backend_room:
+            self._backend_room.del_subscriber(self)
         self._backend_room = None
 
         if self._backend_handle:
@@ -644,6 +664,9 @@ class VideoRoomSubscriber(object):
     def get_backend_room(self):
         return self._backend_room
 
+    def estimated_bitrate(self):
+        return sum(publisher.estimated_bitrate() for publisher in self._feeds.values())
+
     def _sync_feeds(self):
 
         room = self.room_wref()
@@ -834,7 +857,8 @@ class VideoRoomSubscriber(object):
 
         # backend session
         backend_session = get_backend_session(backend_room.server_url,
-                                              auto_destroy=BACKEND_SESSION_AUTO_DESTROY_TIME)
+                                              auto_destroy=BACKEND_SESSION_AUTO_DESTROY_TIME,
+                                              key=backend_room.backend_room_id)
         # attach backend handle
         backend_handle = backend_session.attach_handle(JANUS_VIDEOROOM_PACKAGE, handle_listener=self)
         try:
@@ -858,6 +882,7 @@ class VideoRoomSubscriber(object):
 
             self._backend_handle = backend_handle
             self._backend_room = backend_room
+            backend_room.add_subscriber(self)
             self.room_wref = weakref.ref(room)
             self.room_id = room.room_id
 
@@ -874,6 +899,8 @@ class VideoRoomSubscriber(object):
         except Exception:
             backend_handle.detach()
             self._backend_handle = None
+            if self._backend_room:
+                self._backend_room.del_subscriber(self)
             self._backend_room = None
             self.room_wref = None
             self.room_id = 0
@@ -1415,6 +1442,8 @@ class VideoRoomPublisher(object):
 
         self.user_audio_active_packets = 0  # Participant's audio_active_packets overwriting global room setting
         self.user_audio_level_average = 0  # Participant's audio_level_average overwriting global room setting
+        self.bitrate = 0           # Bitrate limit of this publisher, 0 means the limit of the room
+        self.legacy_talking_events = False  # Whether to get the talking events one by one instead of the summary
 
         self.pvt_id = 0     # This is sent to the publisher for mapping purposes, but shouldn't be shared with others
         self.e2ee = False
@@ -1436,6 +1465,7 @@ class VideoRoomPublisher(object):
         self._has_destroyed = False
 
         self._cascade_enabled = handle.is_cascade()
+        self._cascade_max_fanout, self._cascade_location_bias = handle.cascade_tree_params()
 
         self._remote_publishers = {} # all remote publisher of this publisher
         self._children = set() # the children of the cascade forward tree
@@ -1535,7 +1565,8 @@ class VideoRoomPublisher(object):
 
         # backend session
         backend_session = get_backend_session(backend_room.server_url,
-                                              auto_destroy=BACKEND_SESSION_AUTO_DESTROY_TIME)
+                                              auto_destroy=BACKEND_SESSION_AUTO_DESTROY_TIME,
+                                              key=backend_room.backend_room_id)
 
         # attach backend handle
         backend_handle = backend_session.attach_handle(JANUS_VIDEOROOM_PACKAGE, handle_listener=self)
@@ -1601,9 +1632,33 @@ class VideoRoomPublisher(object):
             rp.start(backend_room)  # related network IO
 
     def _add_rp_to_cascade_tree(self, rp):
-        # TODO a algorithm to select a mediate server to 
-        # forward stream to this rp
-        self.add_child(rp)
+        # the rp is forwarded by a node of the tree with less than cascade_max_fanout children,
+        # so that the backend server of this publisher doesn't forward the stream to all the rps
+        location = rp.cascade_location() if self._cascade_location_bias else ''
+        parent = choose_cascade_parent(self, location=location, max_fanout=self._cascade_max_fanout)
+        parent.add_child(rp)
+
+    def reattach_rp(self, rp):
+        """ re-attach rp (with its subtree) to the cascade tree after its parent is destroyed """
+        if rp.has_destroyed():
+            return
+        try:
+            self._add_rp_to_cascade_tree(rp)
+            log.info('{} is re-attached to {} in the cascade tree'.format(rp, rp.get_parent()))
+        except Exception as e:
+            log.warning('Fail to re-attach {} to the cascade tree: {}, destroy it'.format(rp, e))
+            rp.destroy()
+
+    def get_children(self):
+        return self._children.copy()
+
+    def can_forward(self):
+        return not self._has_destroyed and self.webrtc_started and self._backend_handle is not None
+
+    def cascade_location(self):
+        if self._backend_room is None:
+            return ''
+        return self._backend_room.server_location
     
     def _update_rps(self):
         
@@ -1933,6 +1988,7 @@ class VideoRoomPublisher(object):
                             stream.audiolevel_ext = False
 
         if bitrate >= 0:
+            self.bitrate = bitrate
             log.debug('Setting video bitrate: {} (room {}, user {})'.format(
                 bitrate, self.room_id, self.user_id))            
         if audio_active_packets:
@@ -2120,6 +2176,26 @@ class VideoRoomPublisher(object):
     def subscriber_num(self):
         return len(self._subscribers)
 
+    def is_talking(self):
+        for stream in self.streams:
+            if stream.talking:
+                return True
+        return False
+
+    def estimated_bitrate(self):
+        if self.bitrate:
+            return self.bitrate
+        if self.room is not None and self.room.bitrate:
+            return self.room.bitrate
+        return DEFAULT_PUBLISHER_BITRATE
+
+    def is_forwarded_to(self, backend_room):
+        """ whether the media of this publisher is available in the backend room, locally or by cascading """
+        return self._backend_room == backend_room or backend_room.server_name in self._remote_publishers
+
+    def remote_publisher_num(self):
+        return len(self._remote_publishers)
+
     def add_subscription(self, subscriber):
         self._subscriptions.add(subscriber)
 
@@ -2180,6 +2256,12 @@ class VideoRoomPublisher(object):
         if self._frontend_handle:
             self._frontend_handle.push_plugin_event(data=data)
 
+    def push_videoroom_broadcast_event(self, broadcast_msg):
+        if self._has_destroyed:
+            return
+        if self._frontend_handle:
+            self._frontend_handle.push_broadcast_event(broadcast_msg)
+
     def hangup(self):
         if self._has_destroyed:
             return
@@ -2300,10 +2382,7 @@ class VideoRoomPublisher(object):
                     talk_event = data.copy()
                     talk_event['id'] = self.user_id
                     talk_event['room'] = self.room_id
-                    if self._frontend_handle:
-                        self._frontend_handle.push_plugin_event(talk_event)
-                    if self.room:
-                        self.room.notify_other_participants(self, talk_event)
+                    self.room.notify_talking(self, talk_event)
             elif op == 'event':
                 if ('moderation' in data) :
 
@@ -2376,6 +2455,9 @@ class VideoRoomPublisher(object):
                     child.set_parent(None)
                     child.destroy() # async remove
 
+                if self.room:
+                    self.room.clear_talking(self.user_id)
+
                 # notify other participant unpublished
                 unpub_event = {
                     'videoroom': 'event',
@@ -2444,7 +2526,7 @@ class RemotePublisher(object):
         self._subscribers = set()    # Subscriptions to this remote publisher
 
         self._idle_ts = get_monotonic_time()
-        self._idle_check_greenlet = None
+        self._idle_check_started = False
 
         self.utime = time.time()
         self.ctime = time.time()
@@ -2457,7 +2539,9 @@ class RemotePublisher(object):
             return
         self._has_destroyed = True
 
-        self._idle_check_greenlet = None
+        if self._idle_check_started:
+            self._idle_check_started = False
+            get_timer_service().cancel(self)
 
         self._subscribers.clear()
 
@@ -2487,6 +2571,7 @@ class RemotePublisher(object):
             except Exception:
                 pass  # ignore leave failed
         
+        origin_publisher = self.origin_publisher
         if self.origin_publisher:
             self.origin_publisher.on_rp_destroy(self)
             self.origin_publisher = None
@@ -2494,10 +2579,14 @@ class RemotePublisher(object):
         log.info('{} is destroyed'.format(self))
 
 
-        # next, destory all children rps
+        # next, re-attach all children rps to the tree if the origin publisher is still publishing,
+        # otherwise destroy them
         for child in children:
             child.set_parent(None)
-            child.destroy()
+            if origin_publisher is not None and origin_publisher.can_forward():
+                gevent.spawn(origin_publisher.reattach_rp, child)
+            else:
+                child.destroy()
 
     def __str__(self):
         return 'Remote Publisher "{0}" for {1} ({2})'.format(
@@ -2569,9 +2658,9 @@ class RemotePublisher(object):
                 self.host = urlparse(backend_room.server_url).hostname
             self._backend_room = backend_room
             
-            # working greenlet
-            self._idle_check_greenlet = \
-                gevent.spawn(self._idle_check_routine)            
+            # idle check timer
+            self._idle_check_started = True
+            get_timer_service().call_later(self, REMOTE_CLEANUP_CHECK_INTERVAL, self._idle_check)
             
             log.info('{} has started successfully'.format(self)) 
 
@@ -2641,6 +2730,14 @@ class RemotePublisher(object):
     
     def get_children(self):
         return self._children.copy()
+
+    def can_forward(self):
+        return not self._has_destroyed and self._backend_room is not None
+
+    def cascade_location(self):
+        if self._backend_room is None:
+            return ''
+        return self._backend_room.server_location
     
     def add_child(self, remote_p):
         self._assert_valid()
@@ -2726,32 +2823,32 @@ class RemotePublisher(object):
             self._idle_ts = 0
             return False
 
-    def _idle_check_routine(self):
+    def _idle_check(self):
+        # run by the shared timer service every REMOTE_CLEANUP_CHECK_INTERVAL, destroy() would
+        # block for the backend, so it is spawned in a new greenlet
+        if self._has_destroyed:
+            return
 
-        while not self._has_destroyed:
-            # check backend room 
-            if self._backend_room is None or self._backend_room.is_valid() is None:
-                log.info('{} will be destroyed because backend server invalid'.format(self))  
-                try:
-                    self.destroy()
-                except Exception as e:
-                    pass # ignore
-                break # exit 
+        # check backend room
+        if self._backend_room is None or self._backend_room.is_valid() is None:
+            log.info('{} will be destroyed because backend server invalid'.format(self))
+            gevent.spawn(self._destroy_quietly)
+            return
 
-            # check idle
-            now = get_monotonic_time()
-            if self._check_idle() and now - self._idle_ts > REMOTE_IDLE_TIMEOUT:
-                log.info('{} idle timeout {} sec, auto cleanup'.format(self, REMOTE_IDLE_TIMEOUT))  
-                try:
-                    self.destroy()
-                except Exception as e:
-                    pass # ignore
-                break # exit 
+        # check idle
+        now = get_monotonic_time()
+        if self._check_idle() and now - self._idle_ts > REMOTE_IDLE_TIMEOUT:
+            log.info('{} idle timeout {} sec, auto cleanup'.format(self, REMOTE_IDLE_TIMEOUT))
+            gevent.spawn(self._destroy_quietly)
+            return
 
-            gevent.sleep(REMOTE_CLEANUP_CHECK_INTERVAL)
+        get_timer_service().call_later(self, REMOTE_CLEANUP_CHECK_INTERVAL, self._idle_check)
 
-        if self._idle_check_greenlet:
-            self._idle_check_greenlet = None
+    def _destroy_quietly(self):
+        try:
+            self.destroy()
+        except Exception as e:
+            pass # ignore
 
 class BackendRoom(object):
 
@@ -2759,9 +2856,11 @@ class BackendRoom(object):
         self.backend_room_id = backend_room_id
         self.server_name = backend_server.name
         self.server_url = backend_server.url
+        self.server_location = backend_server.location
         self.backend_admin_key = backend_admin_key
         self._room = room
         self._publishers = set()
+        self._subscribers = set()
         self._has_destroyed = False
         self._backend_handle = None
         self._lock = BoundedSemaphore()
@@ -2788,6 +2887,7 @@ class BackendRoom(object):
         self._has_destroyed = True
 
         self._publishers.clear()
+        self._subscribers.clear()
         room_id = 0
         des = ''
 
@@ -2839,7 +2939,8 @@ class BackendRoom(object):
 
             # 1. create the backend handle
             backend_session = get_backend_session(self.server_url,
-                                                auto_destroy=BACKEND_SESSION_AUTO_DESTROY_TIME)
+                                                auto_destroy=BACKEND_SESSION_AUTO_DESTROY_TIME,
+                                                key=self.backend_room_id)
 
             backend_handle = backend_session.attach_handle(
                 JANUS_VIDEOROOM_PACKAGE, 
@@ -2915,7 +3016,7 @@ class BackendRoom(object):
         # the backend room is active by now, edit it
         body = {
             'request': 'edit',
-            'room': self._backend_room_id,
+            'room': self.backend_room_id,
         }
         if new_bitrate is not None:
             body['new_bitrate'] = new_bitrate
@@ -2931,6 +3032,37 @@ class BackendRoom(object):
                 self.server_url)) 
 
 
+    def adopt(self, room):
+        """ take over this pre-activated generic backend room for room
+
+        Janus cannot rename a room, so the backend room keeps its id, and the parameters
+        editable by Janus are edited to the ones of room.
+        """
+        self._assert_valid()
+        if self._backend_handle is None:
+            raise JanusCloudError('Backend room "{}" ({}) is not active'.format(
+                self.backend_room_id, self.server_url),
+                JANUS_VIDEOROOM_ERROR_NO_SUCH_ROOM)
+        template = self._room
+        self._room = room
+        body = {
+            'request': 'edit',
+            'room': self.backend_room_id,
+            'new_description': 'januscloud-{}'.format(room.description)
+        }
+        if template is None or room.bitrate != template.bitrate:
+            body['new_bitrate'] = room.bitrate
+        if template is None or room.fir_freq != template.fir_freq:
+            body['new_fir_freq'] = room.fir_freq
+        if room.rec_dir:
+            body['new_rec_dir'] = room.rec_dir
+        if self.backend_admin_key:
+            body['admin_key'] = self.backend_admin_key
+        _send_backend_message(self._backend_handle, body=body)
+
+        log.info('Backend room "{}"({}) is adopted by room {}({})'.format(
+            self.backend_room_id, self.server_url, room.room_id, room.description))
+
     def add_publisher(self, user_id):
         self._publishers.add(user_id)
 
@@ -2940,6 +3072,55 @@ class BackendRoom(object):
     def publisher_num(self):
         return len(self._publishers)
 
+    def add_subscriber(self, subscriber):
+        self._subscribers.add(subscriber)
+
+    def del_subscriber(self, subscriber):
+        self._subscribers.discard(subscriber)
+
+    def subscriber_num(self):
+        return len(self._subscribers)
+
+    def estimated_bitrate(self):
+        """ estimate the bitrate forwarded by the backend server for this room
+
+        It's the sum of the media received from the publishers (locally or by cascading),
+        the media sent to the subscribers and the media cascaded to the other backend rooms.
+        """
+        if self._room is None:
+            return 0
+        bitrate = 0
+        for publisher in self._room.list_participants():
+            if publisher.get_backend_room() == self:
+                bitrate += publisher.estimated_bitrate() * (1 + publisher.remote_publisher_num())
+            elif publisher.is_forwarded_to(self):
+                bitrate += publisher.estimated_bitrate()
+        for subscriber in self._subscribers:
+            bitrate += subscriber.estimated_bitrate()
+        return bitrate
+
+    def missing_feed_num(self, feed_ids):
+        """ number of the feeds which need to be cascaded to this backend room for subscribing """
+        if self._room is None:
+            return len(feed_ids)
+        missing = 0
+        for feed_id in feed_ids:
+            publisher = self._room.get_participant_by_user_id(feed_id)
+            if publisher is None or not publisher.is_forwarded_to(self):
+                missing += 1
+        return missing
+
+    def get_info(self):
+        return {
+            'server_name': self.server_name,
+            'server_url': self.server_url,
+            'backend_room_id': self.backend_room_id,
+            'active': self._backend_handle is not None,
+            'publishers': self.publisher_num(),
+            'subscribers': self.subscriber_num(),
+            'estimated_bitrate': self.estimated_bitrate()
+        }
+
     def _create_backend(self, backend_handle):
 
         if self._room is None:
@@ -3005,6 +3186,7 @@ class VideoRoom(object):
                  transport_wide_cc_ext=False, record=False, rec_dir='', allowed=None,
                  notify_joining=False, lock_record=False, require_e2ee=False,
                  vp9_profile='', h264_profile='', min_publisher_one_backend=5,
+                 max_subscriber_one_backend=0, max_bitrate_one_backend=0,
                  utime=None, ctime=None):
 
         # public property
@@ -3074,7 +3256,10 @@ class VideoRoom(object):
 
         self.require_e2ee = require_e2ee         # Whether end-to-end encrypted publishers are required
 
-        self.min_publisher_one_backend = min_publisher_one_backend
+        self.min_publisher_one_backend = min_publisher_one_backend    # Publishers packed in a backend room
+        self.max_subscriber_one_backend = max_subscriber_one_backend  # Subscribers in a backend room, 0 means no limit
+        self.max_bitrate_one_backend = max_bitrate_one_backend        # Estimated bitrate forwarded by a backend room,
+                                                                      # 0 means no limit
 
         #internal property
         self._participants = {}                  # Map of potential publishers (we get subscribers from them)
@@ -3085,8 +3270,11 @@ class VideoRoom(object):
 
         self._backend_rooms = {}                 # Map of backend rooms for janus-gateway
         self._backend_admin_key = backend_admin_key
+        self._placements = collections.deque(maxlen=PLACEMENT_HISTORY_SIZE)    # recent placement decisions
+        self._talking_coalescer = None           # TalkingCoalescer, created on the first talking event
 
         self.idle_ts = get_monotonic_time()
+        self._idle_wheel = None                  # timing wheel for auto cleanup, set by the room manager
 
         self._backend_room_id = random_uint64()
 
@@ -3108,12 +3296,22 @@ class VideoRoom(object):
             raise JanusCloudError('No such room ({})'.format(self.room_id),
                                   JANUS_VIDEOROOM_ERROR_NO_SUCH_ROOM)
 
+    def has_destroyed(self):
+        return self._has_destroyed
+
+    def set_idle_wheel(self, idle_wheel):
+        self._idle_wheel = idle_wheel
+
     def check_idle(self):
         if len(self._participants) == 0:
             if self.idle_ts == 0:
                 self.idle_ts = get_monotonic_time()
+                if self._idle_wheel is not None:
+                    self._idle_wheel.add(self.room_id, self)
             return True
         else:
+            if self.idle_ts != 0 and self._idle_wheel is not None:
+                self._idle_wheel.remove(self.room_id)
             self.idle_ts = 0
             return False
 
@@ -3121,10 +3319,16 @@ class VideoRoom(object):
         if self._has_destroyed:
             return
         self._has_destroyed = True
+        if self._idle_wheel is not None:
+            self._idle_wheel.remove(self.room_id)
 
         participants = list(self._participants.values())
         backend_rooms = list(self._backend_rooms.values())
 
+        if self._talking_coalescer is not None:
+            self._talking_coalescer.close()
+            self._talking_coalescer = None
+
         self._participants.clear()
         self._private_id.clear()
         self._creating_user_id.clear()
@@ -3224,33 +3428,71 @@ class VideoRoom(object):
                         backend_room, self.room_id, e))
         
     def choose_backend_room(self, handle):
-        """ get a backend room for a new participant
-        
-        check if the current activated backend room is suitable, 
-        if not, find a backend server according to the global algoithm.
-        
+        """ get a backend room for a new publisher
+
+        If min_publisher_one_backend is not zero, the publisher is packed into the fullest
+        backend room which still has the capacity, so that the room is served by as few backend
+        rooms as possible, and the publishers are cascaded to less backend rooms.
+        Otherwise, or if no backend room has the capacity, a backend server is found according to
+        the global algorithm, the full backend rooms excluded if possible.
+
         """
         if self.min_publisher_one_backend != 0:
-            min_publisher = 1000000
-            backend_room = None
-            # find the backend room of the min publisher
-            for b_room in self._backend_rooms.values():
-                if min_publisher < b_room.publisher_num():
-                    min_publisher = b_room.publisher_num()
-                    backend_room = b_room
-            # return 
-            if backend_room and \
-                min_publisher < self.min_publisher_one_backend:
+            candidates = [b_room for b_room in self._backend_rooms.values()
+                          if self._has_capacity(b_room, publisher=True)]
+            if candidates:
+                backend_room = max(candidates, key=lambda b_room: (b_room.publisher_num(), b_room.subscriber_num()))
                 backend_room.activate()
+                self._record_placement('publisher', backend_room, 'packed')
                 return backend_room
-        
-        # Dispatch a backend server(backend room) according to the global algorithm
-        backend_server = handle.choose_server()
+
+        full_servers = [name for name, b_room in self._backend_rooms.items()
+                        if not self._has_capacity(b_room, publisher=True)]
+        return self._open_backend_room(handle, 'publisher', full_servers)
+
+    def choose_subscriber_backend_room(self, handle, feed_ids=()):
+        """ get a backend room for a new subscriber in cascade mode
+
+        The backend room with the capacity and the least feeds to cascade is chosen, the less
+        loaded one for the tie. A new backend room is opened only if all of them are full.
+        """
+        candidates = [b_room for b_room in self._backend_rooms.values() if self._has_capacity(b_room)]
+        if candidates:
+            backend_room = min(candidates, key=lambda b_room: (b_room.missing_feed_num(feed_ids),
+                                                              b_room.estimated_bitrate()))
+            backend_room.activate()
+            self._record_placement('subscriber', backend_room, 'least_cascade')
+            return backend_room
+        return self._open_backend_room(handle, 'subscriber', list(self._backend_rooms.keys()))
+
+    def _has_capacity(self, backend_room, publisher=False):
+        if not backend_room.is_valid():
+            return False
+        if publisher:
+            if self.min_publisher_one_backend and backend_room.publisher_num() >= self.min_publisher_one_backend:
+                return False
+        elif self.max_subscriber_one_backend and backend_room.subscriber_num() >= self.max_subscriber_one_backend:
+            return False
+        if self.max_bitrate_one_backend and backend_room.estimated_bitrate() >= self.max_bitrate_one_backend:
+            return False
+        return True
+
+    def _open_backend_room(self, handle, participant_type, full_servers=()):
+        """ dispatch a backend server(backend room) according to the global algorithm """
+        # try the other servers if the algorithm picks a full one, the full ones are excluded for the consistent hash
+        for i in range(len(full_servers) + 1):
+            backend_server = handle.choose_server(key=self.room_id, exclude=full_servers)
+            if backend_server is None or backend_server.name not in full_servers:
+                break
         if backend_server is None:
             raise JanusCloudError('No backend server available', JANUS_ERROR_BAD_GATEWAY)
         # activate backend room
         backend_room = self._backend_rooms.get(backend_server.name)
         if backend_room is None:
+            backend_room = self._claim_pooled_backend_room(backend_server)
+            if backend_room is not None:
+                self._record_placement(participant_type, backend_room, 'pooled')
+                return backend_room
             backend_room = BackendRoom(
                 room=self,
                 backend_server=backend_server, 
@@ -3263,21 +3505,55 @@ class VideoRoom(object):
             except Exception as e:
                 backend_room.destroy()
                 raise    # up raise            
+            self._record_placement(participant_type, backend_room, 'new')
         else:
             backend_room.activate()
+            self._record_placement(participant_type, backend_room,
+                                   'over_capacity' if backend_server.name in full_servers else 'server_select')
         return backend_room
-    
-    def _random_backend_room(self, handle):
-        ''' random select one in the current backend rooms'''
-        backend_room_list = list(self._backend_rooms.values())
-        if len(backend_room_list) == 0:
-            return self.choose_backend_room(handle)
-        index = random.randint(0, len(backend_room_list) - 1)
-        backend_room = backend_room_list[index]
 
-        backend_room.activate()
-        return backend_room       
+    def _claim_pooled_backend_room(self, backend_server):
+        if _backend_room_warmer is None:
+            return None
+        backend_room = _backend_room_warmer.claim(backend_server.name, self)
+        if backend_room is None:
+            return None
+        self._backend_rooms[backend_server.name] = backend_room
+        try:
+            backend_room.adopt(self)
+        except Exception as e:
+            log.warning('Fail to adopt {} for room {}: {}, create a new one'.format(backend_room, self.room_id, e))
+            backend_room.destroy()
+            self._backend_rooms.pop(backend_server.name, None)
+            return None
+        return backend_room
 
+    def pre_activate(self, server_chooser):
+        """ activate a backend room in advance on the backend server likely chosen for the first participant
+
+        :param server_chooser: object to choose the backend server, e.g. BackendServerManager
+        """
+        self._assert_valid()
+        if self._backend_rooms:
+            return  # already have
+        self._open_backend_room(server_chooser, 'pre_activate')
+
+    def _record_placement(self, participant_type, backend_room, reason):
+        self._placements.append({
+            'time': int(time.time()),
+            'type': participant_type,
+            'server_name': backend_room.server_name,
+            'reason': reason,
+            'backend_rooms': len(self._backend_rooms)
+        })
+        log.debug('A {} of room {} is placed on backend server {} ({})'.format(
+            participant_type, self.room_id, backend_room.server_name, reason))
+
+    def list_backend_rooms(self):
+        return list(self._backend_rooms.values())
+
+    def list_placements(self):
+        return list(self._placements)
 
     def new_participant(self, user_id, handle, display=''):
         if handle is None:
@@ -3368,10 +3644,14 @@ class VideoRoom(object):
         try:
             if new_subscriber.cascade_enabled():
                 # cascade mode is enabled for this subscriber, backend_room should selected
-                if owner and owner.subscription_num() == 1:
+                if owner and owner.subscription_num() == 1 and owner.get_backend_room() is not None \
+                        and self._has_capacity(owner.get_backend_room()):
                     backend_room = owner.get_backend_room()
                 else:
-                    backend_room = self._random_backend_room(handle)
+                    feed_ids = [stream.get('feed', 0) for stream in join_params.get('streams', [])]
+                    if join_params.get('feed'):
+                        feed_ids.append(join_params['feed'])
+                    backend_room = self.choose_subscriber_backend_room(handle, feed_ids)
             else:
                 backend_room = None
 
@@ -3452,6 +3732,7 @@ class VideoRoom(object):
         if publisher is None:
             return  # already removed
         self._private_id.pop(publisher.pvt_id, None)
+        self.clear_talking(participant_id)
 
         event = {
             'videoroom': 'event',
@@ -3535,16 +3816,81 @@ class VideoRoom(object):
         if self._has_destroyed: # if destroyed, just return
             return
 
+        # the plugin event is encoded only once for all the participants
+        broadcast_msg = JanusBroadcastMsg('event', plugindata={
+            'plugin': JANUS_VIDEOROOM_PACKAGE,
+            'data': event
+        })
         participant_list = list(self._participants.values())
         for publisher in participant_list:
             if publisher != src_participant:
                 try:
-                    publisher.push_videoroom_event(event)
+                    publisher.push_videoroom_broadcast_event(broadcast_msg)
                 except Exception as e:
                     log.warning('Notify publisher {} ({}) of room {} Failed:{}'.format(
                         publisher.user_id, publisher.display, self.room_id, e))
                     pass     # ignore errors during push event to each publisher
     
+    def notify_talking(self, publisher, talk_event):
+        """ notify the talking / stopped-talking event of the publisher
+
+        If the talking events are coalesced, the participants get the talking-summary event
+        listing the active speakers instead, except the ones asking for the legacy events.
+        """
+        if self._has_destroyed:
+            return
+        if _talking_coalesce_window <= 0:
+            publisher.push_videoroom_event(talk_event)
+            self.notify_other_participants(publisher, talk_event)
+            return
+
+        if self._talking_coalescer is None:
+            self._talking_coalescer = TalkingCoalescer(
+                send_summary=self._send_talking_summary,
+                get_recipients=self._talking_summary_recipients,
+                window=_talking_coalesce_window,
+                min_interval=_talking_summary_min_interval)
+        speaker = {'id': publisher.user_id}
+        if publisher.display:
+            speaker['display'] = publisher.display
+        self._talking_coalescer.update(publisher.user_id, publisher.is_talking(), speaker)
+
+        legacy_participants = [participant for participant in self._participants.values()
+                               if participant.legacy_talking_events]
+        if legacy_participants:
+            broadcast_msg = JanusBroadcastMsg('event', plugindata={
+                'plugin': JANUS_VIDEOROOM_PACKAGE,
+                'data': talk_event
+            })
+            for participant in legacy_participants:
+                participant.push_videoroom_broadcast_event(broadcast_msg)
+
+    def clear_talking(self, user_id):
+        if self._talking_coalescer is not None:
+            self._talking_coalescer.remove(user_id)
+
+    def _talking_summary_recipients(self):
+        return [participant for participant in self._participants.values()
+                if not participant.legacy_talking_events]
+
+    def _send_talking_summary(self, speakers, recipients):
+        if self._has_destroyed:
+            return
+        broadcast_msg = JanusBroadcastMsg('event', plugindata={
+            'plugin': JANUS_VIDEOROOM_PACKAGE,
+            'data': {
+                'videoroom': 'talking-summary',
+                'room': self.room_id,
+                'talking': speakers
+            }
+        })
+        for participant in recipients:
+            try:
+                participant.push_videoroom_broadcast_event(broadcast_msg)
+            except Exception as e:
+                log.warning('Notify publisher {} ({}) of room {} Failed:{}'.format(
+                    participant.user_id, participant.display, self.room_id, e))
+
     def enable_allowed(self):
         log.debug('Enabling the check on allowed authorization tokens for room {}'.format(self.room_id))
         self.check_allowed = True
@@ -3605,27 +3951,149 @@ class VideoRoom(object):
                                   JANUS_VIDEOROOM_ERROR_PUBLISHERS_FULL)
 
 
+class BackendRoomWarmer(object):
+    """ Activate the backend rooms in background, so that the first participants of a room on
+    a backend server don't wait for the attach / create / join round trips.
+
+    The rooms given by pre_activate() get a backend room on the backend server likely chosen
+    for their first participant. Besides, pool_size generic backend rooms are kept on each
+    backend server, one of which is claimed by the room opening a new backend room on the
+    server, if the room has the same parameters not editable by Janus as the generic one.
+    """
+
+    # the parameters of the backend room which cannot be changed by the edit request of Janus
+    FIXED_PARAMS = ('audiocodec', 'videocodec', 'opus_fec', 'opus_dtx', 'audiolevel_ext', 'audiolevel_event',
+                    'audio_active_packets', 'audio_level_average', 'videoorient_ext', 'playoutdelay_ext',
+                    'transport_wide_cc_ext', 'require_e2ee', 'h264_profile', 'vp9_profile')
+
+    def __init__(self, backend_server_mgr, pool_size=0, backend_admin_key=''):
+        self._backend_server_mgr = backend_server_mgr
+        self._pool_size = pool_size
+        self._backend_admin_key = backend_admin_key
+        self._template = VideoRoom(room_id=0, description='pool', backend_admin_key=backend_admin_key)
+        self._pools = {}                # server name -> list of the generic backend rooms
+        self._pending_rooms = set()     # rooms to pre-activate
+        self._stats = {
+            'pre_activated': 0,
+            'pool_created': 0,
+            'pool_hits': 0,
+            'pool_misses': 0,
+            'pool_mismatches': 0
+        }
+        self._warm_event = Event()
+        self._warm_greenlet = gevent.spawn(self._warm_routine)
+
+    def pre_activate(self, room):
+        self._pending_rooms.add(room)
+        self._warm_event.set()
+
+    def claim(self, server_name, room):
+        """ take a generic backend room of the server for room, None if not available """
+        if self._pool_size == 0:
+            return None
+        for param in self.FIXED_PARAMS:
+            if getattr(room, param) != getattr(self._template, param):
+                self._stats['pool_mismatches'] += 1
+                return None
+        pool = self._pools.get(server_name, [])
+        backend_room = None
+        while pool:
+            backend_room = pool.pop()
+            if backend_room.is_valid() and backend_room.get_backend_handle() is not None:
+                break
+            backend_room = None
+        if backend_room is None:
+            self._stats['pool_misses'] += 1
+        else:
+            self._stats['pool_hits'] += 1
+        self._warm_event.set()     # refill
+        return backend_room
+
+    def get_stats(self):
+        stats = dict(self._stats)
+        stats['pool_size'] = self._pool_size
+        stats['pooled'] = {name: len(pool) for name, pool in self._pools.items()}
+        stats['pending_rooms'] = len(self._pending_rooms)
+        return stats
+
+    def _warm_routine(self):
+        while True:
+            self._warm_event.wait(timeout=BACKEND_ROOM_WARM_INTERVAL)
+            self._warm_event.clear()
+            try:
+                self._fill_pools()
+                self._pre_activate_rooms()
+            except Exception as e:
+                log.warning('Backend room warmer error: {}'.format(e))
+
+    def _pre_activate_rooms(self):
+        for room in list(self._pending_rooms):
+            if room.has_destroyed():
+                self._pending_rooms.discard(room)
+                continue
+            try:
+                room.pre_activate(self._backend_server_mgr)
+            except Exception as e:
+                # maybe no backend server available yet, retry later
+                log.debug('Fail to pre-activate the backend room of room {}: {}'.format(room.room_id, e))
+            else:
+                self._pending_rooms.discard(room)
+                self._stats['pre_activated'] += 1
+
+    def _fill_pools(self):
+        if self._pool_size == 0:
+            return
+        server_list = self._backend_server_mgr.get_valid_server_list()
+        server_names = set()
+        for server in server_list:
+            server_names.add(server.name)
+            pool = self._pools.setdefault(server.name, [])
+            pool[:] = [backend_room for backend_room in pool if backend_room.is_valid()]
+            while len(pool) < self._pool_size:
+                backend_room = BackendRoom(room=self._template,
+                                           backend_server=server,
+                                           backend_room_id=random_uint64(),
+                                           backend_admin_key=self._backend_admin_key)
+                try:
+                    backend_room.activate()
+                except Exception as e:
+                    log.warning('Fail to create the generic backend room on {}: {}'.format(server.name, e))
+                    backend_room.destroy()
+                    break
+                pool.append(backend_room)
+                self._stats['pool_created'] += 1
+
+        # the backend rooms of the servers gone are destroyed
+        for server_name in list(self._pools.keys()):
+            if server_name not in server_names:
+                for backend_room in self._pools.pop(server_name):
+                    backend_room.destroy()
+
+
 class VideoRoomManager(object):
 
-    def __init__(self, room_db='', room_dao=None, auto_cleanup_sec=0, admin_key=''):
+    def __init__(self, room_db='', room_dao=None, auto_cleanup_sec=0, admin_key='', room_affinity=None):
         self._rooms_map = {}
         self._public_rooms_list = []
         self._admin_key = admin_key
         self._room_dao = room_dao
         self._room_db = room_db
+        self._room_affinity = room_affinity
         self._auto_cleanup_sec = auto_cleanup_sec
         if 0 < self._auto_cleanup_sec < 60:
             self._auto_cleanup_sec = 60    # above 60 secs
-        self._auto_cleanup_greenlet = None
+        self._idle_wheel = None
+        if self._auto_cleanup_sec > 0:
+            # room auto cleanup is enable
+            self._idle_wheel = TimingWheel('room_auto_cleanup', self._auto_cleanup_sec,
+                                           self._on_rooms_idle_timeout, tick=ROOM_CLEANUP_CHECK_INTERVAL)
         if self._room_dao is not None:
             self._load_from_dao()
-        if auto_cleanup_sec:
-            self._auto_cleanup_greenlet = gevent.spawn(self._room_auto_cleanup_routine)
 
     def __len__(self):
         return len(self._rooms_map)
 
-    def create(self, room_id=0, permanent=False, admin_key='', room_params={}):
+    def create(self, room_id=0, permanent=False, admin_key='', room_params={}, claim=True):
         if permanent and self._room_dao is None:
             raise JanusCloudError('permanent not support',
                                   JANUS_VIDEOROOM_ERROR_INVALID_REQUEST)
@@ -3650,10 +4118,20 @@ class VideoRoomManager(object):
             new_room = VideoRoom(room_id=room_id, 
                                  backend_admin_key=self._admin_key,
                                  **room_params)
+            if claim and self._room_affinity is not None:
+                # the room is only known by this proxy (or worker) unless permanent,
+                # so the participants joining on the others are redirected here
+                self._room_affinity.acquire(new_room)
             self._rooms_map[room_id] = new_room
+        except VideoRoomRedirectError:
+            self._rooms_map.pop(room_id, None)
+            new_room.destroy()
+            raise JanusCloudError('Room {} already exists'.format(room_id),
+                                  JANUS_VIDEOROOM_ERROR_ROOM_EXISTS)
         except Exception as e:
             self._rooms_map.pop(room_id, None)
             raise
+        self._watch_idle(new_room)
         if not new_room.is_private:
             self._public_rooms_list.append(new_room)
 
@@ -3705,12 +4183,23 @@ class VideoRoomManager(object):
     def get(self, room_id):
         room = self._rooms_map.get(room_id)
         if room is None:
+            # the room may be created by the other proxies (or workers)
+            room = self._load_room_from_dao(room_id)
+        if room is None:
+            if self._room_affinity is not None:
+                self._room_affinity.check_owner(room_id)
             raise JanusCloudError('No such room ({})'.format(room_id),
                                   JANUS_VIDEOROOM_ERROR_NO_SUCH_ROOM)
         return room
 
     def exists(self, room_id):
-        return room_id in self._rooms_map
+        try:
+            self.get(room_id)
+        except VideoRoomRedirectError:
+            return True
+        except JanusCloudError:
+            return False
+        return True
 
     def destroy(self, room_id, secret='', permanent=False):
         if permanent and self._room_dao is None:
@@ -3723,6 +4212,8 @@ class VideoRoomManager(object):
         if room in self._public_rooms_list:
             self._public_rooms_list.remove(room)
         room.destroy()
+        if self._room_affinity is not None:
+            self._room_affinity.release(room)
 
         saved = False
         if permanent and self._room_dao is not None:
@@ -3752,10 +4243,12 @@ class VideoRoomManager(object):
             room_params = room_params_schema.validate(room_config)
             room = self._rooms_map.get(room_id)
             if room is None:
+                # the rooms of the config file are on all the proxies, claimed when joined
                 self.create(room_id=room_id,
                             permanent=False,
                             admin_key=self._admin_key,
-                            room_params=room_params)
+                            room_params=room_params,
+                            claim=False)
             else:
                 for k, v in room_params.items():
                     if hasattr(room, k):
@@ -3769,48 +4262,183 @@ class VideoRoomManager(object):
         for room in room_list:
             room.set_backend_admin_key(self._admin_key)
             self._rooms_map[room.room_id] = room
+            self._watch_idle(room)
             if not room.is_private:
                 self._public_rooms_list.append(room)
         log.info('Video rooms are loaded from DB ({}) successfully, total {} rooms'.format(
             self._room_db,
             len(room_list)))
 
-    def _room_auto_cleanup_routine(self):
+    def _load_room_from_dao(self, room_id):
+        if self._room_dao is None:
+            return None
+        room = self._room_dao.get_by_room_id(room_id)
+        if room is None or room_id in self._rooms_map:
+            return self._rooms_map.get(room_id)
+        room.set_backend_admin_key(self._admin_key)
+        self._rooms_map[room_id] = room
+        self._watch_idle(room)
+        if not room.is_private:
+            self._public_rooms_list.append(room)
+        log.info('Video room {} is loaded from DB ({})'.format(room_id, self._room_db))
+        return room
+
+    def _watch_idle(self, room):
+        if self._idle_wheel is not None:
+            room.set_idle_wheel(self._idle_wheel)
+            if room.check_idle():
+                self._idle_wheel.add(room.room_id, room)
+
+    def _on_rooms_idle_timeout(self, expired_rooms):
+        # called by the timing wheel with the rooms which have been idle for auto_cleanup_sec
         cleanup_rooms = []
+        for room in expired_rooms:
+            if self._rooms_map.get(room.room_id) is room and room.check_idle():
+                cleanup_rooms.append(room)
+        for room in cleanup_rooms:
+            self._rooms_map.pop(room.room_id, None)  # avoid future usage
+            if room in self._public_rooms_list:
+                self._public_rooms_list.remove(room)
+
+        # destroy all the idle rooms
+        for room in cleanup_rooms:
+            try:
+                log.info('Video room {} timeout for auto cleanup'.format(room.room_id))
+                room.destroy()
+            except Exception as e:
+                log.warning('Failed to destroy the empty room "{}": {}'.format(room.room_id, e))
+            if self._room_affinity is not None:
+                self._room_affinity.release(room)
+
+        if self._room_dao is not None and cleanup_rooms:
+            try:
+                self._room_dao.del_by_list(cleanup_rooms)
+            except Exception as e:
+                log.warning('Failed to delete the empty rooms from DB: {}'.format(e))
+
+class VideoRoomRedirectError(JanusCloudError):
+    """ the room is served by another proxy, the participant should join it there """
+
+    def __init__(self, room_id, owner):
+        super().__init__('Room {} is served by proxy {}'.format(room_id, owner),
+                         JANUS_VIDEOROOM_ERROR_ROOM_REDIRECT)
+        self.room_id = room_id
+        self.owner = owner
+
+
+def get_room_affinity_owner(url, proxy_config, worker_index=None):
+    """ get the address of this proxy (or worker) given to the participants redirected to it
+
+    The placeholders of room_affinity_url are formatted, {worker} is the index of the worker (0 if not
+    in workers mode), {ws_port} / {wss_port} are the port of the worker's own ws / wss listen address,
+    or the port of the shared one if not in workers mode or not configured.
+    """
+    ws_config = proxy_config['ws_transport']
+    fields = {'worker': worker_index or 0}
+    for key in ('ws', 'wss'):
+        listen = ws_config[key + '_listen']
+        worker_listen = ws_config['worker_{}_listen'.format(key)]
+        if worker_index is not None and worker_listen:
+            listen = get_worker_listen(worker_listen, worker_index)
+        fields[key + '_port'] = listen.rpartition(':')[2]
+    try:
+        return url.format(**fields)
+    except (KeyError, IndexError, ValueError) as e:
+        raise JanusCloudError('Invalid room_affinity_url {}: {}'.format(url, e), JANUS_ERROR_NOT_IMPLEMENTED)
+
+
+class VideoRoomAffinity(object):
+    """ This room affinity makes all the participants of a room served by the same proxy
+
+    A proxy claims the ownership of a room in redis when a participant joins it, and the
+    participants trying to join a room owned by another proxy get an error with the address of
+    the owner to join there. So the participants, the backend rooms and the cascading of a room
+    are all managed in one place. The ownership is a lease renewed in background, released when
+    the room is destroyed or idle for a lease, and taken over by others if the owner is down.
+    """
+
+    def __init__(self, owner_dao, owner, lease=30):
+        self._owner_dao = owner_dao
+        self.owner = owner
+        self._lease = lease
+        self._owned_rooms = {}     # room_id -> (room, acquire time) owned by this proxy
+        self._stats = {
+            'claimed': 0,
+            'redirected': 0,
+            'lost': 0,
+        }
+        self._greenlet = gevent.spawn(self._renew_routine)
+
+    def acquire(self, room):
+        """ make sure the room is owned by this proxy, raise VideoRoomRedirectError if owned by another one """
+        owned = self._owned_rooms.get(room.room_id)
+        if owned is not None and owned[0] is room:
+            self._owned_rooms[room.room_id] = (room, get_monotonic_time())
+            return
+        try:
+            owner = self._owner_dao.claim(room.room_id, self.owner)
+        except Exception as e:
+            # serve the room here rather than make it unavailable
+            log.warning('Fail to claim the ownership of video room {}: {}'.format(room.room_id, e))
+            return
+        if owner != self.owner:
+            self._stats['redirected'] += 1
+            raise VideoRoomRedirectError(room.room_id, owner)
+        self._stats['claimed'] += 1
+        self._owned_rooms[room.room_id] = (room, get_monotonic_time())
+
+    def check_owner(self, room_id):
+        """ raise VideoRoomRedirectError if the room is owned by another proxy """
+        owner = self._owner_dao.get_owner(room_id)
+        if owner and owner != self.owner:
+            self._stats['redirected'] += 1
+            raise VideoRoomRedirectError(room_id, owner)
+
+    def release(self, room):
+        owned = self._owned_rooms.get(room.room_id)
+        if owned is None or owned[0] is not room:
+            return
+        del self._owned_rooms[room.room_id]
+        try:
+            self._owner_dao.release(room.room_id, self.owner)
+        except Exception as e:
+            log.warning('Fail to release the ownership of video room {}: {}'.format(room.room_id, e))
+
+    def get_stats(self):
+        stats = {
+            'owner': self.owner,
+            'owned_rooms': len(self._owned_rooms),
+        }
+        stats.update(self._stats)
+        return stats
+
+    def _renew_routine(self):
+        interval = max(self._lease / 3, 1)
         while True:
-            if self._auto_cleanup_sec > 0:
-                # room auto cleanup is enable
-                now = get_monotonic_time()
-                cleanup_rooms.clear()
-                for room in self._rooms_map.values():
-                    if room.check_idle() and now - room.idle_ts > self._auto_cleanup_sec:
-                        cleanup_rooms.append(room)
-                for room in cleanup_rooms:
-                    self._rooms_map.pop(room.room_id, None)  # avoid future usage
-                    if room in self._public_rooms_list:
-                        self._public_rooms_list.remove(room)
-
-                # kick out all timeout session
-                for room in cleanup_rooms:
-                    try:
-                        log.info('Video room {} timeout for auto cleanup'.format(room.room_id))   
-                        room.destroy()                                            
-                    except Exception as e:
-                        log.warning('Failed to destroy the empty room "{}": {}'.format(room.room_id, e))
-
-                if self._room_dao is not None:
-                    try:
-                        self._room_dao.del_by_list(cleanup_rooms)
-                    except Exception as e:
-                        log.warning('Failed to delete the empty rooms from DB: {}'.format(e))
-
-                cleanup_rooms.clear()
-                delta_time = get_monotonic_time() - now
-                if delta_time < ROOM_CLEANUP_CHECK_INTERVAL:
-                    gevent.sleep(ROOM_CLEANUP_CHECK_INTERVAL - delta_time)
-            else:
-                # session timeout check is disable, just None loop
-                gevent.sleep(ROOM_CLEANUP_CHECK_INTERVAL)
+            gevent.sleep(interval)
+            now = get_monotonic_time()
+            # the room which has not been joined for a lease since it's idle is given up
+            release_rooms = [room for room, acquire_ts in self._owned_rooms.values()
+                             if room.has_destroyed() or
+                             (room.idle_ts and now - max(room.idle_ts, acquire_ts) > self._lease)]
+            for room in release_rooms:
+                self.release(room)
+
+            room_ids = list(self._owned_rooms.keys())
+            if not room_ids:
+                continue
+            try:
+                owners = self._owner_dao.claim_list(room_ids, self.owner)
+            except Exception as e:
+                log.warning('Fail to renew the ownership of {} video rooms: {}'.format(len(room_ids), e))
+                continue
+            for room_id, owner in zip(room_ids, owners):
+                if owner != self.owner:
+                    # the lease has expired (e.g. redis was unreachable) and been taken by another proxy
+                    log.error('Video room {} has been taken over by proxy {}'.format(room_id, owner))
+                    self._owned_rooms.pop(room_id, None)
+                    self._stats['lost'] += 1
+
 
 class VideoRoomHandle(FrontendHandleBase):
 
@@ -4229,6 +4857,8 @@ class VideoRoomHandle(FrontendHandleBase):
                     join_base_info = join_base_schema.validate(body)
                     room = self._room_mgr.get(join_base_info['room']). \
                         check_join(join_base_info['pin'])
+                    if self._plugin.room_affinity is not None:
+                        self._plugin.room_affinity.acquire(room)
                     ptype = join_base_info['ptype']
 
                     if ptype == 'publisher':
@@ -4245,6 +4875,7 @@ class VideoRoomHandle(FrontendHandleBase):
                             handle=self,
                             display=join_params.get('display', '')
                         )
+                        new_publisher.legacy_talking_events = join_params.get('talking_events') == 'legacy'
                         try:
                             if request == 'joinandconfigure':
                                 # configure the publisher at once
@@ -4597,6 +5228,14 @@ class VideoRoomHandle(FrontendHandleBase):
             if reply_event:
                 self._push_plugin_event(data=reply_event, jsep=reply_jsep, transaction=transaction)
 
+        except VideoRoomRedirectError as e:
+            log.info('Handle {} is redirected to proxy {} to join room {}'.format(self.handle_id, e.owner, e.room_id))
+            self._push_plugin_event({
+                'videoroom': 'event',
+                'error_code': e.code,
+                'error': str(e),
+                'redirect': e.owner,
+            }, transaction=transaction)
         except JanusCloudError as e:
             log.exception('Fail to handle async message ({}) for handle {}'.format(body, self.handle_id))
             type, dummy, tb = sys.exc_info()
@@ -4639,11 +5278,14 @@ class VideoRoomHandle(FrontendHandleBase):
     def push_event(self, method, transaction=None, **kwargs):
         self._push_event(method=method, transaction=transaction, **kwargs)
 
+    def push_broadcast_event(self, broadcast_msg):
+        self._push_broadcast_event(broadcast_msg)
+
 
-    def choose_server(self, transport=None):
+    def choose_server(self, transport=None, key=None, exclude=()):
         if transport is None:
             transport = self._session.ts
-        return self._plugin.backend_server_mgr.choose_server(self._session.ts)
+        return self._plugin.backend_server_mgr.choose_server(transport, key=key, exclude=exclude)
 
     def is_cascade(self):
         if self._plugin:
@@ -4651,6 +5293,14 @@ class VideoRoomHandle(FrontendHandleBase):
         else:
             return False # default cascade is off
 
+    def cascade_tree_params(self):
+        """ get (cascade_max_fanout, cascade_location_bias) """
+        if self._plugin:
+            return (self._plugin.config['general']['cascade_max_fanout'],
+                    self._plugin.config['general']['cascade_location_bias'])
+        else:
+            return 0, False
+
 
 
 class VideoRoomPlugin(PluginBase):
@@ -4681,15 +5331,59 @@ class VideoRoomPlugin(PluginBase):
                 'room_db \'{}\' not support by videoroom plugin'.format(self.config['general']['room_db']),
                 JANUS_ERROR_NOT_IMPLEMENTED)
 
+        self.room_affinity = None
+        if self.config['general']['room_affinity']:
+            if room_dao is None:
+                raise JanusCloudError('room_affinity requires the room_db of redis',
+                                      JANUS_ERROR_NOT_IMPLEMENTED)
+            owner_url = self.config['general']['room_affinity_url'] or proxy_config['general']['server_name']
+            if not owner_url:
+                raise JanusCloudError('room_affinity requires room_affinity_url or the server_name of janus-proxy',
+                                      JANUS_ERROR_NOT_IMPLEMENTED)
+            owner = get_room_affinity_owner(owner_url, proxy_config, get_worker_index())
+            if proxy_config['general'].get('workers', 1) > 1 and \
+                    get_room_affinity_owner(owner_url, proxy_config, 0) == \
+                    get_room_affinity_owner(owner_url, proxy_config, 1):
+                # all the workers would claim the rooms as the same owner
+                raise JanusCloudError('room_affinity requires a room_affinity_url of each worker in workers mode, '
+                                      'e.g. "wss://proxy1.example.com:{wss_port}" with ws_transport.worker_wss_listen',
+                                      JANUS_ERROR_NOT_IMPLEMENTED)
+            from januscloud.proxy.dao.rd_room_owner_dao import RDRoomOwnerDao
+            self.room_affinity = VideoRoomAffinity(
+                owner_dao=RDRoomOwnerDao(redis_client, lease=self.config['general']['room_affinity_lease']),
+                owner=owner,
+                lease=self.config['general']['room_affinity_lease'])
+        elif proxy_config['general'].get('workers', 1) > 1:
+            # the participants of a room would be split across the workers
+            raise JanusCloudError('videoroom plugin requires room_affinity in workers mode',
+                                  JANUS_ERROR_NOT_IMPLEMENTED)
+
         self.room_mgr = VideoRoomManager(
             room_db=self.config['general']['room_db'],
             room_dao=room_dao,
             auto_cleanup_sec=self.config['general']['room_auto_destroy_timeout'],
-            admin_key=self.config['general']['admin_key']
+            admin_key=self.config['general']['admin_key'],
+            room_affinity=self.room_affinity
         )
 
         self.room_mgr.load_from_config(self.config['rooms'])
 
+        global _talking_coalesce_window, _talking_summary_min_interval
+        _talking_coalesce_window = self.config['general']['talking_coalesce_window'] / 1000
+        _talking_summary_min_interval = self.config['general']['talking_summary_min_interval'] / 1000
+
+        global _backend_room_warmer
+        self.backend_room_warmer = None
+        if self.config['general']['pre_activate_rooms'] or self.config['general']['backend_room_pool_size']:
+            self.backend_room_warmer = BackendRoomWarmer(
+                backend_server_mgr=backend_server_mgr,
+                pool_size=self.config['general']['backend_room_pool_size'],
+                backend_admin_key=self.config['general']['admin_key'])
+            if self.config['general']['pre_activate_rooms']:
+                for room_config in self.config['rooms']:
+                    self.backend_room_warmer.pre_activate(self.room_mgr.get(room_config['room_id']))
+        _backend_room_warmer = self.backend_room_warmer
+
         includeme(pyramid_config)
         pyramid_config.registry.videoroom_plugin = self
 
@@ -4726,6 +5420,15 @@ class VideoRoomPlugin(PluginBase):
                 Optional("admin_key"): Default(StrVal(), default=''),
                 Optional("lock_rtp_forward"): Default(BoolVal(), default=False),
                 Optional("cascade"): Default(BoolVal(), default=False),
+                Optional("cascade_max_fanout"): Default(IntVal(min=0, max=1000), default=0),
+                Optional("cascade_location_bias"): Default(BoolVal(), default=True),
+                Optional("room_affinity"): Default(BoolVal(), default=False),
+                Optional("room_affinity_url"): Default(StrVal(), default=''),
+                Optional("room_affinity_lease"): Default(IntVal(min=3, max=3600), default=30),
+                Optional("pre_activate_rooms"): Default(BoolVal(), default=False),
+                Optional("backend_room_pool_size"): Default(IntVal(min=0, max=64), default=0),
+                Optional("talking_coalesce_window"): Default(IntVal(min=0, max=10000), default=0),
+                Optional("talking_summary_min_interval"): Default(IntVal(min=0, max=60000), default=0),
                 AutoDel(str): object  # for all other key we don't care
             }, default={}),
             Optional("rooms"): Default([{
@@ -4755,6 +5458,7 @@ def includeme(config):
     config.add_route('videoroom_participant', JANUS_VIDEOROOM_API_BASE_PATH + '/rooms/{room_id}/participants/{user_id}')
     config.add_route('videoroom_tokens', JANUS_VIDEOROOM_API_BASE_PATH + '/rooms/{room_id}/tokens')
     config.add_route('videoroom_forwarder_list', JANUS_VIDEOROOM_API_BASE_PATH + '/rooms/{room_id}/rtp_forwarders')
+    config.add_route('videoroom_backend_room_list', JANUS_VIDEOROOM_API_BASE_PATH + '/rooms/{room_id}/backend_rooms')
     config.scan('januscloud.proxy.plugin.videoroom')
 
 
@@ -4773,6 +5477,10 @@ def get_videoroom_info(request):
         'handles': len(plugin.handles),
         'rooms': len(room_mgr)
     }
+    if plugin.room_affinity is not None:
+        videoroom_info['room_affinity'] = plugin.room_affinity.get_stats()
+    if plugin.backend_room_warmer is not None:
+        videoroom_info['backend_room_warmer'] = plugin.backend_room_warmer.get_stats()
     return videoroom_info
 
 
@@ -4828,6 +5536,8 @@ def post_videoroom_room_list(request):
                                permanent=room_base_info['permanent'],
                                admin_key=admin_key,
                                room_params=room_params)
+    if plugin.backend_room_warmer is not None and plugin.config['general']['pre_activate_rooms']:
+        plugin.backend_room_warmer.pre_activate(new_room)
     reply = {
         'videoroom': 'created',
         'room': new_room.room_id,
@@ -5061,3 +5771,22 @@ def delete_videoroom_forwarder_list(request):
     publisher.stop_rtp_forward(stream_info['stream_id'])
 
     return Response(status=200)
+
+
+@get_view(route_name='videoroom_backend_room_list')
+def get_videoroom_backend_room_list(request):
+    plugin = request.registry.videoroom_plugin
+    room_mgr = plugin.room_mgr
+    room_id = int(request.matchdict['room_id'])
+    params = get_params_from_request(request)
+    room_base_info = room_base_schema.validate(params)
+    room = room_mgr.get(room_id).check_modify(room_base_info['secret'])
+
+    return {
+        'room': room.room_id,
+        'min_publisher_one_backend': room.min_publisher_one_backend,
+        'max_subscriber_one_backend': room.max_subscriber_one_backend,
+        'max_bitrate_one_backend': room.max_bitrate_one_backend,
+        'backend_rooms': [backend_room.get_info() for backend_room in room.list_backend_rooms()],
+        'placements': room.list_placements()
+    }
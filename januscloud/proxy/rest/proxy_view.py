@@ -7,10 +7,14 @@ from januscloud.common.schema import Schema, Optional, DoNotCare, \
     FloatVal, AutoDel, StrVal, EnumVal
 from pyramid.response import Response
 from januscloud.core.plugin_base import get_plugin_list
+from januscloud.core.backend_session import get_handle_pool_stats
 
 def includeme(config):
     config.add_route('info', '/info')
     config.add_route('ping', '/ping')
+    config.add_route('ws_transport_stats', '/ws_transport')
+    config.add_route('ws_transport_conn_stats', '/ws_transport/connections')
+    config.add_route('backend_handle_pool_stats', '/backend_handle_pool')
 
 
 
@@ -43,3 +47,22 @@ def get_info(request):
 @get_view(route_name='ping')
 def get_ping(request):
     return 'pong'
+
+
+
+@get_view(route_name='ws_transport_stats')
+def get_ws_transport_stats(request):
+    ws_server_list = getattr(request.registry, 'ws_server_list', [])
+    return [ws_server.get_stats() for ws_server in ws_server_list]
+
+
+@get_view(route_name='ws_transport_conn_stats')
+def get_ws_transport_conn_stats(request):
+    ws_server_list = getattr(request.registry, 'ws_server_list', [])
+    return [{'listen': ws_server.listen, 'connections': ws_server.get_conn_stats()}
+            for ws_server in ws_server_list]
+
+
+@get_view(route_name='backend_handle_pool_stats')
+def get_backend_handle_pool_stats(request):
+    return get_handle_pool_stats()
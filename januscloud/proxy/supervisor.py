@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+""" multi-process mode of Janus-proxy
+
+When general.workers is more than 1, janus-proxy runs as a supervisor which starts so many
+worker processes and restarts them if they exit. Each worker is a complete janus-proxy with
+its own sessions, and all the workers listen on the same ws/wss addresses with SO_REUSEPORT,
+so that the kernel spreads the incoming connections across them. Each worker may listen on
+its own ws/wss address too (ws_transport.worker_ws_listen / worker_wss_listen), so that a
+client can be sent to a given worker, e.g. the owner of a video room with room_affinity.
+
+The admin API of each worker listens on its own local address, the supervisor serves the
+admin API on admin_api.http_listen by forwarding the requests to all the workers:
+
+    GET: the results of the workers are merged, see merge_worker_results()
+    POST/PUT/DELETE: applied to all the workers, succeed if any worker succeeds (e.g. a videocall
+                     request relayed by the other proxies is only handled by the worker of the
+                     callee), otherwise the first failure is returned
+    GET /workers: the status of the worker processes
+
+A room created by POST /plugins/<plugin>/rooms without the room id is given a random one by
+the supervisor, so that all the workers create the same room.
+
+The state which must be shared by all the workers (backend servers, rooms, videocall users)
+should be kept in redis by the DAOs, just as the state shared by many proxies.
+"""
+import os
+import re
+import sys
+import json
+import signal
+import logging
+import subprocess
+import gevent
+from urllib.request import Request as HTTPRequest, urlopen
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, urlencode
+from januscloud.common.utils import get_monotonic_time, random_uint64
+
+log = logging.getLogger(__name__)
+
+WORKER_INDEX_ENV = 'JANUS_PROXY_WORKER_INDEX'
+SUPERVISOR_PID_ENV = 'JANUS_PROXY_SUPERVISOR_PID'
+WORKER_RESTART_DELAY = 1        # secs to wait before restarting an exited worker
+WORKER_STOP_TIMEOUT = 10        # secs to wait for the workers to quit before killing them
+WORKER_API_TIMEOUT = 10         # secs to wait for the admin API response of a worker
+WORKER_START_FAILED_EXIT_CODE = 78      # EX_CONFIG, the worker fails to start, e.g. the config is not supported
+ROOM_CREATE_PATH = re.compile(r'^/plugins/\w+/rooms/?$')
+
+
+def get_worker_index():
+    """ get the index of this worker process, None if not started by the supervisor """
+    value = os.environ.get(WORKER_INDEX_ENV)
+    if not value:
+        return None
+    return int(value)
+
+
+def get_supervisor_pid():
+    """ get the pid of the supervisor which started this worker process """
+    return int(os.environ.get(SUPERVISOR_PID_ENV) or 0)
+
+
+def get_worker_listen(listen, worker_index):
+    """ get the listen address of the worker, the port of the first worker is increased one by one """
+    host, sep, port = listen.rpartition(':')
+    return '{}:{}'.format(host, int(port) + worker_index)
+
+
+def get_worker_http_listen(config, worker_index):
+    """ get the admin API listen address of the worker """
+    return get_worker_listen(config['admin_api']['worker_http_listen'], worker_index)
+
+
+def get_worker_log_file(log_file, worker_index):
+    """ each worker writes its own log file, since a rotating file can not be shared by processes """
+    if not log_file:
+        return log_file
+    root, ext = os.path.splitext(log_file)
+    return '{}.worker{}{}'.format(root, worker_index, ext)
+
+
+# the fields of the admin API results which count something in each worker, summed over the workers.
+# The counter fields of a dict in this set (e.g. the pooled rooms of each server) are summed too
+WORKER_COUNTER_KEYS = frozenset([
+    # plugin info
+    'handles',
+    # ws transport and its request dispatcher
+    'connections', 'queued_messages', 'dropped', 'coalesced', 'evicted', 'rejected',
+    'raw_bytes_out', 'wire_bytes_out', 'compress_ms', 'raw_bytes_in', 'wire_bytes_in', 'decompress_ms',
+    'workers', 'busy_keys', 'queued_tasks',
+    # backend handle pool
+    'warm_handles', 'hits', 'misses',
+    # videoroom backend room warmer and room affinity
+    'pre_activated', 'pool_created', 'pool_hits', 'pool_misses', 'pool_mismatches', 'pooled', 'pending_rooms',
+    'owned_rooms', 'claimed', 'redirected', 'lost',
+])
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _item_key(item):
+    return json.dumps(item, sort_keys=True, default=str)
+
+
+def merge_worker_results(results, counter=False):
+    """ merge the results of the same GET request on all the workers
+
+    The numbers of the fields in WORKER_COUNTER_KEYS are summed. The items of the lists found on
+    all the workers (e.g. the servers or rooms kept in redis) are returned once, the others are
+    concatenated with the index of the worker added to their dict items. The dicts are merged
+    field by field. Any other value is returned as it is if identical on all the workers (e.g.
+    the shared state or config), otherwise as a dict of the worker index to the value of the worker.
+
+    :param results: list of (worker_index, value)
+    :param counter: whether the values are counters
+    :return: the merged value
+    """
+    values = [value for worker_index, value in results]
+    if counter and all(_is_number(value) for value in values):
+        return sum(values)
+    if all(isinstance(value, list) for value in values):
+        keys = [set(_item_key(item) for item in value) for value in values]
+        shared = set.intersection(*keys)
+        merged = []
+        for worker_index, value in results:
+            for item in value:
+                key = _item_key(item)
+                if key in shared:
+                    if worker_index == results[0][0]:
+                        merged.append(item)
+                    continue
+                if isinstance(item, dict):
+                    item = dict(item, worker=worker_index)
+                merged.append(item)
+        return merged
+    if all(isinstance(value, dict) for value in values):
+        merged = {}
+        for worker_index, value in results:
+            for key in value:
+                if key not in merged:
+                    merged[key] = merge_worker_results(
+                        [(index, other[key]) for index, other in results if key in other],
+                        counter=counter or key in WORKER_COUNTER_KEYS)
+        return merged
+    if all(value == values[0] for value in values[1:]):
+        return values[0]
+    return {worker_index: value for worker_index, value in results}
+
+
+def fill_room_id(query_string, body, content_type):
+    """ give a random room id to the room creating request if not specified, as the plugin does
+
+    :return: (query_string, body) of the request
+    """
+    query = parse_qsl(query_string or '')
+    if any(value not in ('', '0') for key, value in query if key == 'room'):
+        return query_string, body
+    room_id = random_uint64()
+    if body and 'json' in (content_type or ''):
+        params = json.loads(body.decode('utf-8'))
+        if isinstance(params, dict):
+            if params.get('room'):
+                return query_string, body
+            params['room'] = room_id
+            return query_string, json.dumps(params).encode('utf-8')
+    elif body:
+        form = parse_qsl(body.decode('utf-8'))
+        if any(value not in ('', '0') for key, value in form if key == 'room'):
+            return query_string, body
+        form = [(key, value) for key, value in form if key != 'room'] + [('room', str(room_id))]
+        return query_string, urlencode(form).encode('utf-8')
+    query = [(key, value) for key, value in query if key != 'room'] + [('room', str(room_id))]
+    return urlencode(query), body
+
+
+class WorkerProcess(object):
+
+    def __init__(self, worker_index, args, http_listen):
+        self.worker_index = worker_index
+        self.args = args
+        self.http_listen = http_listen
+        self.process = None
+        self.restarts = 0
+        self.start_time = 0
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else 0
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        env = dict(os.environ)
+        env[WORKER_INDEX_ENV] = str(self.worker_index)
+        env[SUPERVISOR_PID_ENV] = str(os.getpid())
+        self.process = subprocess.Popen(self.args, env=env)
+        self.start_time = get_monotonic_time()
+        log.info('Janus-proxy worker {} is started (pid {})'.format(self.worker_index, self.process.pid))
+
+    def signal(self, signum):
+        if self.is_running():
+            try:
+                self.process.send_signal(signum)
+            except OSError:
+                pass
+
+    def to_dict(self):
+        return {
+            'worker': self.worker_index,
+            'pid': self.pid,
+            'running': self.is_running(),
+            'restarts': self.restarts,
+            'uptime': int(get_monotonic_time() - self.start_time) if self.is_running() else 0,
+            'http_listen': self.http_listen,
+        }
+
+
+class Supervisor(object):
+    """ This supervisor starts the worker processes, and restarts the exited ones until stopped """
+
+    def __init__(self, worker_num, worker_args, config):
+        """
+        :param worker_num: number of the worker processes
+        :param worker_args: command line to start a worker process
+        :param config: the config of janus-proxy
+        """
+        self._workers = [WorkerProcess(worker_index, worker_args, get_worker_http_listen(config, worker_index))
+                         for worker_index in range(worker_num)]
+        self._watchers = []
+        self._stopping = False
+        self._start_failed_cbk = None
+
+    @property
+    def workers(self):
+        return self._workers
+
+    def start(self, start_failed_cbk=None):
+        """
+        :param start_failed_cbk: called if a worker fails to start at the first time, since the
+                                 others would fail for the same reason, e.g. the config is not supported
+        """
+        self._start_failed_cbk = start_failed_cbk
+        for worker in self._workers:
+            worker.start()
+            self._watchers.append(gevent.spawn(self._watch_routine, worker))
+
+    def stop(self):
+        if self._stopping:
+            return
+        self._stopping = True
+        log.info('Stop all the Janus-proxy workers...')
+        for worker in self._workers:
+            worker.signal(signal.SIGTERM)
+        gevent.joinall(self._watchers, timeout=WORKER_STOP_TIMEOUT)
+        for worker in self._workers:
+            if worker.is_running():
+                log.error('Janus-proxy worker {} (pid {}) does not quit in {} secs, killed'.format(
+                    worker.worker_index, worker.pid, WORKER_STOP_TIMEOUT))
+                worker.signal(signal.SIGKILL)
+        gevent.killall(self._watchers)
+
+    def _watch_routine(self, worker):
+        while True:
+            returncode = worker.process.wait()
+            if self._stopping:
+                log.info('Janus-proxy worker {} (pid {}) quits'.format(worker.worker_index, worker.pid))
+                return
+            if returncode == WORKER_START_FAILED_EXIT_CODE and worker.restarts == 0:
+                log.error('Janus-proxy worker {} (pid {}) fails to start, not restarted'.format(
+                    worker.worker_index, worker.pid))
+                if self._start_failed_cbk is not None:
+                    self._start_failed_cbk()
+                return
+            log.error('Janus-proxy worker {} (pid {}) exits unexpectedly with code {}, restart it'.format(
+                worker.worker_index, worker.pid, returncode))
+            gevent.sleep(WORKER_RESTART_DELAY)
+            if self._stopping:
+                return
+            worker.restarts += 1
+            worker.start()
+
+    def call_workers(self, method, path, body=None, content_type=None):
+        """ send the admin API request to all the workers concurrently
+
+        :return: list of (worker_index, status_code, response_body), status_code is 0 if the worker can not
+                 be reached
+        """
+        greenlets = [gevent.spawn(self._call_worker, worker, method, path, body, content_type)
+                     for worker in self._workers]
+        gevent.joinall(greenlets)
+        return [greenlet.value for greenlet in greenlets]
+
+    @staticmethod
+    def _call_worker(worker, method, path, body, content_type):
+        request = HTTPRequest('http://{}{}'.format(worker.http_listen, path), data=body, method=method)
+        if content_type:
+            request.add_header('Content-Type', content_type)
+        try:
+            with urlopen(request, timeout=WORKER_API_TIMEOUT) as response:
+                return worker.worker_index, response.status, response.read()
+        except HTTPError as e:
+            return worker.worker_index, e.code, e.read()
+        except Exception as e:
+            log.warning('Fail to call the admin API {} {} of worker {}: {}'.format(
+                method, path, worker.worker_index, e))
+            return worker.worker_index, 0, b''
+
+
+class AdminAPIAggregator(object):
+    """ WSGI application of the supervisor admin API, which forwards the requests to the workers """
+
+    def __init__(self, supervisor, json_codec):
+        self._supervisor = supervisor
+        self._json_codec = json_codec
+
+    def __call__(self, environ, start_response):
+        method = environ['REQUEST_METHOD']
+        path = environ.get('PATH_INFO', '/')
+        query_string = environ.get('QUERY_STRING')
+        if path == '/workers' and method == 'GET':
+            workers = [worker.to_dict() for worker in self._supervisor.workers]
+            return self._response(start_response, 200, self._json_codec.encode(workers).encode('utf-8'))
+
+        content_length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = environ['wsgi.input'].read(content_length) if content_length else None
+        if method == 'POST' and ROOM_CREATE_PATH.match(path):
+            try:
+                query_string, body = fill_room_id(query_string, body, environ.get('CONTENT_TYPE'))
+            except ValueError:
+                pass    # let the workers reject the invalid request
+        if query_string:
+            path += '?' + query_string
+        results = self._supervisor.call_workers(method, path, body, environ.get('CONTENT_TYPE'))
+        reached = [result for result in results if result[1]]
+        if not reached:
+            return self._response(start_response, 503, b'No Janus-proxy worker is available')
+        if method != 'GET':
+            # the request is applied to all the workers, return the first success if any
+            succeeded = [result for result in reached if 200 <= result[1] < 300]
+            for worker_index, status_code, response_body in results:
+                if status_code < 200 or status_code >= 300:
+                    if not succeeded:
+                        return self._response(start_response, status_code or 503, response_body)
+                    log.warning('Admin API {} {} fails on worker {} with status {}'.format(
+                        method, path, worker_index, status_code))
+            return self._response(start_response, succeeded[0][1], succeeded[0][2])
+
+        for worker_index, status_code, response_body in reached:
+            if status_code != 200:
+                return self._response(start_response, status_code, response_body)
+        try:
+            merged = merge_worker_results([(worker_index, self._json_codec.decode(response_body.decode('utf-8')))
+                                           for worker_index, status_code, response_body in reached])
+        except ValueError:
+            # not json, return the response of the first worker
+            return self._response(start_response, 200, reached[0][2])
+        return self._response(start_response, 200, self._json_codec.encode(merged).encode('utf-8'))
+
+    @staticmethod
+    def _response(start_response, status_code, body):
+        start_response('{} {}'.format(status_code, _STATUS_REASONS.get(status_code, 'Unknown')), [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Access-Control-Allow-Origin', '*'),
+        ])
+        return [body]
+
+
+_STATUS_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+
+if __name__ == '__main__':
+    # load test: ping requests per second over websocket with 1, 2, 4 ... workers
+    #
+    #   python -m januscloud.proxy.supervisor [max_workers [duration [connections]]]
+    #
+    # the load is generated by as many client processes as the cores, each with
+    # connections / cores websocket connections sending ping requests in a closed loop
+    import gevent.monkey
+    gevent.monkey.patch_all()
+    import socket
+    import tempfile
+
+    def run_client(port, duration, conn_num):
+        from ws4py.client.geventclient import WebSocketClient
+        counter = [0]
+        deadline = get_monotonic_time() + duration
+        request = json.dumps({'janus': 'ping', 'transaction': 'load'})
+
+        def conn_routine():
+            ws = WebSocketClient('ws://127.0.0.1:{}'.format(port), protocols=['janus-protocol'])
+            ws.connect()
+            while get_monotonic_time() < deadline:
+                ws.send(request)
+                if ws.receive() is None:
+                    break
+                counter[0] += 1
+            ws.close()
+
+        gevent.joinall([gevent.spawn(conn_routine) for i in range(conn_num)])
+        print(counter[0])
+
+    def wait_port(port, timeout=30):
+        deadline = get_monotonic_time() + timeout
+        while get_monotonic_time() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return
+            except OSError:
+                gevent.sleep(0.2)
+        raise RuntimeError('proxy is not ready on port {}'.format(port))
+
+    def run_proxy(worker_num, duration, conn_num, port=18288):
+        cores = os.cpu_count() or 1
+        conf = tempfile.NamedTemporaryFile('w', suffix='.yml', delete=False)
+        conf.write('general:\n  workers: {}\n'
+                   'log:\n  log_to_stdout: false\n  log_to_file: ""\n  debug_level: ERROR\n'
+                   'ws_transport:\n  ws: true\n  ws_listen: "127.0.0.1:{}"\n  json: compact\n'
+                   'admin_api:\n  http_listen: "127.0.0.1:18100"\n  worker_http_listen: "127.0.0.1:18110"\n'.format(
+                       worker_num, port))
+        conf.close()
+        proxy = subprocess.Popen([sys.executable, '-m', 'januscloud.proxy.main', conf.name],
+                                 stdout=subprocess.DEVNULL)
+        try:
+            wait_port(port)
+            gevent.sleep(1)   # let all the workers listen
+            clients = [subprocess.Popen([sys.executable, '-m', 'januscloud.proxy.supervisor', '--client', str(port),
+                                         str(duration), str(max(conn_num // cores, 1))], stdout=subprocess.PIPE)
+                       for i in range(cores)]
+            total = sum(int(client.communicate()[0]) for client in clients)
+            return total / duration
+        finally:
+            proxy.send_signal(signal.SIGTERM)
+            proxy.wait()
+            os.unlink(conf.name)
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--client':
+        run_client(int(sys.argv[2]), float(sys.argv[3]), int(sys.argv[4]))
+    else:
+        max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 1)
+        duration = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+        conn_num = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+        print('cores: {}, connections: {}, duration: {} secs'.format(os.cpu_count(), conn_num, duration))
+        base = None
+        worker_num = 1
+        while worker_num <= max_workers:
+            rate = run_proxy(worker_num, duration, conn_num)
+            base = base or rate
+            print('{:>3} workers: {:>10.0f} msg/s, {:>5.2f}x'.format(worker_num, rate, rate / base))
+            worker_num *= 2
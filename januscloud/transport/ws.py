@@ -1,51 +1,163 @@
 # -*- coding: utf-8 -*-
 import urllib.parse
-import json
+import socket
 import logging
+from collections import deque
 import gevent
+from gevent.baseserver import parse_address
 from ws4py.websocket import WebSocket
 from ws4py.server.geventserver import WSGIServer
 from ws4py.server.wsgiutils import WebSocketWSGIApplication
 from ws4py.client.geventclient import WebSocketClient
-from gevent import Greenlet
 from gevent.lock import RLock
-from gevent.pool import Pool
+from gevent.event import Event
 from januscloud.core.request import Request
-from januscloud.common.utils import get_monotonic_time
+from januscloud.core.dispatcher import FairDispatcher
+from januscloud.core.timing_wheel import get_timer_service
+from januscloud.common.utils import get_monotonic_time, error_to_janus_msg
+from januscloud.common.error import JanusCloudError, JANUS_ERROR_SERVICE_UNAVAILABLE
+from januscloud.common.json_codec import get_json_codec
+from januscloud.transport.ws_deflate import PERMESSAGE_DEFLATE, PerMessageDeflate, DeflateError, negotiate_deflate_offer, \
+    make_deflate_offer, get_agreed_extension
 
 log = logging.getLogger(__name__)
 
+# the plugin events which can be dropped or coalesced for a slow consumer
+DROPPABLE_PLUGIN_EVENTS = {
+    'talking': 'talking',
+    'stopped-talking': 'talking',
+    'slow_link': 'slow_link',
+}
+
+
+def droppable_key(message):
+    """ return the coalescing key of a droppable event message, or None if the message cannot be dropped
+
+    The later event with the same key supersedes the former one, e.g. the stopped-talking event
+    of a participant supersedes its talking event
+    """
+    method = message.get('janus')
+    if method == 'slowlink':
+        return message.get('sender'), 'slowlink', message.get('mid'), message.get('uplink')
+    if method != 'event':
+        return None
+    plugindata = message.get('plugindata')
+    if not isinstance(plugindata, dict):
+        return None
+    data = plugindata.get('data')
+    if not isinstance(data, dict):
+        return None
+    op = data.get('videoroom') or data.get('audiobridge')
+    kind = DROPPABLE_PLUGIN_EVENTS.get(op)
+    if kind is None:
+        return None
+    return message.get('sender'), kind, data.get('id'), data.get('mindex')
+
+
+def _deflate_send(ws, payload, binary):
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    # compressed in the lock, so the frames are sent in the order of the compression context
+    with ws._write_lock:
+        frame = ws._deflate.compress_message(payload, binary)
+        if frame is None:
+            WebSocket.send(ws, payload, binary)
+        else:
+            ws._write(frame)
+
+
+def _deflate_process(ws, data):
+    try:
+        frames = ws._deflate.inflate_frames(data)
+    except DeflateError as e:
+        log.warning('Failed to inflate the message on {}: {}'.format(ws, e))
+        ws.close(1009, str(e))
+        return False
+    for frame in frames:
+        if not WebSocket.process(ws, frame):
+            return False
+    ws.reading_buffer_size = PerMessageDeflate.READING_SIZE
+    return True
+
+
+class WSServerApplication(WebSocketWSGIApplication):
+    """ WSGI application which negotiates permessage-deflate extension in handshake """
+
+    class _AgreedExtensions(object):
+        # the extension header is rewritten to the agreed one before handshake, so accept it
+        def __contains__(self, extension):
+            return extension.startswith(PERMESSAGE_DEFLATE)
+
+    def __init__(self, deflate=False, deflate_window_bits=15, deflate_context_takeover=True, **kwargs):
+        super(WSServerApplication, self).__init__(**kwargs)
+        self._deflate = deflate
+        self._deflate_window_bits = deflate_window_bits
+        self._deflate_context_takeover = deflate_context_takeover
+        self.extensions = self._AgreedExtensions()
+
+    def __call__(self, environ, start_response):
+        offers = environ.pop('HTTP_SEC_WEBSOCKET_EXTENSIONS', None)
+        if offers and self._deflate:
+            extension = negotiate_deflate_offer(offers, self._deflate_window_bits, self._deflate_context_takeover)
+            if extension:
+                environ['HTTP_SEC_WEBSOCKET_EXTENSIONS'] = extension
+        return super(WSServerApplication, self).__call__(environ, start_response)
+
 
 class WSServerConn(WebSocket):
 
-    DEFAULT_ENCODER = json.JSONEncoder()
-    DEFAULT_DECODER = json.JSONDecoder()
     DEFAULT_MSG_HANDLE_THREAD_POOL_SIZE = 8
 
     def __init__(self, *args, **kwargs):
 
         super(WSServerConn, self).__init__(*args, **kwargs)
 
-        json_indent = self.environ.get('json_indent')
-        if json_indent == 'indented':
-            self._msg_encoder = json.JSONEncoder(indent=3)
-        elif json_indent == 'plain':
-            self._msg_encoder = json.JSONEncoder(indent=None)
-        elif json_indent == 'compact':
-            self._msg_encoder = json.JSONEncoder(indent=None, separators=(',', ':'))
-        else:
-            self._msg_encoder = self.DEFAULT_ENCODER
-
-        self._msg_decoder = self.DEFAULT_DECODER
+        # codecs are shared by all the connections, so that a broadcast message can be encoded
+        # only once for the connections of the same json codec
+        json_codec = get_json_codec(self.environ.get('json_codec', 'json'),
+                                    self.environ.get('json_indent', 'plain'))
+        self._msg_encoder = json_codec
+        self._msg_decoder = json_codec
 
         self._recv_msg_cbk = None
         self._closed_cbk = None
         self._write_lock = RLock()
 
+        # permessage-deflate, agreed by WSServerApplication in handshake
+        self._deflate = None
+        extension = get_agreed_extension(self.extensions)
+        if extension:
+            self._deflate = PerMessageDeflate(extension, is_server=True,
+                                              min_size=self.environ.get('deflate_min_size', 0))
+            self.reading_buffer_size = PerMessageDeflate.READING_SIZE
+
+        # outbound send queue drained by one sender greenlet
+        self._send_queue = deque()
+        self._send_queue_event = Event()
+        self._send_greenlet = None
+        self._send_closed = False
+        self._send_timeout = 30
+        self._coalesce_entries = {}     # droppable key -> entry in send queue
+        self._congested_ts = 0           # when the queue depth went above the high watermark
+        self._send_queue_size = self.environ.get('send_queue_size', 0)
+        self._send_queue_hwm = self.environ.get('send_queue_high_watermark', 0)
+        self._send_queue_lwm = self.environ.get('send_queue_low_watermark', 0)
+        self._drop_policy = self.environ.get('send_queue_drop_policy', 'none')
+        self._slow_consumer_timeout = self.environ.get('slow_consumer_timeout', 0)
+        if self._send_queue_size:
+            if not 0 < self._send_queue_hwm <= self._send_queue_size:
+                self._send_queue_hwm = self._send_queue_size
+            if not 0 <= self._send_queue_lwm <= self._send_queue_hwm:
+                self._send_queue_lwm = self._send_queue_hwm
+        self._stats = self.environ.get('app.stats')
+        self._conns = self.environ.get('app.conns')
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_queue_depth = 0
+
         # pingpong check mechanism
         self._ping_ts = 0
         self._last_active_ts = 0
-        self._pingpong_check_greenlet = None
         self._pingpong_trigger = self.environ.get('pingpong_trigger', 0)
         self._pingpong_timeout = self.environ.get('pingpong_timeout', 0)
         if self._pingpong_trigger:
@@ -62,11 +174,27 @@ class WSServerConn(WebSocket):
         with self._write_lock:
             return super()._write(b)
 
+    def send(self, payload, binary=False):
+        if self._deflate is None:
+            return super().send(payload, binary)
+        _deflate_send(self, payload, binary)
+
+    def process(self, data):
+        if self._deflate is None or not data:
+            return super().process(data)
+        return _deflate_process(self, data)
+
+    def deflate_stats(self):
+        return self._deflate.get_stats() if self._deflate else None
+
     def opened(self):
+        if self._conns is not None:
+            self._conns.add(self)
+
         # start check idle
         if self._pingpong_trigger:
             self._last_active_ts = get_monotonic_time()
-            self._pingpong_check_greenlet = gevent.spawn(self._pingpong_check_routine)
+            get_timer_service().call_later(self, self._pingpong_trigger, self._pingpong_check)
 
         # create app
         try:
@@ -85,7 +213,15 @@ class WSServerConn(WebSocket):
 
     def closed(self, code, reason=None):
         log.info('Closed {0}: {1}'.format(self, reason))
-        self._pingpong_check_greenlet = None
+        if self._pingpong_trigger:
+            get_timer_service().cancel(self)
+        if self._conns is not None:
+            self._conns.discard(self)
+        # stop the sender greenlet
+        self._send_closed = True
+        self._send_queue.clear()
+        self._coalesce_entries.clear()
+        self._send_queue_event.set()
         if self._closed_cbk:
             self._closed_cbk(self)
 
@@ -103,7 +239,7 @@ class WSServerConn(WebSocket):
                     self._recv_msg_cbk(
                         self,
                         self._msg_decoder.decode(str(message)),
-                        self._on_recv_msg_cbk_greenlet_exception
+                        self._on_recv_msg_cbk_exception
                     )
                 except Exception:
                     log.exception('Failed to handle received msg on {0}'.format(self))
@@ -113,16 +249,162 @@ class WSServerConn(WebSocket):
         """
         send message
         :param message: object which can be encoded by msg_encoder (by default json encoder)
-        :param timeout: send timeout in second, if timeout, gevent.Timeout exception will be raised
+        :param timeout: send timeout in second, if timeout, gevent.Timeout exception will be raised.
+                        If the send queue is enabled, the message is only queued and sent by the
+                        sender greenlet, so the timeout is ignored
+        :return:
+        """
+        if self.server_terminated:
+            raise Exception('Already closed: {0}'.format(self))
+        key = droppable_key(message) if self._send_queue_size else None
+        self.send_frame(self._msg_encoder.encode(message), key=key, timeout=timeout)
+        #log.debug("Sent message to {0}: {1}".format(self, self._msg_encoder.encode(message)))
+
+    def send_broadcast_message(self, broadcast_msg, session_id=0, sender=None, opaque_id=None, timeout=30):
+        """
+        send a message broadcast to many connections, whose common part is only encoded once
+        :param broadcast_msg: instance of januscloud.common.utils:JanusBroadcastMsg
+        :param session_id: session id of the recipient
+        :param sender: handle id of the recipient
+        :param opaque_id: opaque id of the recipient handle
+        :param timeout: the same as send_message()
+        :return:
+        """
+        if self.server_terminated:
+            raise Exception('Already closed: {0}'.format(self))
+        key = None
+        if self._send_queue_size:
+            key = droppable_key(broadcast_msg.to_msg(session_id, sender, opaque_id))
+        self.send_frame(broadcast_msg.encode(self._msg_encoder, session_id, sender, opaque_id),
+                        key=key, timeout=timeout)
+
+    def send_frame(self, frame, key=None, timeout=30):
+        """
+        send a pre-encoded text frame
+        :param frame: str message already encoded by msg_encoder
+        :param key: droppable key of the message (see droppable_key()), None means the message cannot be dropped
+        :param timeout: the same as send_message()
         :return:
         """
         if self.server_terminated:
             raise Exception('Already closed: {0}'.format(self))
         if self._pingpong_trigger:
             self._last_active_ts = get_monotonic_time()
+        if self._send_queue_size:
+            self._enqueue_frame(frame, key)
+            return
         with gevent.Timeout(seconds=timeout):
-            self.send(self._msg_encoder.encode(message), binary=False)
-        #log.debug("Sent message to {0}: {1}".format(self, self._msg_encoder.encode(message)))
+            self.send(frame, binary=False)
+
+    @property
+    def msg_encoder(self):
+        return self._msg_encoder
+
+    def queue_depth(self):
+        return len(self._send_queue)
+
+    def _enqueue_frame(self, frame, key=None):
+        depth = len(self._send_queue)
+        if depth >= self._send_queue_hwm:
+            now = get_monotonic_time()
+            if not self._congested_ts:
+                self._congested_ts = now
+            elif self._slow_consumer_expired(now):
+                self._evict_slow_consumer()
+                return
+            if key is not None:
+                if self._drop_policy == 'drop':
+                    self.dropped += 1
+                    if self._stats is not None:
+                        self._stats['dropped'] += 1
+                    return
+                elif self._drop_policy == 'coalesce':
+                    entry = self._coalesce_entries.get(key)
+                    if entry is not None:
+                        entry[1] = frame
+                        self.coalesced += 1
+                        if self._stats is not None:
+                            self._stats['coalesced'] += 1
+                        return
+            if depth >= self._send_queue_size:
+                self._evict('send queue overflow ({} messages)'.format(depth))
+                return
+
+        entry = [key, frame]
+        self._send_queue.append(entry)
+        if key is not None:
+            self._coalesce_entries[key] = entry
+        if depth + 1 > self.max_queue_depth:
+            self.max_queue_depth = depth + 1
+
+        if self._send_greenlet is None:
+            self._send_greenlet = gevent.spawn(self._send_routine)
+        self._send_queue_event.set()
+
+    def _slow_consumer_expired(self, now):
+        return self._slow_consumer_timeout and self._congested_ts and \
+            now - self._congested_ts >= self._slow_consumer_timeout
+
+    def _evict_slow_consumer(self):
+        self._evict('send queue stays above high watermark ({}) for {} secs'.format(
+            self._send_queue_hwm, self._slow_consumer_timeout))
+
+    def _evict(self, reason):
+        """ close the connection as a slow consumer, the queued and the following messages are discarded
+        like on a closed connection """
+        log.warning('Evict the slow consumer {}: {}'.format(self, reason))
+        if self._stats is not None:
+            self._stats['evicted'] += 1
+        self._send_closed = True
+        self._send_queue.clear()
+        self._coalesce_entries.clear()
+        self._send_queue_event.set()
+        self.server_terminated = True
+        # shutdown the socket directly, because a close frame cannot be sent to the stalled peer
+        self._shutdown_socket()
+
+    def _shutdown_socket(self):
+        # the reader greenlet would get EOF and close the connection
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass
+
+    def _send_routine(self):
+        while not self._send_closed:
+            if not self._send_queue:
+                self._send_queue_event.clear()
+                self._send_queue_event.wait()
+                continue
+            entry = self._send_queue.popleft()
+            key, frame = entry
+            if key is not None and self._coalesce_entries.get(key) is entry:
+                del self._coalesce_entries[key]
+            if self._congested_ts and len(self._send_queue) <= self._send_queue_lwm:
+                self._congested_ts = 0
+            # the congestion is also checked here, as a congested connection may get no new messages
+            timeout = self._send_timeout
+            if self._congested_ts and self._slow_consumer_timeout:
+                remaining = self._congested_ts + self._slow_consumer_timeout - get_monotonic_time()
+                if remaining <= 0:
+                    self._evict_slow_consumer()
+                    break
+                timeout = min(timeout, remaining)
+            try:
+                with gevent.Timeout(seconds=timeout):
+                    self.send(frame, binary=False)
+            except (Exception, gevent.Timeout) as e:
+                if not self._send_closed:
+                    if self._slow_consumer_expired(get_monotonic_time()):
+                        self._evict_slow_consumer()
+                    else:
+                        log.error('Fail to send message on {}: {}'.format(self, e))
+                        self._send_closed = True
+                        self._send_queue.clear()
+                        self._coalesce_entries.clear()
+                        self._shutdown_socket()
+                break
+        self._send_greenlet = None
 
     # transport session interface methods
     def session_created(self, session_id=""):
@@ -134,63 +416,118 @@ class WSServerConn(WebSocket):
     def session_claimed(self, session_id=""):
         pass
 
-    def _on_recv_msg_cbk_greenlet_exception(self, g):
-        log.error('Failed to handle received msg on {0}: {1}'.format(self, g.exception))
+    def _on_recv_msg_cbk_exception(self, exception):
+        log.error('Failed to handle received msg on {0}: {1}'.format(self, exception))
         self.close()
 
-    def _pingpong_check_routine(self):
-        while not self.server_terminated:
-            gevent.sleep(1)
-            if self.server_terminated:
-                break
-            now = get_monotonic_time()
+    def _pingpong_check(self):
+        # run by the shared timer service, only re-scheduled at the next possible deadline,
+        # so the activities just update the timestamp
+        if self.server_terminated:
+            return
+        now = get_monotonic_time()
+        if self._ping_ts:
             # check pingpong timeout
-            if self._ping_ts:
-                if now - self._ping_ts > self._pingpong_timeout:
-                    log.debug('Close ws connection ({}) because of no pong'. format(self))
-                    self.close()
-                    break
+            remaining = self._ping_ts + self._pingpong_timeout - now
+            if remaining < 0:
+                log.debug('Close ws connection ({}) because of no pong'. format(self))
+                gevent.spawn(self.close)
+                return
+        else:
             # send ping if idle
-            if self._last_active_ts and now - self._last_active_ts >= self._pingpong_trigger:
-                try:
-                    self.ping('')
-                    self._last_active_ts = self._ping_ts = get_monotonic_time()
-                except Exception as e:
-                    log.error('Fail to send ping on {}: {}'.format(self, str(e)))
-                    self.close()
-                    break
+            remaining = self._last_active_ts + self._pingpong_trigger - now
+            if remaining <= 0:
+                self._last_active_ts = self._ping_ts = now
+                gevent.spawn(self._send_ping)
+                remaining = self._pingpong_timeout
+        get_timer_service().call_later(self, remaining, self._pingpong_check)
+
+    def _send_ping(self):
+        try:
+            self.ping('')
+        except Exception as e:
+            log.error('Fail to send ping on {}: {}'.format(self, str(e)))
+            self.close()
+
+
+def _create_reuse_port_listener(listen, backlog=1024):
+    family, address = parse_address(listen)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(address)
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
 
 
 class WSServer(object):
 
-    def __init__(self, listen, request_handler, msg_handler_pool_size=1024, indent='indented',
+    def __init__(self, listen, request_handler, msg_handler_pool_size=1024, indent='indented', json_codec='json',
+                 session_concurrency=1, session_queue_size=64,
                  pingpong_trigger=0, pingpong_timeout=0,
-                 keyfile=None, certfile=None):
+                 send_queue_size=0, send_queue_high_watermark=0, send_queue_low_watermark=0,
+                 send_queue_drop_policy='none', slow_consumer_timeout=0,
+                 deflate=False, deflate_window_bits=15, deflate_context_takeover=True, deflate_min_size=256,
+                 reuse_port=False, keyfile=None, certfile=None):
         """
         :param listen: string ip:port
         :param request_handler: instance of januscloud.proxy.core.request:RequestHandler
-        :param msg_handler_pool_size:
+        :param msg_handler_pool_size: max number of the greenlets handling the incoming requests, 0 means not limited
+        :param indent: json indent mode of the messages, 'indented', 'plain' or 'compact'
+        :param json_codec: json codec to encode / decode the messages, 'auto', 'json', 'orjson' or 'ujson'
+        :param session_concurrency: max number of the requests of a session handled at the same time,
+                                    the requests of a session are handled in order if it's 1
+        :param session_queue_size: max number of the pending requests of a session, the requests beyond
+                                   are rejected
+        :param send_queue_size: max messages in the outbound queue of each connection, 0 means
+                                sending synchronously without queue
+        :param send_queue_high_watermark: queue depth above which droppable events are dropped or coalesced
+        :param send_queue_low_watermark: queue depth below which the connection is no longer congested
+        :param send_queue_drop_policy: how to handle droppable events above the high watermark,
+                                       'none', 'drop' or 'coalesce'
+        :param slow_consumer_timeout: evict the connection which stays above the high watermark for so many
+                                      seconds, 0 means only evict it when the queue overflows
+        :param deflate: whether to accept permessage-deflate extension offered by the clients
+        :param deflate_window_bits: max LZ77 window bits (9 - 15) of the compression, for both sides
+        :param deflate_context_takeover: False means the compression context is reset for each message,
+                                         which saves memory at the cost of the compression ratio
+        :param deflate_min_size: the messages smaller than this are not compressed
+        :param reuse_port: listen with SO_REUSEPORT, so that many processes can listen on the same address
         :param keyfile:
         :param certfile:
         """
-        if msg_handler_pool_size == 0:
-            msg_handler_pool_size = None
-
-        self._msg_handler_pool = Pool(size=msg_handler_pool_size)
+        self._conns = set()
+        self._stats = {
+            'dropped': 0,
+            'coalesced': 0,
+            'evicted': 0,
+            'rejected': 0,
+        }
+
+        self._msg_dispatcher = FairDispatcher('ws_request', max_workers=msg_handler_pool_size,
+                                              key_concurrency=session_concurrency,
+                                              max_key_queue=session_queue_size)
         self._request_handler = request_handler
         self._listen = listen
+        app = WSServerApplication(protocols=['janus-protocol'], handler_cls=WSServerConn,
+                                  deflate=deflate, deflate_window_bits=deflate_window_bits,
+                                  deflate_context_takeover=deflate_context_takeover)
+        listener = self._listen
+        if reuse_port:
+            listener = _create_reuse_port_listener(self._listen)
         if keyfile or certfile:
             self._server = WSGIServer(
-                self._listen,
-                WebSocketWSGIApplication(protocols=['janus-protocol'], handler_cls=WSServerConn),
+                listener,
+                app,
                 log=logging.getLogger('websocket server'),
                 keyfile=keyfile,
                 certfile=certfile
             )
         else:
             self._server = WSGIServer(
-                self._listen,
-                WebSocketWSGIApplication(protocols=['janus-protocol'], handler_cls=WSServerConn),
+                listener,
+                app,
                 log=logging.getLogger('websocket server'),
             )
         self._server.set_environ(
@@ -198,8 +535,17 @@ class WSServer(object):
                 'app.recv_msg_cbk': self._async_incoming_msg_handler,
                 'app.closed_cbk': self._request_handler.transport_gone,
                 'json_indent': indent,
+                'json_codec': json_codec,
                 'pingpong_trigger': pingpong_trigger,
-                'pingpong_timeout': pingpong_timeout
+                'pingpong_timeout': pingpong_timeout,
+                'send_queue_size': send_queue_size,
+                'send_queue_high_watermark': send_queue_high_watermark,
+                'send_queue_low_watermark': send_queue_low_watermark,
+                'send_queue_drop_policy': send_queue_drop_policy,
+                'slow_consumer_timeout': slow_consumer_timeout,
+                'deflate_min_size': deflate_min_size,
+                'app.stats': self._stats,
+                'app.conns': self._conns,
             }
         )
 
@@ -210,17 +556,85 @@ class WSServer(object):
     def stop(self):
         self._server.stop()
 
+    @property
+    def listen(self):
+        return self._listen
+
+    def get_stats(self):
+        """ statistics of the connections on this server """
+        queue_depths = [conn.queue_depth() for conn in self._conns]
+        stats = {
+            'listen': self._listen,
+            'connections': len(self._conns),
+            'queued_messages': sum(queue_depths),
+            'max_queue_depth': max(queue_depths, default=0),
+            'request_dispatcher': self._msg_dispatcher.get_stats(),
+            'deflate': self._get_deflate_stats(),
+        }
+        stats.update(self._stats)
+        return stats
+
+    def get_conn_stats(self):
+        """ statistics of each connection on this server """
+        return [{
+            'peer': '{}:{}'.format(*conn.peer_address[:2]) if conn.peer_address else '',
+            'queue_depth': conn.queue_depth(),
+            'dropped': conn.dropped,
+            'coalesced': conn.coalesced,
+            'deflate': conn.deflate_stats(),
+        } for conn in self._conns]
+
+    def _get_deflate_stats(self):
+        total = {
+            'connections': 0,
+            'raw_bytes_out': 0,
+            'wire_bytes_out': 0,
+            'compress_ms': 0,
+            'raw_bytes_in': 0,
+            'wire_bytes_in': 0,
+            'decompress_ms': 0,
+        }
+        for conn in self._conns:
+            conn_stats = conn.deflate_stats()
+            if conn_stats is None:
+                continue
+            total['connections'] += 1
+            for key in ('raw_bytes_out', 'wire_bytes_out', 'compress_ms',
+                        'raw_bytes_in', 'wire_bytes_in', 'decompress_ms'):
+                total[key] += conn_stats[key]
+        total['ratio_out'] = round(total['wire_bytes_out'] / total['raw_bytes_out'], 3) \
+            if total['raw_bytes_out'] else 1.0
+        total['ratio_in'] = round(total['wire_bytes_in'] / total['raw_bytes_in'], 3) \
+            if total['raw_bytes_in'] else 1.0
+        return total
+
     def _async_incoming_msg_handler(self, transport_session, message, exception_handler):
-        greenlet = Greenlet(
-            self._incoming_msg_handler,
-            transport_session,
-            message,
-        )
-        greenlet.link_exception(exception_handler)
-        self._msg_handler_pool.start(
-            greenlet,
-            blocking=True
-        )
+        # requests of the same session are queued in order, the requests without session
+        # (create, info...) are queued by the connection
+        session_id, transaction = 0, None
+        if isinstance(message, dict):
+            session_id, transaction = message.get('session_id', 0), message.get('transaction')
+            if not isinstance(session_id, int):
+                session_id = 0      # invalid session id would be rejected by the request handler
+        if not self._msg_dispatcher.dispatch(session_id or transport_session, self._incoming_msg_task,
+                                             transport_session, message, exception_handler):
+            self._stats['rejected'] += 1
+            try:
+                transport_session.send_message(error_to_janus_msg(
+                    session_id,
+                    transaction,
+                    JanusCloudError('Too many pending requests for session {}'.format(session_id),
+                                    JANUS_ERROR_SERVICE_UNAVAILABLE)))
+            except Exception as e:
+                log.debug('Failed to reject the request on {}: {}'.format(transport_session, e))
+
+    def _incoming_msg_task(self, transport_session, message, exception_handler):
+        if transport_session.server_terminated:
+            return
+        try:
+            self._incoming_msg_handler(transport_session, message)
+        except Exception as e:
+            exception_handler(e)
 
     def _incoming_msg_handler(self, transport_session, message):
         if self._request_handler:
@@ -234,12 +648,21 @@ class WSServer(object):
 class WSClient(WebSocketClient):
 
     APP_FACTORY = None
-    DEFAULT_ENCODER = json.JSONEncoder()
-    DEFAULT_DECODER = json.JSONDecoder()
+    DEFAULT_ENCODER = get_json_codec('auto', 'compact')
+    DEFAULT_DECODER = DEFAULT_ENCODER
     DEFAULT_MSG_HANDLE_THREAD_POOL_SIZE = 8
 
-    def __init__(self, url, recv_msg_cbk=None, close_cbk=None, protocols=None, msg_encoder=None, msg_decoder=None):
-        WebSocketClient.__init__(self, url, protocols=protocols)
+    def __init__(self, url, recv_msg_cbk=None, close_cbk=None, protocols=None, msg_encoder=None, msg_decoder=None,
+                 deflate=False, deflate_min_size=256):
+        """
+        :param deflate: whether to offer permessage-deflate extension to the server
+        :param deflate_min_size: the messages smaller than this are not compressed
+        """
+        self._deflate = None
+        self._deflate_offered = deflate
+        self._deflate_min_size = deflate_min_size
+        headers = [('Sec-WebSocket-Extensions', make_deflate_offer())] if deflate else None
+        WebSocketClient.__init__(self, url, protocols=protocols, headers=headers)
         self._msg_encoder = msg_encoder or self.DEFAULT_ENCODER
         self._msg_decoder = msg_decoder or self.DEFAULT_DECODER
         self._recv_msg_cbk = recv_msg_cbk
@@ -257,6 +680,27 @@ class WSClient(WebSocketClient):
         with self._write_lock:
             return super()._write(b)
 
+    def process_handshake_header(self, headers):
+        protocols, extensions = super().process_handshake_header(headers)
+        extension = get_agreed_extension(extensions) if self._deflate_offered else None
+        if extension:
+            self._deflate = PerMessageDeflate(extension, is_server=False, min_size=self._deflate_min_size)
+            self.reading_buffer_size = PerMessageDeflate.READING_SIZE
+        return protocols, extensions
+
+    def send(self, payload, binary=False):
+        if self._deflate is None:
+            return super().send(payload, binary)
+        _deflate_send(self, payload, binary)
+
+    def process(self, data):
+        if self._deflate is None or not data:
+            return super().process(data)
+        return _deflate_process(self, data)
+
+    def deflate_stats(self):
+        return self._deflate.get_stats() if self._deflate else None
+
     def received_message(self, message):
         if message.is_text:
             # log.debug('Received message from {0}: {1}'.format(self, message))
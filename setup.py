@@ -63,6 +63,10 @@ setup(name='janus-cloud',
       ],
       zip_safe=False,
       install_requires=requires,
+      extras_require={
+          'orjson': ['orjson'],
+          'ujson': ['ujson'],
+      },
       tests_require=requires,
       entry_points="""
       [console_scripts]